@@ -1,4 +1,7 @@
+from collections import defaultdict
+from contextlib import contextmanager
 import logging
+import threading
 import time
 import re
 import os
@@ -119,6 +122,66 @@ class PersistentRunsDBConnection:
                     time.sleep(10)
 
 
+class MonaryClientPool:
+    """Process-wide pool of long-lived monary clients, keyed by (host, uri, database_name).
+    A monary client should not be used by several threads at once, so clients are handed out one thread at a time
+    and returned to the pool after use. New clients are only made if all clients for a key are in use.
+    Also keeps track of the time spent making connections and running queries.
+    """
+
+    def __init__(self):
+        self.log = logging.getLogger(self.__class__.__name__)
+        self.lock = threading.Lock()
+        self.free_clients = defaultdict(list)
+        self.n_clients = 0
+        self.time_spent = defaultdict(float)
+
+    @contextmanager
+    def client(self, client_maker_config, database_name, uri, host):
+        """Context manager giving a monary client for host, uri, database_name (see ClientMaker.get_client)"""
+        key = (host, uri, database_name)
+        with self.lock:
+            client = self.free_clients[key].pop() if len(self.free_clients[key]) else None
+
+        if client is None:
+            t0 = time.time()
+            client = ClientMaker(client_maker_config).get_client(database_name=database_name,
+                                                                 uri=uri,
+                                                                 host=host,
+                                                                 monary=True)
+            self.add_time('connection', time.time() - t0)
+            with self.lock:
+                self.n_clients += 1
+            self.log.debug("Made new monary client for %s (%d clients in pool)" % (host, self.n_clients))
+
+        try:
+            yield client
+        except Exception:
+            # Don't reuse a client which had some trouble
+            with self.lock:
+                self.n_clients -= 1
+            client.close()
+            raise
+
+        with self.lock:
+            self.free_clients[key].append(client)
+
+    def add_time(self, what, seconds):
+        with self.lock:
+            self.time_spent[what] += seconds
+
+    def timing_summary(self):
+        return ', '.join(['%0.1f sec on %s' % (v, k) for k, v in sorted(self.time_spent.items())])
+
+    def close_all(self):
+        with self.lock:
+            for clients in self.free_clients.values():
+                for client in clients:
+                    client.close()
+            self.n_clients -= sum([len(clients) for clients in self.free_clients.values()])
+            self.free_clients.clear()
+
+
 def parse_passwordless_uri(uri):
     """Return host, port, database_name"""
     uri_pattern = r'mongodb://([^:]+):(\d+)/(\w+)'
@@ -13,7 +13,7 @@ from tqdm import tqdm                   # Progress bar
 import pax      # Needed for pax.__version__
 from pax.configuration import load_configuration
 from pax.exceptions import InvalidConfigurationError
-from pax import simulation, utils
+from pax import simulation, utils, data_model, retention
 
 if six.PY2:
     import imp
@@ -62,6 +62,7 @@ class Processor:
 
         pc = self.config['pax']
         self.log = setup_logging(pc.get('logging_level'))
+        data_model.set_validation(pc.get('validate_datastructure', True))
         self.log.info("This is PAX version %s, running with configuration for %s." % (
             pax.__version__, self.config['DEFAULT'].get('tpc_name', 'UNSPECIFIED TPC NAME')))
 
@@ -179,6 +180,11 @@ class Processor:
             self.action_plugins = []
             self.log.debug("No action plugins specified: this will be a pretty boring processing run...")
 
+        # Release low-level data of large events as soon as no plugin needs it anymore, see pax.retention
+        self.retention_policy = retention.RetentionPolicy(
+            self.action_plugins,
+            budget=self.config['DEFAULT'].get('low_level_data_budget', float('inf')))
+
         self.timer = utils.Timer()
 
         # Sometimes the config tells us to start running immediately (e.g. if fetching from a queue
@@ -274,7 +280,9 @@ class Processor:
         for j, plugin in enumerate(self.action_plugins):
             self.log.debug("%s (step %d/%d)" % (plugin.__class__.__name__, j, total_plugins))
             event = plugin.process_event(event)
+            self.retention_policy.after_plugin(j, event)
             plugin.total_time_taken += self.timer.punch()
+        self.retention_policy.after_event(event)
 
         # Uncomment to diagnose memory leaks
         # gc.collect()  # don't care about stuff that would be garbage collected properly
@@ -370,6 +378,7 @@ class Processor:
                                    'n/a',
                                    round(total_time / 1000, 1)])
         self.log.info("Timing report:\n" + str(timing_report))
+        self.retention_policy.report()
 
     def shutdown(self):
         """Call shutdown on all plugins"""
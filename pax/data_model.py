@@ -12,6 +12,21 @@ from pax.utils import Memoize
 from pax.plugins.io import strax_functions
 
 
+# Whether StrictModel checks the types of attributes on assignment. See set_validation.
+validation_enabled = True
+
+# Field tables by class, see Model.get_field_table
+field_tables = {}
+
+
+def set_validation(enabled):
+    """Turn StrictModel's type and dtype checks on attribute assignment on or off (for all classes).
+    Turning them off makes attribute assignment much faster, but mistakes will only show up as weird output.
+    """
+    global validation_enabled
+    validation_enabled = bool(enabled)
+
+
 class Model(object):
     """Data modelling base class -- use for subclassing.
     Features:
@@ -42,8 +57,13 @@ class Model(object):
 
         # Initialize all attributes from kwargs and kwargs_dict
         kwargs.update(kwargs_dict or {})
+        field_table = self.get_field_table()
         for k, v in kwargs.items():
-            if k in list_field_info:
+            field = field_table.get(k)
+            if field is not None and field[0] is type(v) and field[0] not in (list, np.ndarray):
+                # Plain value of the right type: no conversion needed
+                setattr(self, k, v)
+            elif k in list_field_info:
                 # User gave a value to initialize a list field. Hopefully an iterable!
                 # Let's check if the types are correct
                 desired_type = list_field_info[k]
@@ -98,6 +118,29 @@ class Model(object):
                 list_field_info[k] = v.element_type
         return list_field_info
 
+    @classmethod
+    def get_field_table(cls):
+        """Return dict with fieldname => (type, names of types which may be cast to it, numpy dtype or None)
+        for all user-specified fields in the class declaration. Collection fields have type list.
+        Built only once per class (kept in field_tables; not using Memoize, this is called on every assignment).
+        """
+        if cls in field_tables:
+            return field_tables[cls]
+        field_table = {}
+        for field_name, default_value in cls.__dict__.items():
+            if field_name.startswith('_') or callable(default_value) or \
+                    isinstance(default_value, (property, classmethod, staticmethod)):
+                continue
+            if isinstance(default_value, ListField):
+                field_table[field_name] = (list, frozenset(), None)
+                continue
+            field_type = type(default_value)
+            field_table[field_name] = (field_type,
+                                       frozenset(casting_allowed_for.get(field_type.__name__, [])),
+                                       default_value.dtype if field_type == np.ndarray else None)
+        field_tables[cls] = field_table
+        return field_table
+
     def __str__(self):
         return str(self.__dict__)
 
@@ -232,7 +275,43 @@ class StrictModel(Model):
     """
 
     def __setattr__(self, key, value):
+        if not validation_enabled:
+            object.__setattr__(self, key, value)
+            return
+
+        try:
+            field_type, cast_from, dtype = field_tables[self.__class__][key]
+        except KeyError:
+            if self.__class__ not in field_tables:
+                self.get_field_table()
+                self.__setattr__(key, value)
+            else:
+                # Not a field declared in this class (or nonexistent): check against the current value
+                self._check_and_setattr(key, value)
+            return
+
+        if type(value) is not field_type:
+            # Are we allowed to cast the type?
+            new_class_name = value.__class__.__name__
+            if new_class_name in cast_from:
+                value = field_type(value)
+            else:
+                raise TypeError('Attribute %s of class %s should be a %s, not a %s. Allowed other types: %s.'
+                                % (key,
+                                   self.__class__.__name__,
+                                   field_type.__name__,
+                                   new_class_name,
+                                   casting_allowed_for.get(field_type.__name__, '')))
+
+        # Check for attempted dtype change
+        if dtype is not None and value.dtype != dtype:
+            raise TypeError('Attribute %s of class %s should have numpy dtype %s, not %s' % (
+                key, self.__class__.__name__, dtype, value.dtype))
+
+        object.__setattr__(self, key, value)
 
+    def _check_and_setattr(self, key, value):
+        """Set attribute after checking value against the current value of the attribute"""
         # Get the old attr.
         # Will raise AttributeError if doesn't exists, which is what we want
         old_val = getattr(self, key)
@@ -802,24 +802,194 @@ class Event(StrictModel):
         The returned list is sorted DESCENDING (i.e. reversed!) by the key sort_key (default area)
         unless you pass reverse=False, then it is ascending (normal sort order).
         """
-        # Extract only peaks of a certain type
-        peaks = []
-        for peak in self.peaks:
-            if detector != 'all':
-                if peak.detector != detector:
-                    continue
-            if desired_type != 'all' and peak.type.lower() != desired_type:
-                continue
-            peaks.append(peak)
-
-        # Sort the peaks by your sort key
         if isinstance(sort_key, (str, bytes)):
             sort_key = [sort_key]
-        peaks = sorted(peaks,
-                       key=operator.attrgetter(*sort_key),
-                       reverse=reverse)
+        cache_key = ('sorted', desired_type, detector, tuple(sort_key), reverse)
+        cache = self._peak_cache()
+        if cache_key not in cache:
+            # Sort the peaks by your sort key
+            peaks = [self.peaks[i] for i in self.get_peak_indices_by_type(desired_type, detector)]
+            cache[cache_key] = sorted(peaks,
+                                      key=operator.attrgetter(*sort_key),
+                                      reverse=reverse)
+
+        # Return a copy, so the caller can modify the list without messing up the cache
+        return list(cache[cache_key])
+
+    def get_peak_indices_by_type(self, desired_type='all', detector='tpc'):
+        """Returns array of indices in event.peaks of the peaks
+          whose type is desired_type, and
+          who are in the detector specified by the 'detector' argument (unless detector='all')
+        in the order they appear in event.peaks.
+        """
+        cache_key = ('indices', desired_type, detector)
+        cache = self._peak_cache()
+        if cache_key not in cache:
+            # Extract only peaks of a certain type
+            cache[cache_key] = np.array([i for i, peak in enumerate(self.peaks)
+                                         if (detector == 'all' or peak.detector == detector) and
+                                         (desired_type == 'all' or peak.type.lower() == desired_type)],
+                                        dtype=np.int64)
+        return cache[cache_key]
+
+    def get_peak_index(self, peak):
+        """Returns index of peak in event.peaks. Raises ValueError if the peak is not in the event."""
+        cache = self._peak_cache()
+        if 'index_of' not in cache:
+            cache['index_of'] = {id(p): i for i, p in enumerate(self.peaks)}
+        try:
+            return cache['index_of'][id(peak)]
+        except KeyError:
+            raise ValueError("Peak is not in event.peaks")
+
+    def _peak_cache(self):
+        """Returns dictionary for caching peak lookups. It is emptied whenever event.peaks is replaced or changes
+        length, and by invalidate_peak_cache.
+        """
+        state = (id(self.peaks), len(self.peaks))
+        # The cache is not a field: keep it out of StrictModel's hands, so it never ends up in the output
+        cached_state, cache = self.__dict__.get('_peak_lookup_cache', (None, None))
+        if cached_state != state:
+            cache = {}
+            self.__dict__['_peak_lookup_cache'] = (state, cache)
+        return cache
+
+    def invalidate_peak_cache(self):
+        """Empty the cache of peak lookups (get_peaks_by_type, s1s, get_peak_index, get_peak_store, etc.).
+        Changes to the peaks themselves (e.g. setting a peak's type or area) or replacing peaks in event.peaks are
+        not detected: the processor calls this before and after each plugin, but if a plugin changes peaks and then
+        looks them up again, it must call this in between.
+        """
+        self.__dict__.pop('_peak_lookup_cache', None)
 
-        return peaks
+    def get_peak_store(self):
+        """Returns a :class:`pax.datastructure.PeakStore` of the peaks in this event.
+        It is built on demand and cached like other peak lookups (see invalidate_peak_cache).
+        """
+        cache = self._peak_cache()
+        if 'store' not in cache:
+            cache['store'] = PeakStore(self.peaks)
+        return cache['store']
+
+    def get_hitpattern_summary(self, pmts, pmt_locations):
+        """Returns dictionary of arrays summarizing the hitpattern of each peak in event.peaks in the channels pmts,
+        see PeakStore.hitpattern_summary. Like other peak lookups, this is cached (see invalidate_peak_cache),
+        so plugins looking at the same channels share the computation.
+        """
+        cache = self._peak_cache()
+        cache_key = ('hitpattern', tuple(pmts))
+        if cache_key not in cache:
+            cache[cache_key] = self.get_peak_store().hitpattern_summary(pmts, pmt_locations)
+        return cache[cache_key]
+
+    def __getstate__(self):
+        # Don't pickle the peak lookup cache: it is easy to rebuild, and the peak store would double the size
+        state = self.__dict__.copy()
+        state.pop('_peak_lookup_cache', None)
+        return state
+
+
+class PeakStore(object):
+    """Column table of the peaks of an event, for vectorized peak-level computations:
+      - scalars: structured array with one row per peak, containing all int, float and bool fields of Peak,
+        as well as type and detector.
+      - arrays: dict of field name => 2d array (n_peaks, field length), for numpy array fields which have the
+        same length for each peak (e.g. area_per_channel: n_peaks * n_channels).
+      - ragged: dict of field name => (1d array of the concatenated values, array of n_peaks + 1 offsets),
+        for numpy array fields whose length differs between peaks.
+    The hits and reconstructed_positions are not stored.
+
+    The store is a copy of the peaks' data: changes to the peaks are not seen in it, get a new store from the event
+    (see Event.invalidate_peak_cache).
+    """
+
+    def __init__(self, peaks):
+        self.n_peaks = n = len(peaks)
+        scalar_dtype = Peak.get_dtype()
+        self.scalar_fields = scalar_dtype.names
+        str_len = max([1] + [len(getattr(p, f)) for p in peaks for f in ('type', 'detector')])
+        self.scalars = np.zeros(n, dtype=scalar_dtype.descr + [('type', 'U%d' % str_len),
+                                                               ('detector', 'U%d' % str_len)])
+        for field_name in self.scalars.dtype.names:
+            self.scalars[field_name] = [getattr(p, field_name) for p in peaks]
+
+        self.arrays = {}
+        self.ragged = {}
+        for field_name, default_value in Peak().get_fields_data():
+            if not isinstance(default_value, np.ndarray) or default_value.dtype.names is not None:
+                # Not a numpy array field, or a structured array (hits)
+                continue
+            values = [getattr(p, field_name) for p in peaks]
+            lengths = np.array([len(v) for v in values], dtype=np.int64)
+            if n and np.all(lengths == lengths[0]):
+                self.arrays[field_name] = store = np.zeros((n, lengths[0]), dtype=default_value.dtype)
+                for i, v in enumerate(values):
+                    store[i] = v
+            else:
+                offsets = np.concatenate([[0], np.cumsum(lengths)])
+                store = np.zeros(offsets[-1], dtype=default_value.dtype)
+                for i, v in enumerate(values):
+                    store[offsets[i]:offsets[i + 1]] = v
+                self.ragged[field_name] = (store, offsets)
+
+    def __len__(self):
+        return self.n_peaks
+
+    def get_array(self, field_name, peak_i):
+        """Returns the value of numpy array field field_name of peak peak_i (a view into the store)"""
+        if field_name in self.arrays:
+            return self.arrays[field_name][peak_i]
+        store, offsets = self.ragged[field_name]
+        return store[offsets[peak_i]:offsets[peak_i + 1]]
+
+    def hitpattern_summary(self, pmts, pmt_locations):
+        """Returns dictionary of arrays with, for each peak, a summary of its area_per_channel in channels pmts:
+          area: total area
+          max_pmt: index in pmts of the channel with the largest area
+          mean_position: (n_peaks, 2) area-weighted mean of pmt_locations ((x, y) of each channel in pmts)
+          spread: area-weighted root mean square distance of pmt_locations to mean_position
+          empty: True if all channels have zero area
+        mean_position and spread are nan for peaks with zero area.
+        """
+        pmts = np.asarray(pmts, dtype=np.int64)
+        pmt_locations = np.asarray(pmt_locations, dtype=np.float64)
+        if 'area_per_channel' in self.arrays:
+            hitpatterns = self.arrays['area_per_channel'][:, pmts].astype(np.float64)
+        else:
+            hitpatterns = np.zeros((self.n_peaks, len(pmts)), dtype=np.float64)
+            for peak_i in range(self.n_peaks):
+                hitpatterns[peak_i] = self.get_array('area_per_channel', peak_i)[pmts]
+
+        area = hitpatterns.sum(axis=1)
+        if len(pmts):
+            max_pmt = np.argmax(hitpatterns, axis=1)
+        else:
+            max_pmt = np.zeros(self.n_peaks, dtype=np.int64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            # Weighted mean of the offsets from the pmt with the largest area, so that for peaks with all area in one
+            # channel the mean position is exactly that pmt's location, and the spread exactly 0.
+            reference = pmt_locations[max_pmt] if len(pmts) else np.zeros((self.n_peaks, 2))
+            offsets = pmt_locations[np.newaxis, :, :] - reference[:, np.newaxis, :]
+            mean_offset = np.sum(hitpatterns[:, :, np.newaxis] * offsets, axis=1) / area[:, np.newaxis]
+            mean_position = reference + mean_offset
+            # Weighted mean squared distance to the mean position: the centered second moment
+            square_distance = np.sum((offsets - mean_offset[:, np.newaxis, :]) ** 2, axis=2)
+            spread = np.sqrt(np.sum(hitpatterns * square_distance, axis=1) / area)
+        return dict(area=area,
+                    max_pmt=max_pmt,
+                    mean_position=mean_position,
+                    spread=spread,
+                    empty=np.all(hitpatterns == 0, axis=1))
+
+    def peak_view(self, peak_i):
+        """Returns a new :class:`pax.datastructure.Peak` with the data of peak peak_i in the store.
+        Its numpy array fields are views into the store; it has no hits or reconstructed positions.
+        """
+        kwargs = dict(zip(self.scalars.dtype.names, self.scalars[peak_i].tolist()))
+        for field_name in list(self.arrays.keys()) + list(self.ragged.keys()):
+            kwargs[field_name] = self.get_array(field_name, peak_i)
+        kwargs['reconstructed_positions'] = []
+        return Peak(do_it_fast=True, **kwargs)
 
 
 # An event proxy object which can hold arbitrary data
@@ -132,41 +132,63 @@ def extend_intervals(w, intervals, left_extension, right_extension):
 
 def smooth_lowess(y, x, frac=1.0/2.0):
     """
-    Smoothing using lowess
+    Smoothing using lowess (locally weighted linear regression)
     return y expectation at input x positions
+    x must be sorted in ascending order.
+    Only points within the neighborhood (frac * len(x), in units of x) of a point get a nonzero weight,
+    so this takes O(n * neighborhood) time and O(n) memory.
     """
     n = len(x)
     neighborhood = np.ceil(frac*n)
+    result = np.zeros(n, dtype=np.float64)
+    if n == 0:
+        return result
+    _smooth_lowess(np.asarray(y, dtype=np.float64), np.asarray(x, dtype=np.float64), float(neighborhood), result)
+    return result
 
-    # w_ij = (1-abs((x_j-x_i)/(neighborhood))**3)**3 if x_j IN the neighborhood of x_i
-    # w_ij = 0 if x_j in NOT IN the neighborhood of x_i
-    # Of corse w_ij is symmetric
-    w = np.clip(np.abs((x[:, None]-x[None, :])/neighborhood), 0.0, 1.0)
-    w = (1-w**3)**3
 
-    delta = np.ones(n)
-    # We use matrices to speed up calculation but memory costly
-    xmatrix = np.tile(x, n).reshape(n, n)  # x_*j
-    ymatrix = np.tile(y, n).reshape(n, n)  # y_*j
-
-    wmatrix = w * np.tile(delta, n).reshape(n, n)   # w_ij * delta_*j
-
-    # Here capital case X Y has nothing to do with lower case x y,
-
-    # Derived from linear regression in order to solve 'm' and 'k'
-    # Ya_i=m_i+k_i*Xa_i and Yb_i=m_i+k_i*Xb_i
-    Ya = np.sum(wmatrix * ymatrix, axis=1) / np.sum(wmatrix, axis=1)
-    Xa = np.sum(wmatrix * xmatrix, axis=1) / np.sum(wmatrix, axis=1)
-    Yb = np.sum(wmatrix * xmatrix * ymatrix, axis=1) / np.sum(wmatrix * xmatrix, axis=1)
-    Xb = np.sum(wmatrix * xmatrix * xmatrix, axis=1) / np.sum(wmatrix * xmatrix, axis=1)
-
-    yestimate = Ya + (Yb - Ya) / (Xb - Xa) * (x - Xa)
-    residuals = y - yestimate
-    s = np.median(np.abs(residuals))
-    delta = np.clip(residuals / (6.0 * s), -1, 1)
-    delta = (1 - delta ** 2) ** 2
-
-    return yestimate
+@numba.jit(numba.void(numba.float64[:], numba.float64[:], numba.float64, numba.float64[:]),
+           nopython=True)
+def _smooth_lowess(y, x, neighborhood, result):
+    """Fills result with the lowess estimate of y at each x. See smooth_lowess.
+    For point i:
+      w_ij = (1-abs((x_j-x_i)/(neighborhood))**3)**3 if x_j IN the neighborhood of x_i, else 0.
+    Fits y_j = m_i + k_i * x_j, in the form:
+      Ya_i = m_i + k_i * Xa_i, with Ya, Xa the w_ij-weighted means of y, x
+      Yb_i = m_i + k_i * Xb_i, with Yb, Xb the w_ij * x_j-weighted means of y, x
+    The window of points with nonzero weight slides along with i, since x is sorted.
+    """
+    n = len(x)
+    window_start = 0
+    window_end = 0      # Exclusive
+    for i in range(n):
+        # Move the window so it contains exactly the x_j with |x_j - x_i| < neighborhood
+        while window_start < n and (x[i] - x[window_start]) / neighborhood >= 1:
+            window_start += 1
+        if window_end < window_start:
+            window_end = window_start
+        while window_end < n and (x[window_end] - x[i]) / neighborhood < 1:
+            window_end += 1
+
+        sum_w = 0.0
+        sum_wx = 0.0
+        sum_wy = 0.0
+        sum_wxx = 0.0
+        sum_wxy = 0.0
+        for j in range(window_start, window_end):
+            d = abs((x[j] - x[i]) / neighborhood)
+            w = (1 - d**3)**3
+            sum_w += w
+            sum_wx += w * x[j]
+            sum_wy += w * y[j]
+            sum_wxx += w * x[j] * x[j]
+            sum_wxy += w * x[j] * y[j]
+
+        ya = sum_wy / sum_w
+        xa = sum_wx / sum_w
+        yb = sum_wxy / sum_wx
+        xb = sum_wxx / sum_wx
+        result[i] = ya + (yb - ya) / (xb - xa) * (x[i] - xa)
 
 
 def find_intervals_above_threshold(w, threshold, result_buffer):
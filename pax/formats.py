@@ -9,9 +9,12 @@ Please be careful when editing this file:
  - Do not use python3-specific syntax, this file should be importable by python2 applications.
    (but in a sense this applies to all of pax, we aim to support python 2 and 3)
 """
+import json
 import logging
+import operator
 import os
 import re
+import zlib
 
 import numpy as np
 
@@ -27,6 +30,17 @@ try:
 except ImportError:
     base_logger.warning("You don't have h5py -- if you use the hdf5 format, pax will crash!")
 
+# Optional fast compressors for the columnar format. zlib is always available as fallback.
+try:
+    import blosc
+except ImportError:
+    blosc = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
 
 class TableFormat(object):
     """Base class for bulk output formats
@@ -55,6 +69,14 @@ class TableFormat(object):
     def read_data(self, df_name, start, end):
         raise NotImplementedError
 
+    def iter_chunks(self, df_name, chunk_size=100000):
+        """Yield record arrays of at most chunk_size rows of df_name, in order.
+        Formats which can read partial tables will only hold one chunk in memory at a time.
+        """
+        n = self.n_in_data(df_name)
+        for start in range(0, n, chunk_size):
+            yield self.read_data(df_name, start, min(start + chunk_size, n))
+
     def write_data(self, data):
         raise NotImplementedError
 
@@ -86,6 +108,12 @@ class NumpyDump(TableFormat):
             end = self.n_in_data(df_name)
         return self.f[df_name][start:end]
 
+    def iter_chunks(self, df_name, chunk_size=100000):
+        # npz members can't be read partially, and are loaded again on every access: load once.
+        data = self.f[df_name]
+        for start in range(0, len(data), chunk_size):
+            yield data[start:start + chunk_size]
+
     @property
     def data_types_present(self):
         return list(self.f.keys())
@@ -149,7 +177,7 @@ class ROOTDump(TableFormat):
     This is """
     file_extension = 'root'
     supports_array_fields = True
-    supports_write_in_chunks = False
+    supports_write_in_chunks = True
     supports_read_back = True
 
     # Lookup dictionary for converting python numpy types to
@@ -183,6 +211,7 @@ class ROOTDump(TableFormat):
         TableFormat.__init__(self, *args, **kwargs)
 
     def open(self, name, mode):
+        self.mode = mode
         if mode == 'w':
             self.f = self.ROOT.TFile(name, "RECREATE")
             self.trees = {}
@@ -193,6 +222,11 @@ class ROOTDump(TableFormat):
             raise ValueError("Invalid mode")
 
     def close(self):
+        if self.mode == 'w':
+            # Write the trees only once: writing after every chunk would leave a new cycle of each tree in the file
+            self.log.debug("Writing out to TFile")
+            self.f.Write()
+            self.log.debug("Done writing")
         self.f.Close()
 
     def write_data(self, data):
@@ -237,13 +271,10 @@ class ROOTDump(TableFormat):
                 # Fill appends the actual data to the branches
                 self.trees[treename].Fill()
 
-        # Write to file
-        self.log.debug("Writing out to TFile")
-        self.f.Write()
-        self.log.debug("Done writing")
-
-    def read_data(self, df_name):
+    def read_data(self, df_name, start=0, end=None):
         self.log.warning("ROOT read support is experimental!")
+        if end is None:
+            end = self.n_in_data(df_name)
         tree = self.f.Get(df_name)
 
         # Read the branch names and types
@@ -267,10 +298,9 @@ class ROOTDump(TableFormat):
                 continue
 
         # Read the data into a numpy record array
-        n = self.n_in_data(df_name)
-        data = np.zeros(n, dtype=dt)
-        for i in range(self.n_in_data(df_name)):
-            tree.GetEntry(i)
+        data = np.zeros(end - start, dtype=dt)
+        for i in range(end - start):
+            tree.GetEntry(start + i)
             for bdata in dt:
                 value = getattr(tree, bdata[0])
                 if len(bdata) == 3:
@@ -291,6 +321,267 @@ class ROOTDump(TableFormat):
         return self.f.Get(df_name).GetEntries()
 
 
+##
+# Columnar format
+##
+
+def compress_column(data, codec, typesize=8):
+    """Compress bytes data with codec ('blosc', 'lz4' or 'zlib')"""
+    if codec == 'blosc':
+        return blosc.compress(data, typesize=typesize, cname='lz4')
+    elif codec == 'lz4':
+        return lz4.frame.compress(data)
+    elif codec == 'zlib':
+        return zlib.compress(data, 1)
+    raise ValueError("Unknown compression codec %s" % codec)
+
+
+def decompress_column(data, codec):
+    """Decompress bytes data compressed by compress_column with codec"""
+    if codec == 'blosc':
+        if blosc is None:
+            raise ImportError("This file was compressed with blosc, but you don't have blosc installed")
+        return blosc.decompress(data)
+    elif codec == 'lz4':
+        if lz4 is None:
+            raise ImportError("This file was compressed with lz4, but you don't have lz4 installed")
+        return lz4.frame.decompress(data)
+    elif codec == 'zlib':
+        return zlib.decompress(data)
+    raise ValueError("Unknown compression codec %s" % codec)
+
+
+def best_available_codec():
+    if blosc is not None:
+        return 'blosc'
+    if lz4 is not None:
+        return 'lz4'
+    return 'zlib'
+
+
+class ColumnarDump(TableFormat):
+    """Chunked columnar format, optimized for reading a few columns of very large tables
+
+    The output is a directory with, for each table, a data file <table>.bin and a metadata file <table>.json.
+    Every chunk written is split in row groups of at most row_group_size rows. Within a row group, each column is
+    compressed separately (with blosc, lz4 or zlib, whichever is available) and appended to the data file, so
+    writing never rewrites earlier data. For each row group the metadata stores the byte range of every column,
+    and the min and max of every scalar column (e.g. Event, area, type).
+
+    When reading, you can select columns (only these are decompressed) and pass a predicate, a list of
+    (column, operator, value) tuples, e.g. [('type', '==', 's2'), ('area', '>', 1000)], which are AND-ed.
+    Row groups whose statistics show no row can pass are skipped without reading any data. See select.
+    """
+    file_extension = 'DIRECTORY'
+    supports_append = True
+    supports_write_in_chunks = True
+    supports_array_fields = True
+    supports_read_back = True
+    row_group_size = 2**17
+
+    operators = {'==': operator.eq,
+                 '!=': operator.ne,
+                 '<': operator.lt,
+                 '<=': operator.le,
+                 '>': operator.gt,
+                 '>=': operator.ge}
+
+    def open(self, name, mode):
+        self.dirname = name
+        self.mode = mode
+        self.tables = {}
+        self.data_files = {}
+        if mode == 'r' and not os.path.isdir(name):
+            raise ValueError("No columnar data directory at %s" % name)
+        # Load the metadata of all tables already present (in write mode, this means we will append)
+        if os.path.isdir(name):
+            for fn in os.listdir(name):
+                if fn.endswith('.json'):
+                    with open(os.path.join(name, fn), mode='r') as f:
+                        self.tables[fn[:-len('.json')]] = json.load(f)
+
+    def close(self):
+        for df_name, f in self.data_files.items():
+            f.close()
+            if self.mode == 'w':
+                self._write_metadata(df_name)
+        self.data_files = {}
+
+    def _write_metadata(self, df_name):
+        with open(os.path.join(self.dirname, df_name + '.json'), mode='w') as f:
+            json.dump(self.tables[df_name], f)
+
+    def write_data(self, data):
+        for df_name, records in data.items():
+            if df_name not in self.tables:
+                self.tables[df_name] = {'dtype': [(name, records.dtype.fields[name][0].base.str,
+                                                   records.dtype.fields[name][0].shape)
+                                                  for name in records.dtype.names],
+                                        'codec': best_available_codec(),
+                                        'n_rows': 0,
+                                        'row_groups': []}
+            elif np.dtype(self._dtype(df_name)) != records.dtype:
+                if records.dtype.names != np.dtype(self._dtype(df_name)).names:
+                    raise ValueError("Attempt to append data with fields %s to table %s with fields %s" % (
+                        records.dtype.names, df_name, np.dtype(self._dtype(df_name)).names))
+                # Same fields, but e.g. different string length: convert to the dtype already in the file
+                records = records.astype(self._dtype(df_name))
+            if df_name not in self.data_files:
+                self.data_files[df_name] = open(os.path.join(self.dirname, df_name + '.bin'), mode='ab')
+            for start in range(0, len(records), self.row_group_size):
+                self._write_row_group(df_name, records[start:start + self.row_group_size])
+
+    def _write_row_group(self, df_name, records):
+        table = self.tables[df_name]
+        f = self.data_files[df_name]
+        f.seek(0, os.SEEK_END)
+        row_group = {'n_rows': len(records), 'columns': {}, 'stats': {}}
+        for column_name in records.dtype.names:
+            column = np.ascontiguousarray(records[column_name])
+            blob = compress_column(column.tobytes(), table['codec'], typesize=column.dtype.itemsize)
+            row_group['columns'][column_name] = (f.tell(), len(blob))
+            f.write(blob)
+            if len(column) and len(column.shape) == 1 and column.dtype.kind in 'biufS':
+                if column.dtype.kind == 'S':
+                    # Older numpy versions can't do min / max on strings
+                    low, high = np.sort(column)[[0, -1]]
+                elif column.dtype.kind == 'f' and np.isnan(column).any():
+                    # NaN rows pass != predicates, and nothing else: keep track of them
+                    row_group.setdefault('has_nan', []).append(column_name)
+                    if np.isnan(column).all():
+                        continue
+                    low, high = np.nanmin(column), np.nanmax(column)
+                else:
+                    low, high = column.min(), column.max()
+                row_group['stats'][column_name] = self._to_json_value(low, high)
+        table['row_groups'].append(row_group)
+        table['n_rows'] += len(records)
+
+    @staticmethod
+    def _to_json_value(*values):
+        result = []
+        for x in values:
+            if isinstance(x, bytes):
+                x = x.decode('utf-8')
+            elif isinstance(x, np.generic):
+                x = x.item()
+            result.append(x)
+        return result
+
+    def _dtype(self, df_name):
+        # JSON turns the tuples in the dtype description into lists, numpy wants them back
+        return [(name, base) + ((tuple(shape),) if len(shape) else ())
+                for name, base, shape in self.tables[df_name]['dtype']]
+
+    def _read_row_group(self, df_name, row_group, columns):
+        """Return record array with columns from row_group of table df_name"""
+        table = self.tables[df_name]
+        full_dtype = np.dtype(self._dtype(df_name))
+        result = np.zeros(row_group['n_rows'], dtype=[(c,) + full_dtype.fields[c][:1] for c in columns])
+        f = self.data_files.get(df_name)
+        if f is None:
+            f = self.data_files[df_name] = open(os.path.join(self.dirname, df_name + '.bin'), mode='rb')
+        for column_name in columns:
+            offset, length = row_group['columns'][column_name]
+            f.seek(offset)
+            column_dtype = full_dtype.fields[column_name][0]
+            result[column_name] = np.frombuffer(decompress_column(f.read(length), table['codec']),
+                                                dtype=column_dtype.base).reshape((-1,) + column_dtype.shape)
+        return result
+
+    def _may_pass(self, row_group, predicate):
+        """Return False if row group statistics show no row in row_group can pass predicate"""
+        for column_name, op, value in predicate:
+            if column_name not in row_group['stats']:
+                continue
+            if isinstance(value, bytes):
+                value = value.decode('utf-8')
+            low, high = row_group['stats'][column_name]
+            if op == '==' and not low <= value <= high:
+                return False
+            if op == '!=' and low == high == value and column_name not in row_group.get('has_nan', []):
+                return False
+            if (op == '<' and not low < value) or (op == '<=' and not low <= value):
+                return False
+            if (op == '>' and not high > value) or (op == '>=' and not high >= value):
+                return False
+        return True
+
+    def _mask(self, records, predicate):
+        mask = np.ones(len(records), dtype=np.bool_)
+        for column_name, op, value in predicate:
+            if records.dtype.fields[column_name][0].kind == 'S' and not isinstance(value, bytes):
+                value = value.encode('utf-8')
+            mask &= self.operators[op](records[column_name], value)
+        return mask
+
+    def iter_row_groups(self, df_name, columns=None, predicate=None):
+        """Yield record arrays with columns (default all) of rows in df_name passing predicate,
+        one row group at a time. See class docstring for the predicate format.
+        """
+        if columns is None:
+            columns = list(np.dtype(self._dtype(df_name)).names)
+        predicate = predicate or []
+        for column_name, op, value in predicate:
+            if op not in self.operators:
+                raise ValueError("Unknown operator %s in predicate, use one of %s" % (op, list(self.operators)))
+        columns_to_read = columns + [c for c, _, _ in predicate if c not in columns]
+
+        for row_group in self.tables[df_name]['row_groups']:
+            if not self._may_pass(row_group, predicate):
+                continue
+            records = self._read_row_group(df_name, row_group, columns_to_read)
+            if predicate:
+                records = records[self._mask(records, predicate)]
+            if columns_to_read != columns:
+                records = self._select_columns(records, columns)
+            yield records
+
+    @staticmethod
+    def _select_columns(records, columns):
+        result = np.zeros(len(records), dtype=[(c,) + records.dtype.fields[c][:1] for c in columns])
+        for c in columns:
+            result[c] = records[c]
+        return result
+
+    def iter_chunks(self, df_name, chunk_size=100000):
+        for records in self.iter_row_groups(df_name):
+            for start in range(0, len(records), chunk_size):
+                yield records[start:start + chunk_size]
+
+    def select(self, df_name, columns=None, predicate=None):
+        """Return record array with columns (default all) of rows in df_name passing predicate"""
+        chunks = list(self.iter_row_groups(df_name, columns, predicate))
+        if not len(chunks):
+            return self._select_columns(np.zeros(0, dtype=self._dtype(df_name)),
+                                        columns or list(np.dtype(self._dtype(df_name)).names))
+        return np.concatenate(chunks)
+
+    def read_data(self, df_name, start=0, end=None, columns=None):
+        if end is None:
+            end = self.n_in_data(df_name)
+        if columns is None:
+            columns = list(np.dtype(self._dtype(df_name)).names)
+        chunks = []
+        row_group_start = 0
+        for row_group in self.tables[df_name]['row_groups']:
+            row_group_end = row_group_start + row_group['n_rows']
+            if row_group_end > start and row_group_start < end:
+                records = self._read_row_group(df_name, row_group, columns)
+                chunks.append(records[max(0, start - row_group_start):end - row_group_start])
+            row_group_start = row_group_end
+        if not len(chunks):
+            return self._select_columns(np.zeros(0, dtype=self._dtype(df_name)), columns)
+        return np.concatenate(chunks)
+
+    @property
+    def data_types_present(self):
+        return list(self.tables.keys())
+
+    def n_in_data(self, df_name):
+        return self.tables[df_name]['n_rows']
+
+
 ##
 # Pandas data formats
 ##
@@ -326,6 +617,20 @@ class PandasFormat(TableFormat):
 
 class PandasCSV(PandasFormat):
     pandas_format_key = 'csv'
+    supports_write_in_chunks = True
+
+    def open(self, name, mode):
+        self.filename = name
+        self.rows_written = {}
+
+    def write_pandas_dataframe(self, df_name, df):
+        # Append to the csv file if we already wrote a chunk of this dataframe,
+        # continuing the row index where the previous chunk ended.
+        path = os.path.join(self.filename, df_name + '.csv')
+        first_row = self.rows_written.get(df_name, 0)
+        df.index += first_row
+        df.to_csv(path, mode='a' if df_name in self.rows_written else 'w', header=df_name not in self.rows_written)
+        self.rows_written[df_name] = first_row + len(df)
 
 
 class PandasHTML(PandasFormat):
@@ -372,6 +677,12 @@ class PandasHDF5(PandasFormat):
                 return []
         return self.store[df_name][start:end+1].to_records(index=False)
 
+    def iter_chunks(self, df_name, chunk_size=100000):
+        # Select only the rows we need from the store, rather than loading the whole table for every chunk
+        n = self.n_in_data(df_name)
+        for start in range(0, n, chunk_size):
+            yield self.store.select(df_name, start=start, stop=min(start + chunk_size, n)).to_records(index=False)
+
     @property
     def data_types_present(self):
         return list(self.store.keys())
@@ -381,7 +692,8 @@ class PandasHDF5(PandasFormat):
             print(self.store)
             self.log.warning("No %s present in HDF5 file... you sure this is good data?" % df_name)
             return 0
-        return len(self.store[df_name])
+        # Get the number of rows without loading the table
+        return self.store.get_storer(df_name).nrows
 
 
 # List of data formats, pax / analysis code can import this
@@ -393,4 +705,5 @@ flat_data_formats = {
     'html':         PandasHTML,
     'json':         PandasJSON,
     'root':         ROOTDump,
+    'columnar':     ColumnarDump,
 }
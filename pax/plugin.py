@@ -75,6 +75,10 @@ class ProcessPlugin(BasePlugin):
     do_input_check = True
     do_output_check = True
 
+    # Kinds of low-level data (see pax.retention.LOW_LEVEL_DATA) this plugin uses.
+    # None means the plugin may use all of them: they are kept in memory until it has run.
+    uses_low_level_data = None
+
     def _pre_startup(self):
         # Give the logger another name, we need self.log for the adapter
         self._log = self.log
@@ -88,7 +92,13 @@ class ProcessPlugin(BasePlugin):
         if self.has_shut_down:
             raise RuntimeError("%s was asked to process an event, but it has already shut down!" % self.name)
 
+        # Peak lookups are cached only while a plugin runs: we don't know what plugins did to the peaks
+        # (see Event.invalidate_peak_cache)
+        if isinstance(event, Event):
+            event.invalidate_peak_cache()
         event = self._process_event(event)
+        if isinstance(event, Event):
+            event.invalidate_peak_cache()
         if self.do_output_check:
             if not isinstance(event, Event):
                 raise RuntimeError("%s returned a %s instead of an event." % (self.name, type(event)))
@@ -143,6 +153,7 @@ class OutputPlugin(ProcessPlugin):
 
 class ClusteringPlugin(TransformPlugin):
     """Base class for peak building / clustering plugins"""
+    uses_low_level_data = ('hits', 'peak_arrays')
 
     def transform_event(self, event):
         self.event = event
@@ -194,8 +205,10 @@ class PosRecPlugin(TransformPlugin):
      - have the same behaviour when giving up (add a position with x = y = nan)
      - don't get passed peaks without top pmts active (we add the nan-position automatically)
      - have self.pmts and self.pmt_locations available in the same way
+     - get passed the summary of each peak's hitpattern in self.pmts (see PeakStore.hitpattern_summary)
     """
     uses_only_top = True
+    uses_low_level_data = ('peak_arrays',)
 
     def _pre_startup(self):
         # List of integers of which PMTs to use, this algorithm uses the top pmt array to reconstruct
@@ -212,17 +225,21 @@ class PosRecPlugin(TransformPlugin):
         TransformPlugin._pre_startup(self)
 
     def transform_event(self, event):
+        # Summary of the hitpattern in our pmts for all peaks at once, shared with other plugins using the same pmts
+        hitpattern_summaries = event.get_hitpattern_summary(self.pmts, self.pmt_locations)
+
         for peak in event.get_peaks_by_type(detector='tpc'):
             # Do not act on lone hits
             if peak.type == 'lone_hit':
                 continue
+            peak_i = event.get_peak_index(peak)
+            hitpattern_summary = {key: values[peak_i] for key, values in hitpattern_summaries.items()}
 
             # If there are no contributing top PMTs, don't even try:
-            area_top = np.sum(peak.area_per_channel[self.pmts])
-            if area_top == 0:
+            if hitpattern_summary['area'] == 0:
                 pos_dict = None
             else:
-                pos_dict = self.reconstruct_position(peak)
+                pos_dict = self.reconstruct_position(peak, hitpattern_summary)
 
             # Parse the plugin's result
             if pos_dict is None:
@@ -238,8 +255,11 @@ class PosRecPlugin(TransformPlugin):
 
         return event
 
-    def reconstruct_position(self, peak):
-        """Return a position {'x': ..., 'y': ...) or (x, y) for the peak or None (if you can't)."""
+    def reconstruct_position(self, peak, hitpattern_summary):
+        """Return a position {'x': ..., 'y': ...) or (x, y) for the peak or None (if you can't).
+        hitpattern_summary is a dictionary with the summary of the peak's hitpattern in self.pmts: area, max_pmt,
+        mean_position, spread and empty (see PeakStore.hitpattern_summary).
+        """
         raise NotImplementedError
 
 
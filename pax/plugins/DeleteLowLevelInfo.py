@@ -1,5 +1,4 @@
-from pax import plugin
-import numpy as np
+from pax import plugin, retention
 
 
 class DeleteLowLevelInfo(plugin.TransformPlugin):
@@ -8,21 +7,18 @@ class DeleteLowLevelInfo(plugin.TransformPlugin):
       * hits for all but the main s1
       * pulses for all but the main s1
       * sum waveforms (but not the peak sum waveforms stored with each peak)
+    For high-energy events (more than shrink_data_threshold pulses, or low-level data taking more than
+    low_level_data_budget bytes), the per-channel arrays and sum waveforms of all but the largest peaks are emptied.
     """
+    uses_low_level_data = ('hits', 'peak_arrays')
 
     def transform_event(self, event):
 
-        # For high energy events, zero the data in expensive fields, except for the 5 largest S1s and S2s in the TPC
-        if event.n_pulses > self.config.get('shrink_data_threshold', float('inf')):
-            largest_indices = [event.peaks.index(x) for x in (event.s1s()[:5] + event.s2s()[:5])]
-            for i, p in enumerate(event.peaks):
-                if i in largest_indices:
-                    continue
-                p.sum_waveform *= 0
-                p.sum_waveform_top *= 0
-                p.area_per_channel *= 0
-                p.hits_per_channel *= 0
-                p.n_saturated_per_channel *= 0
+        # For high energy events, release the data in expensive fields, except for the 5 largest S1s and S2s in the TPC
+        budget = self.config.get('low_level_data_budget', float('inf'))
+        if event.n_pulses > self.config.get('shrink_data_threshold', float('inf')) or \
+                (budget < float('inf') and sum(retention.low_level_data_size(event).values()) > budget):
+            retention.release_peak_arrays(event, keep=retention.largest_peak_indices(event))
 
         if self.config.get('delete_sum_waveforms', True):
             event.sum_waveforms = []
@@ -33,21 +29,16 @@ class DeleteLowLevelInfo(plugin.TransformPlugin):
             pass
 
         elif delopt == 'not_for_s1s':
-            pulses_to_keep = []
-            for p in event.peaks:
-                if p.type == 's1':
-                    pulses_to_keep.extend(p.hits['found_in_pulse'].tolist())
-                else:
-                    p.hits = p.hits[:0]   # Set hits to an empty array
-            pulses_to_keep = np.unique(pulses_to_keep)
-            event.all_hits = event.all_hits[:0]
+            s1_indices = event.get_peak_indices_by_type('s1', detector='all')
+            pulses_to_keep = set()
+            for i in s1_indices:
+                pulses_to_keep.update(event.peaks[i].hits['found_in_pulse'].tolist())
+            retention.release_hits(event, keep=s1_indices)
             event.pulses = [p for i, p in enumerate(event.pulses) if i in pulses_to_keep]
 
         elif delopt == 'all':
-            event.all_hits = event.all_hits[:0]
+            retention.release_hits(event)
             event.pulses = []
-            for p in event.peaks:
-                p.hits = p.hits[:0]
 
         else:
             raise ValueError("Illegal delete_hits_and_pulses value %s" % delopt)
@@ -1,130 +1,216 @@
 import numpy as np
+import numba
 
 from pax import plugin, datastructure
 
-from pax.dsputils import find_intervals_above_threshold
-
 import matplotlib.pyplot as plt
 
 
 class SoftwareZLE(plugin.TransformPlugin):
     """Emulate the Zero-length encoding of the CAEN 1724 digitizer
-    Makes no attempt to emulate the 2-sample word logic, so some rare edge cases will be different
+    By default makes no attempt to emulate the 2-sample word logic, so some rare edge cases will be different:
+    regions to store are truncated to whole 2-sample words.
+    If two_sample_words is True, the data is instead considered in 2-sample words: a word is above threshold if
+    either of its samples is, and the before/after windows are rounded up to whole words.
+
+    All pulses in the event are zero-length encoded at once by zle_event.
 
     Uses a separate debug setting, as need to show plots
     """
     debug = False
-    zle_intervals_buffer = -1 * np.ones((50000, 2), dtype=np.int64)
+
+    def startup(self):
+        self.two_sample_words = self.config.get('two_sample_words', False)
+        self.samples_for_baseline = self.config.get('initial_baseline_samples', None)
+        self.max_intervals = self.config['max_intervals']
+        if self.max_intervals == float('inf'):
+            self.max_intervals = np.iinfo(np.int64).max
+
+        # Get the ZLE threshold for each channel
+        # Note a threshold of X digitizer bins actually means that the data acquisition
+        # triggers when the waveform becomes greater than X, i.e. X+1 or more (see #273)
+        # hence the + 1
+        special_thresholds = {int(ch): thr for ch, thr in self.config.get('special_thresholds', {}).items()}
+        n_channels = max([self.config['n_channels']] + [ch + 1 for ch in special_thresholds.keys()])
+        self.threshold_per_channel = np.ones(n_channels, dtype=np.float64) * (self.config['zle_threshold'] + 1)
+        for ch, thr in special_thresholds.items():
+            self.threshold_per_channel[ch] = thr + 1
 
     def transform_event(self, event):
+        pulses = event.pulses
+        if not len(pulses):
+            return event
+
+        pulse_left = np.array([p.left for p in pulses], dtype=np.int64)
+        if np.any(pulse_left % 2 != 0):
+            raise ValueError("Cannot ZLE in XED-compatible way "
+                             "if pulse starts at odd sample index (%d)" % pulse_left[pulse_left % 2 != 0][0])
+
+        # Concatenate the raw data of all pulses
+        pulse_lengths = np.array([len(p.raw_data) for p in pulses], dtype=np.int64)
+        pulse_start = np.zeros(len(pulses) + 1, dtype=np.int64)
+        np.cumsum(pulse_lengths, out=pulse_start[1:])
+        raw_data = np.concatenate([p.raw_data for p in pulses]).astype(np.int16, copy=False)
+
+        if self.samples_for_baseline is not None:
+            # This tries to do better than the digitizer: compute a baseline for each pulse (in zle_event)
+            baselines = np.zeros(len(pulses), dtype=np.float64)
+            samples_for_baseline = self.samples_for_baseline
+        else:
+            # This is how the digitizer does it (I think???)
+            # Subtract the reference baseline, invert
+            baselines = np.ones(len(pulses), dtype=np.float64) * self.config['digitizer_reference_baseline']
+            samples_for_baseline = -1
+
+        # Every region to encode contains at least one sample above threshold, and regions do not overlap,
+        # so this many regions can be found at most.
+        unit = 2 if self.two_sample_words else 1
+        before, after = self.config['samples_to_store_before'], self.config['samples_to_store_after']
+        window = 1 + -(-before // unit) + -(-after // unit)
+        result_buffer = np.zeros((int(np.sum(pulse_lengths // unit // window + 2)), 3), dtype=np.int64)
+
+        n_found = zle_event(raw_data, pulse_start, baselines,
+                            self.threshold_per_channel[np.array([p.channel for p in pulses], dtype=np.int64)],
+                            samples_for_baseline, before, after, int(self.max_intervals), self.two_sample_words,
+                            result_buffer)
+        regions = result_buffer[:n_found]
+
         new_pulses = []
-        zle_intervals_buffer = self.zle_intervals_buffer
-
-        for pulse_i, pulse in enumerate(event.pulses):
-            if self.debug:
-                print("Starting ZLE in pulse %d, channel %d" % (pulse_i, pulse.channel))
-            if pulse.left % 2 != 0:
-                raise ValueError("Cannot ZLE in XED-compatible way "
-                                 "if pulse starts at odd sample index (%d)" % pulse.left)
-
-            w = pulse.raw_data.copy()
-
-            samples_for_baseline = self.config.get('initial_baseline_samples', None)
-            if samples_for_baseline is not None:
-                # This tries to do better than the digitizer: compute a baseline for the pulse
-                bs = w[:min(len(w), samples_for_baseline)]
-                w = np.mean(bs) - w
-            else:
-                # This is how the digitizer does it (I think???)
-                # Subtract the reference baseline, invert
-                w = self.config['digitizer_reference_baseline'] - w
-
-            if self.debug:
-                plt.plot(w)
-
-            # Get the ZLE threshold
-            # Note a threshold of X digitizer bins actually means that the data acquisition
-            # triggers when the waveform becomes greater than X, i.e. X+1 or more (see #273)
-            # hence the + 1
-            if str(pulse.channel) in self.config.get('special_thresholds', {}):
-                threshold = self.config['special_thresholds'][str(pulse.channel)] + 1
-            else:
-                threshold = self.config['zle_threshold'] + 1
-
-            # Find intervals above ZLE threshold
-            n_itvs_found = find_intervals_above_threshold(w.astype(np.float64),
-                                                          threshold=threshold,
-                                                          result_buffer=zle_intervals_buffer,
-                                                          )
-
-            if n_itvs_found == self.config['max_intervals']:
-                # more than 5000 intervals - insane!!!
-                # Ignore intervals beyond this -- probably will go beyond 32 intervals to encode anyway
-                zle_intervals_buffer[-1, 1] = pulse.length - 1
-
-            if n_itvs_found > 0:
-                itvs_to_encode = zle_intervals_buffer[:n_itvs_found]
-
-                if self.debug:
-                    for l, r in itvs_to_encode:
-                        plt.axvspan(l, r, alpha=0.5, color='red')
-
-                # Find boundaries of regions to encode by subtracting before and after window
-                # This will introduce overlaps and out-of-pulse indices
-                itvs_to_encode[:, 0] -= self.config['samples_to_store_before']
-                itvs_to_encode[:, 1] += self.config['samples_to_store_after']
-
-                # Clip out-of-pulse indices
-                itvs_to_encode = np.clip(itvs_to_encode, 0, pulse.length - 1)
-
-                # Decide which intervals to encode: deal with overlaps here
-                itvs_encoded = 0
-                itv_i = 0
-                while itv_i <= len(itvs_to_encode) - 1:
-                    start = itvs_to_encode[itv_i, 0]
-
-                    if itvs_encoded >= self.config['max_intervals']:
-                        self.log.debug("ZLE breakdown in channel %d: all samples from %d onwards are stored" % (
-                            pulse.channel, zle_intervals_buffer[-1, 0]))
-                        stop = pulse.length - 1
-                        itv_i = len(itvs_to_encode) - 1     # Loop will end after this last pulse is appended
-                    else:
-                        stop = itvs_to_encode[itv_i, 1]
-                        # If next interval starts before this one ends, update stop and keep searching
-                        # If last interval reached, there is no itv_i + 1, thats why the condition has <, not <=
-                        while itv_i < len(itvs_to_encode) - 1:
-                            if itvs_to_encode[itv_i + 1, 0] <= stop:
-                                stop = itvs_to_encode[itv_i + 1, 1]
-                                itv_i += 1
-                            else:
-                                break
-
-                    # Truncate the interval to the nearest even start and odd stop index
-                    # We use truncation rather than extension to ensure data always exists
-                    # pulse.left is guaranteed to be even
-                    if start % 2 != 0:
-                        start += 1
-                    if stop % 2 != 1:
-                        stop -= 1
-                    assert (stop - start + 1) % 2 == 0
-
-                    if self.debug:
-                        plt.axvspan(start, stop, alpha=0.3, color='green')
-
-                    # Explicit casts necessary since we've disabled type checking for pulse class
-                    # for speed in event builder.
-                    # and otherwise numpy ints would get in and break e.g. BSON output.
-                    new_pulses.append(datastructure.Pulse(
-                        channel=int(pulse.channel),
-                        left=int(pulse.left+start),
-                        right=int(pulse.left+stop),
-                        raw_data=pulse.raw_data[start:stop + 1]
-                    ))
-                    itvs_encoded += 1
-                    itv_i += 1
-
-            if self.debug:
+        for pulse_i, start, stop in regions:
+            pulse = pulses[pulse_i]
+            # Explicit casts necessary since we've disabled type checking for pulse class
+            # for speed in event builder.
+            # and otherwise numpy ints would get in and break e.g. BSON output.
+            new_pulses.append(datastructure.Pulse(
+                channel=int(pulse.channel),
+                left=int(pulse.left + start),
+                right=int(pulse.left + stop),
+                raw_data=pulse.raw_data[start:stop + 1]
+            ))
+
+        if self.debug:
+            for pulse_i, pulse in enumerate(pulses):
+                print("ZLE of pulse %d, channel %d" % (pulse_i, pulse.channel))
+                plt.plot(baselines[pulse_i] - pulse.raw_data)
+                for _, start, stop in regions[regions[:, 0] == pulse_i]:
+                    plt.axvspan(start, stop, alpha=0.3, color='green')
                 plt.show()
 
         event.pulses = new_pulses
         return event
+
+
+@numba.jit(numba.int64(numba.int64[:, :], numba.int64, numba.int64, numba.int64, numba.int64, numba.int64),
+           nopython=True)
+def _store_region(result_buffer, n_found, pulse_i, start, stop, unit):
+    """Store region start-stop (inclusive, in units of samples or words) of pulse pulse_i in result_buffer
+    at index n_found. Returns new n_found. Regions without any whole word are not stored."""
+    if unit == 2:
+        start *= 2
+        stop = 2 * stop + 1
+    else:
+        # Truncate the interval to the nearest even start and odd stop index
+        # We use truncation rather than extension to ensure data always exists
+        # pulse.left is guaranteed to be even
+        if start % 2 != 0:
+            start += 1
+        if stop % 2 != 1:
+            stop -= 1
+        if start > stop:
+            # E.g. a single sample at an odd index: nothing left to store
+            return n_found
+    result_buffer[n_found, 0] = pulse_i
+    result_buffer[n_found, 1] = start
+    result_buffer[n_found, 2] = stop
+    return n_found + 1
+
+
+@numba.jit(numba.int64(numba.int16[:], numba.int64[:], numba.float64[:], numba.float64[:],
+                       numba.int64, numba.int64, numba.int64, numba.int64, numba.boolean, numba.int64[:, :]),
+           nopython=True)
+def zle_event(raw_data, pulse_start, baselines, thresholds,
+              samples_for_baseline, before, after, max_intervals, two_sample_words,
+              result_buffer):
+    """Find the regions of each pulse to store after zero-length encoding.
+    :param raw_data: raw data of all pulses concatenated. Pulse i is raw_data[pulse_start[i]:pulse_start[i+1]].
+    :param baselines: the waveform used for ZLE is baselines[i] - raw data of pulse i.
+                      If samples_for_baseline >= 0, the mean of the first samples_for_baseline samples of the pulse
+                      is written to baselines[i] and used instead.
+    :param thresholds: threshold for each pulse. Samples (or words) > threshold will be stored.
+    :param before, after: number of samples to store before and after samples above threshold
+    :param max_intervals: Maximum number of regions to store per pulse. If a pulse has more, all samples from
+                          the start of the last region onwards are stored.
+    :param two_sample_words: if True, find regions in 2-sample words. Otherwise, find regions in samples, and
+                             truncate them to whole words.
+    :param result_buffer: n*3 array, will be filled with (pulse index, first sample, last sample) of regions to
+                          store; samples are indices in the pulse, bounds are inclusive.
+    :returns: number of regions found
+    """
+    unit = 2 if two_sample_words else 1
+    before = (before + unit - 1) // unit
+    after = (after + unit - 1) // unit
+    n_found = 0
+
+    for pulse_i in range(len(pulse_start) - 1):
+        offset = pulse_start[pulse_i]
+        length = pulse_start[pulse_i + 1] - offset
+        if length == 0:
+            continue
+        n_units = length // unit
+        threshold = thresholds[pulse_i]
+
+        if samples_for_baseline >= 0:
+            n = min(length, samples_for_baseline)
+            baseline = 0.0
+            for i in range(n):
+                baseline += raw_data[offset + i]
+            baselines[pulse_i] = baseline / n if n > 0 else np.nan
+        baseline = baselines[pulse_i]
+
+        n_stored = 0            # Regions of this pulse stored so far
+        current_start = -1      # Bounds (in units) of region we're currently deciding about. -1 if no region yet.
+        current_stop = -1
+        itv_start = -1          # Start of the interval above threshold we're currently in. -1 if not in one.
+
+        for u in range(n_units + 1):
+            # Is this sample or word above threshold?
+            # We go one unit beyond the end of the pulse to close the last interval
+            above = False
+            if u < n_units:
+                for i in range(unit * u, unit * (u + 1)):
+                    if baseline - raw_data[offset + i] > threshold:
+                        above = True
+
+            if above and itv_start == -1:
+                itv_start = u
+                continue
+            if above or itv_start == -1:
+                continue
+
+            # Interval above threshold has just ended: extend it by the before and after window,
+            # clipping out-of-pulse indices
+            start = max(0, itv_start - before)
+            stop = min(n_units - 1, u - 1 + after)
+            itv_start = -1
+
+            if current_start != -1 and start <= current_stop:
+                # Overlaps with the current region, extend it
+                current_stop = stop
+                continue
+
+            if current_start != -1:
+                # Store the current region
+                n_found = _store_region(result_buffer, n_found, pulse_i, current_start, current_stop, unit)
+                n_stored += 1
+
+            current_start = start
+            current_stop = stop
+            if n_stored >= max_intervals:
+                # ZLE breakdown: store all samples from here onwards
+                current_stop = n_units - 1
+                break
+
+        if current_start != -1:
+            n_found = _store_region(result_buffer, n_found, pulse_i, current_start, current_stop, unit)
+
+    return n_found
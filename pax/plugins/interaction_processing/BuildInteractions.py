@@ -15,6 +15,8 @@ class BuildInteractions(plugin.TransformPlugin):
 
     xy_posrec_preference = ['algo1', 'algo2', ...]
     """
+    uses_low_level_data = ()
+
     def startup(self):
         if 'xy_posrec_preference' not in self.config:
             raise ValueError('Configuration for %s must contain xy_posrec_preference' % self.name)
@@ -37,8 +39,8 @@ class BuildInteractions(plugin.TransformPlugin):
                     continue
 
                 ia = Interaction()
-                ia.s1 = event.peaks.index(s1)
-                ia.s2 = event.peaks.index(s2)
+                ia.s1 = event.get_peak_index(s1)
+                ia.s2 = event.get_peak_index(s2)
                 ia.drift_time = dt
 
                 # Determine z position from drift time
@@ -67,6 +69,7 @@ class BasicInteractionProperties(plugin.TransformPlugin):
     """Compute basic properties of each interaction
     S1 and S2 x, y, z corrections, S1 hitpattern fit
     """
+    uses_low_level_data = ('peak_arrays',)
 
     def startup(self):
         self.s1_light_yield_map = self.processor.simulator.s1_light_yield_map
@@ -105,6 +105,94 @@ def binom_test(k, n, p):
     return min(1.0, pval)
 
 
+def bdtrc_array(k, n, p):
+    """Vectorized bdtrc: k, n and p are arrays of the same shape"""
+    dn = n - k
+    with np.errstate(all='ignore'):
+        result = np.where(p < .01,
+                          -np.expm1(dn * np.log1p(-p)),
+                          1.0 - np.exp(dn * np.log(1.0 - p)))
+        result = np.where(k == 0, result, betainc(k + 1, dn, p))
+    result[k == n] = 0.0
+    result[k < 0] = 1.0
+    return result
+
+
+def bdtr_array(k, n, p):
+    """Vectorized bdtr: k, n and p are arrays of the same shape"""
+    dn = n - k
+    with np.errstate(all='ignore'):
+        result = np.where(k == 0,
+                          np.exp(dn * np.log(1.0 - p)),
+                          betainc(dn, k + 1, 1.0 - p))
+    result[k == n] = 1.0
+    result[k < 0] = np.nan
+    return result
+
+
+def binom_test_array(k, n, p):
+    """Vectorized binom_test: returns array of p-values for arrays (or scalars) k, n and p.
+    Does exactly the same successive approximation as binom_test, for all elements at once.
+    """
+    k, n, p = [np.array(x, dtype=np.float64) for x in np.broadcast_arrays(k, n, p)]
+    k, n, p = k.ravel(), n.ravel(), p.ravel()
+    if np.any(n < k):
+        raise ValueError("n must be >= k")
+    if np.any((p > 1.0) | (p < 0.0)):
+        raise ValueError("p must be in range [0, 1]")
+    if np.any(k < 0):
+        raise ValueError("k must be >= 0")
+
+    with np.errstate(all='ignore'):
+        d = binom_pmf(k, n, p)
+        rerr = 1 + 1e-7
+        d = d * rerr
+        n_iter = np.maximum(np.round(np.log10(n)) + 1, 2)
+
+        below_mean = k < n * p
+        j_min = np.where(below_mean, k, 0)
+        j_max = np.where(below_mean, n, k)
+        # Above the mean, if the pmf at 0 is larger than at k already, j = 0
+        j_is_zero = ~below_mean & (binom_pmf(0, n, p) > d)
+        j_max[j_is_zero] = 0
+        n_iter[j_is_zero] = 0
+
+        for i in range(int(n_iter.max()) if len(n_iter) else 0):  # successive approximation loop
+            n_pts = 20 if i == 0 else 10
+            active = np.where(n_iter > i)[0]
+            # Same as np.linspace(j_min, j_max, n_pts, endpoint=True) for each element
+            step = (j_max[active] - j_min[active]) / (n_pts - 1)
+            j_range = np.arange(n_pts)[np.newaxis, :] * step[:, np.newaxis] + j_min[active][:, np.newaxis]
+            j_range[:, -1] = j_max[active]
+            y = binom_pmf(j_range, n[active][:, np.newaxis], p[active][:, np.newaxis])
+            y0, y1 = y[:, :-1], y[:, 1:]
+            da = d[active][:, np.newaxis]
+            found = np.where(below_mean[active][:, np.newaxis],
+                             (y0 >= da) & (da > y1),
+                             (y0 <= da) & (da < y1))
+            has_found = np.any(found, axis=1)
+            first_found = np.argmax(found, axis=1)
+            update = active[has_found]
+            first_found = first_found[has_found]
+            j_min[update] = j_range[has_found, first_found]
+            j_max[update] = j_range[has_found, first_found + 1]
+
+        j = np.maximum(np.minimum((j_min + j_max) / 2, n), 0)
+
+        one_sided = k * j == 0  # one is zero, means we do a one-sided test
+        pval = binom_sf_array(np.maximum(k, j), n, p)
+        pval[~one_sided] += binom_cdf_array(np.minimum(k, j), n, p)[~one_sided]
+    return np.minimum(1.0, pval)
+
+
+def binom_cdf_array(k, n, p):
+    return bdtr_array(k, n, p)
+
+
+def binom_sf_array(k, n, p):
+    return bdtrc_array(k, n, p)
+
+
 def s1_area_fraction_top_probability(aft_prob, area_tot, area_fraction_top,
                                      hits_tot, hits_fraction_top, low_pe_threshold=10,
                                      mode='test'):
@@ -129,21 +217,51 @@ def s1_area_fraction_top_probability(aft_prob, area_tot, area_fraction_top,
         return binom_test(size_top, size_tot, aft_prob)
 
 
+def s1_area_fraction_top_probabilities(aft_prob, area_tot, area_fraction_top,
+                                       hits_tot, hits_fraction_top, low_pe_threshold=10):
+    """Vectorized s1_area_fraction_top_probability (in 'test' mode): all arguments are arrays
+    """
+    aft_prob, area_tot, area_fraction_top, hits_tot, hits_fraction_top = [
+        np.asarray(x, dtype=np.float64) for x in (aft_prob, area_tot, area_fraction_top,
+                                                  hits_tot, hits_fraction_top)]
+
+    # below this in PE, transition to hits
+    s1_frac = np.minimum(area_tot / low_pe_threshold, 1)
+    hits_top = hits_tot * hits_fraction_top
+    s1_top = area_tot * area_fraction_top
+    low_pe = area_tot < low_pe_threshold
+    size_top = np.where(low_pe, hits_top * (1. - s1_frac) + s1_top * s1_frac, area_tot * area_fraction_top)
+    size_tot = np.where(low_pe, hits_tot * (1. - s1_frac) + area_tot * s1_frac, area_tot)
+
+    return binom_test_array(size_top, size_tot, aft_prob)
+
+
 class S1AreaFractionTopProbability(plugin.TransformPlugin):
     """Computes p-value for S1 area fraction top for each interaction
     """
+    uses_low_level_data = ()
 
     def startup(self):
         aftmap_filename = utils.data_file_name('XENON1T_s1_aft_xyz_20170808.json')
         self.aft_map = InterpolatingMap(aftmap_filename)
 
     def transform_event(self, event):
-        for ia in event.interactions:
-            s1 = event.peaks[ia.s1]
-
-            aft_prob = self.aft_map.get_value(ia.x, ia.y, ia.z)
-
-            ia.s1_area_fraction_top_probability = s1_area_fraction_top_probability(
-                aft_prob, s1.area, s1.area_fraction_top, s1.n_hits, s1.hits_fraction_top)
+        if not len(event.interactions):
+            return event
+
+        # Look up the expected area fraction top for all interactions at once
+        positions = np.array([[ia.x, ia.y, ia.z] for ia in event.interactions]).T
+        aft_probs = np.atleast_1d(self.aft_map.get_value(*positions))
+
+        s1s = [event.peaks[ia.s1] for ia in event.interactions]
+        p_values = s1_area_fraction_top_probabilities(
+            aft_probs,
+            [s1.area for s1 in s1s],
+            [s1.area_fraction_top for s1 in s1s],
+            [s1.n_hits for s1 in s1s],
+            [s1.hits_fraction_top for s1 in s1s])
+
+        for ia, p_value in zip(event.interactions, p_values):
+            ia.s1_area_fraction_top_probability = float(p_value)
 
         return event
@@ -6,7 +6,7 @@ either be triggered or untriggered. In the case of untriggered, an event builder
 must be run on the data and will result in triggered data.  Input and output
 classes are provided for MongoDB access.  More information is in the docstrings.
 """
-from collections import defaultdict
+from collections import defaultdict, deque
 from concurrent.futures import ThreadPoolExecutor
 from itertools import chain
 import datetime
@@ -19,10 +19,14 @@ import snappy
 import pickle
 import monary
 
-from pax.MongoDB_ClientMaker import ClientMaker, parse_passwordless_uri
+from pax.MongoDB_ClientMaker import ClientMaker, MonaryClientPool, parse_passwordless_uri
 from pax.datastructure import Event, Pulse, EventProxy
 from pax import plugin, trigger, units, exceptions
 
+# Version of the acquisition monitor data file format, stored in the file's header.
+# Version 1 files have a plain string as header, followed by one pickled pulse document per pulse.
+AQM_FILE_FORMAT_VERSION = 2
+
 
 class MongoBase:
 
@@ -310,15 +314,17 @@ class MongoDBReadUntriggered(plugin.InputPlugin, MongoBase):
                                                     'last_time_searched': lts,
                                                     'working_on_run': True})
 
-    def get_events(self):
-        self.log.info("Eventbuilder get_events starting up")
-        self.refresh_run_info()
-        self.log.info("Fetched runs db info successfully")
-
-        # Last time (ns) searched, exclusive. ie we searched [something, last_time_searched)
-        self.last_time_searched = self.initial_start_time
+    def plan_batches(self):
+        """Yield batch windows to query, as dictionaries with
+          - queries: list of keyword arguments for get_pulses, one for each host
+          - last_time_searched: end (exclusive) of the time range searched up to and including this batch
+          - last_data: True if this is the last batch of the run
+        Yields None if no new batch window can be searched yet. When resumed after that, sleeps a while and tries again.
+        """
+        # Last time (ns) planned to be searched, exclusive. ie we will have searched [something, last_time_planned)
+        # This runs ahead of self.last_time_searched, which is only advanced once a batch is handed to the trigger.
+        last_time_planned = self.initial_start_time
         self.log.info("self.initial_start_time: %s", pax_to_human_time(self.initial_start_time))
-        next_event_number = 0
         more_data_coming = True
 
         while more_data_coming:
@@ -333,7 +339,7 @@ class MongoDBReadUntriggered(plugin.InputPlugin, MongoBase):
                 end_of_search_for_this_run = float('inf')
 
             # What is the earliest time we still need to search?
-            next_time_to_search = self.last_time_searched
+            next_time_to_search = last_time_planned
             if next_time_to_search != self.initial_start_time:
                 next_time_to_search += self.batch_window * self.config['skip_ahead']
 
@@ -348,105 +354,96 @@ class MongoDBReadUntriggered(plugin.InputPlugin, MongoBase):
                 duration_of_searchable = self.last_pulse_time - self.config['edge_safety_margin'] - next_time_to_search
                 batches_to_search = int(duration_of_searchable / self.batch_window)
                 if batches_to_search < 1:
+                    yield None
                     self.log.info("DAQ has not taken sufficient data to continue. Sleeping 5 sec...")
                     time.sleep(5)
                     continue
             batches_to_search = min(batches_to_search, self.max_query_workers // len(self.hosts))
 
-            # Start new queries in separate processes
-            with ThreadPoolExecutor(max_workers=self.max_query_workers) as executor:
-                futures = []
-                for batch_i in range(batches_to_search):
-                    futures_per_host = []
-
-                    # Get the query, and collection name needed for it
-                    start = next_time_to_search + batch_i * self.batch_window
-                    if self.split_collections:
-                        subcol_i = self.subcollection_with_time(next_time_to_search) + batch_i
-                        # Prep the query -- not a very difficult one :-)
-                        query = {}
-                        collection_name = self.subcollection_name(subcol_i)
-                        self.log.info("Submitting query for subcollection %d" % subcol_i)
-                    else:
-                        collection_name = self.run_doc['name']
-                        stop = start + self.batch_window
-                        query = self.time_range_query(start, stop)
-                        self.log.info("Submitting query for batch %d, time range [%s, %s)" % (
-                            batch_i, pax_to_human_time(start), pax_to_human_time(stop)))
-
-                    # Do the query on each host
-                    for host in self.hosts:
-                        future = executor.submit(get_pulses,
-                                                 client_maker_config=self.cm.config,
-                                                 query=query,
-                                                 input_info=self.input_info,
-                                                 collection_name=collection_name,
-                                                 host=host,
-                                                 get_area=self.config['can_get_area'])
-                        futures_per_host.append(future)
-                    futures.append(futures_per_host)
-
-                # Record advancement of the batch window
-                self.last_time_searched = next_time_to_search + batches_to_search * self.batch_window
-
-                # Check if there is more data
-                more_data_coming = (not self.data_taking_ended) or (self.last_time_searched <
-                                                                    end_of_search_for_this_run)
-                if not more_data_coming:
-                    self.log.info("Searched to %s, which is beyond %s. This is the last batch of data" % (
-                        pax_to_human_time(self.last_time_searched), pax_to_human_time(end_of_search_for_this_run)))
-
-                # Check if we've passed the user-specified stop (if so configured)
-                stop_after_sec = self.config.get('stop_after_sec', None)
-                if stop_after_sec and 0 < stop_after_sec < float('inf'):
-                    if self.last_time_searched > stop_after_sec * units.s:
-                        self.log.warning("Searched to %s, which is beyond the user-specified stop at %d sec."
-                                         "This is the last batch of data" % (self.last_time_searched,
-                                                                             self.config['stop_after_sec']))
-                        more_data_coming = False
-
-                # Retrieve results from the queries, then pass everything to the trigger
-                for i, futures_per_host in enumerate(futures):
-                    if len(futures_per_host) == 1:
-                        assert not self.split_hosts
-                        times, modules, channels, areas = futures_per_host[0].result()
-                    else:
-                        assert self.split_hosts
-                        times = []
-                        modules = []
-                        channels = []
-                        areas = []
-                        for f in futures_per_host:
-                            ts, ms, chs, ars = f.result()
-                            times.append(ts)
-                            modules.append(ms)
-                            channels.append(chs)
-                            areas.append(ars)
-                        times = np.concatenate(times)
-                        modules = np.concatenate(modules)
-                        channels = np.concatenate(channels)
-                        areas = np.concatenate(areas)
-
-                    times = times * self.sample_duration
-
-                    if len(times):
-                        self.log.info("Batch %d: acquired pulses in range [%s, %s]" % (
-                                      i,
-                                      pax_to_human_time(times[0]),
-                                      pax_to_human_time(times[-1])))
-                    else:
-                        self.log.info("Batch %d: No pulse data found." % i)
-
-                    # Send the new data to the trigger, which will build events from it
-                    # Note the data is still unsorted: the trigger will take care of sorting it.
-                    for data in self.trigger.run(last_time_searched=next_time_to_search + (i + 1) * self.batch_window,
-                                                 start_times=times,
-                                                 channels=channels,
-                                                 modules=modules,
-                                                 areas=areas,
-                                                 last_data=(not more_data_coming and i == len(futures) - 1)):
-                        yield EventProxy(event_number=next_event_number, data=data, block_id=-1)
-                        next_event_number += 1
+            # Record advancement of the planned batch windows
+            last_time_planned = next_time_to_search + batches_to_search * self.batch_window
+
+            # Check if there is more data
+            more_data_coming = (not self.data_taking_ended) or (last_time_planned < end_of_search_for_this_run)
+            if not more_data_coming:
+                self.log.info("Searched to %s, which is beyond %s. This is the last batch of data" % (
+                    pax_to_human_time(last_time_planned), pax_to_human_time(end_of_search_for_this_run)))
+
+            # Check if we've passed the user-specified stop (if so configured)
+            stop_after_sec = self.config.get('stop_after_sec', None)
+            if stop_after_sec and 0 < stop_after_sec < float('inf'):
+                if last_time_planned > stop_after_sec * units.s:
+                    self.log.warning("Searched to %s, which is beyond the user-specified stop at %d sec."
+                                     "This is the last batch of data" % (last_time_planned,
+                                                                         self.config['stop_after_sec']))
+                    more_data_coming = False
+
+            for batch_i in range(batches_to_search):
+                # Get the query, and collection name needed for it
+                start = next_time_to_search + batch_i * self.batch_window
+                if self.split_collections:
+                    subcol_i = self.subcollection_with_time(next_time_to_search) + batch_i
+                    # Prep the query -- not a very difficult one :-)
+                    query = {}
+                    collection_name = self.subcollection_name(subcol_i)
+                    self.log.info("Submitting query for subcollection %d" % subcol_i)
+                else:
+                    collection_name = self.run_doc['name']
+                    stop = start + self.batch_window
+                    query = self.time_range_query(start, stop)
+                    self.log.info("Submitting query for batch %d, time range [%s, %s)" % (
+                        batch_i, pax_to_human_time(start), pax_to_human_time(stop)))
+
+                # Do the query on each host
+                yield dict(queries=[dict(client_maker_config=self.cm.config,
+                                         query=query,
+                                         input_info=self.input_info,
+                                         collection_name=collection_name,
+                                         host=host,
+                                         get_area=self.config['can_get_area'])
+                                    for host in self.hosts],
+                           last_time_searched=start + self.batch_window,
+                           last_data=not more_data_coming and batch_i == batches_to_search - 1)
+
+    def get_events(self):
+        self.log.info("Eventbuilder get_events starting up")
+        self.refresh_run_info()
+        self.log.info("Fetched runs db info successfully")
+
+        next_event_number = 0
+        # Last time (ns) searched by the trigger, exclusive. Reported to the pipeline status by refresh_run_info.
+        self.last_time_searched = self.initial_start_time
+        prefetch = self.config.get('prefetch_batches', max(1, self.max_query_workers // len(self.hosts)))
+
+        # Keep queries for several batch windows running in separate threads, while the trigger works on the
+        # results of the earliest batch.
+        with ThreadPoolExecutor(max_workers=self.max_query_workers) as executor:
+            for i, (batch, results) in enumerate(prefetch_in_order(self.plan_batches(), get_pulses,
+                                                                   executor, prefetch)):
+                # Each host's pulses are sorted by time: the trigger will merge them.
+                assert len(results) == 1 or self.split_hosts
+                times, modules, channels, areas = [list(x) for x in zip(*results)]
+                times = [ts * self.sample_duration for ts in times]
+
+                if sum([len(ts) for ts in times]):
+                    self.log.info("Batch %d: acquired pulses in range [%s, %s]" % (
+                                  i,
+                                  pax_to_human_time(min([ts[0] for ts in times if len(ts)])),
+                                  pax_to_human_time(max([ts[-1] for ts in times if len(ts)]))))
+                else:
+                    self.log.info("Batch %d: No pulse data found." % i)
+
+                # Send the new data to the trigger, which will build events from it
+                self.last_time_searched = batch['last_time_searched']
+                for data in self.trigger.run(last_time_searched=batch['last_time_searched'],
+                                             start_times=times,
+                                             channels=channels,
+                                             modules=modules,
+                                             areas=areas,
+                                             last_data=batch['last_data'],
+                                             presorted=True):
+                    yield EventProxy(event_number=next_event_number, data=data, block_id=-1)
+                    next_event_number += 1
 
         # We've built all the events for this run!
         # Compile the end of run info for the run doc and for display
@@ -458,12 +455,17 @@ class MongoDBReadUntriggered(plugin.InputPlugin, MongoBase):
                                                           if k != 'password' and
                                                           k not in self.processor.config['DEFAULT']}))
 
+        self.log.info("Pulse time queries: %s" % monary_clients.timing_summary())
+
         if not self.secret_mode:
             end_of_run_info = {'trigger.%s' % k: v for k, v in trigger_end_info.items()}
             self.runs_collection.update_one({'_id': self.config['run_doc_id']},
                                             {'$set': end_of_run_info})
         self.log.info("Event building complete. Trigger information: %s" % trigger_end_info)
 
+    def shutdown(self):
+        monary_clients.close_all()
+
 
 class MongoDBReadUntriggeredFiller(plugin.TransformPlugin, MongoBase):
 
@@ -597,6 +599,11 @@ class MongoDBClearUntriggered(plugin.TransformPlugin, MongoBase):
     Else (single collection mode):
         Keeps track of which time is safe to delete, then deletes data from the collection in batches.
         At shutdown, drop the collection
+
+    Acquisition monitor pulses are rescued by a separate thread, while drops/deletes of other collections continue.
+    A collection is only dropped once its rescue has completed. The file is a stream of pickles: after a header
+    (see write_aqm_header), each pickle is a dictionary of columns for a chunk of pulses (see write_aqm_chunk).
+    Use load_acquisition_monitor_pulses to read it.
     """
     do_input_check = False
     do_output_check = False
@@ -606,6 +613,10 @@ class MongoDBClearUntriggered(plugin.TransformPlugin, MongoBase):
     def startup(self):
         MongoBase.startup(self)
         self.executor = ThreadPoolExecutor(max_workers=self.config['max_query_workers'])
+        # Rescues all happen in one thread, so the pulse chunks are written to the file one at a time
+        self.rescue_executor = ThreadPoolExecutor(max_workers=1)
+        self.rescue_chunk_size = self.config.get('acquisition_monitor_rescue_chunk_size', 10000)
+        self.rescue_stats = defaultdict(float)
 
         # Should we actually delete data, or just rescue the acquisition monitor pulses?
         self.actually_delete = self.config.get('delete_data', False)
@@ -630,12 +641,11 @@ class MongoDBClearUntriggered(plugin.TransformPlugin, MongoBase):
             self.log.info("Acquisition monitor (module %d) pulses will be saved to %s" % (
                 self.aqm_module, aqm_file_path))
             self.aqm_output_handle = open(aqm_file_path, mode='wb')
-
-            # Add some random content to make Boris and ruciax happy
-            # (ensure a unique checksum even if there are no pulses or the DAQ crashes)
-            self.aqm_output_handle.write(pickle.dumps("Pax rules! Random numbers of the day: %s" % np.random.randn(3)))
+            self.write_aqm_header()
 
         self.already_rescued_collections = []
+        # (collection name, exception) of rescues that failed. These collections are not dropped.
+        self.failed_rescues = []
 
     def transform_event(self, event_proxy):
         time_since_start = event_proxy.data['stop_time'] - self.time_of_run_start
@@ -662,42 +672,53 @@ class MongoDBClearUntriggered(plugin.TransformPlugin, MongoBase):
         return event_proxy
 
     def shutdown(self):
-        # Wait for any slow drops to complete
-        self.log.info("Waiting for slow collection drops/rescues to complete...")
-        self.executor.shutdown()
-        self.log.info("Collection drops/rescues should be complete. Checking for remaining collections.")
-
-        pulses_in_remaining_collections = defaultdict(int)
-        for db in self.dbs:
-            for coll_name in db.collection_names():
-                if not coll_name.startswith(self.run_doc['name']):
-                    continue
-                if coll_name in self.already_rescued_collections and not self.actually_delete:
-                    # Of course these collections are still there, don't count them as 'remaining'
-                    continue
-                pulses_in_remaining_collections[coll_name] += db[coll_name].count()
-
-        if len(pulses_in_remaining_collections):
-            self.log.info("Leftover collections with pulse counts: %s. Clearing/rescuing these now." % (
-                              str(pulses_in_remaining_collections)))
-
-            for colname in pulses_in_remaining_collections.keys():
-                self.drop_collection_named(colname)
-            self.log.info("Completed.")
-
-        else:
-            self.log.info("All collections have already been cleaned, great.")
+        try:
+            # Wait for any slow drops to complete
+            self.log.info("Waiting for slow collection drops/rescues to complete...")
+            self.executor.shutdown()
+            # Rescues run in order, so once this no-op has run all earlier rescues are done too.
+            # We can't shut down the rescue executor yet: the remaining collections below still need rescuing.
+            self.rescue_executor.submit(lambda: None).result()
+            self.raise_failed_rescues()
+            self.log.info("Collection drops/rescues should be complete. Checking for remaining collections.")
+
+            pulses_in_remaining_collections = defaultdict(int)
+            for db in self.dbs:
+                for coll_name in db.collection_names():
+                    if not coll_name.startswith(self.run_doc['name']):
+                        continue
+                    if coll_name in self.already_rescued_collections and not self.actually_delete:
+                        # Of course these collections are still there, don't count them as 'remaining'
+                        continue
+                    pulses_in_remaining_collections[coll_name] += db[coll_name].count()
+
+            if len(pulses_in_remaining_collections):
+                self.log.info("Leftover collections with pulse counts: %s. Clearing/rescuing these now." % (
+                                  str(pulses_in_remaining_collections)))
+
+                for colname in pulses_in_remaining_collections.keys():
+                    self.drop_collection_named(colname)
+                self.log.info("Completed.")
 
-        if self.actually_delete:
-            # Update the run doc to remove the 'untriggered' entry
-            # since we just deleted the last of the untriggered data
-            self.refresh_run_doc()
-            self.runs_collection.update_one({'_id': self.run_doc['_id']},
-                                            {'$set': {'data': [d for d in self.run_doc['data']
-                                                               if d['type'] != 'untriggered']}})
-
-        if hasattr(self, 'aqm_output_handle') and self.aqm_output_handle is not None:
-            self.aqm_output_handle.close()
+            else:
+                self.log.info("All collections have already been cleaned, great.")
+
+            if self.actually_delete:
+                # Update the run doc to remove the 'untriggered' entry
+                # since we just deleted the last of the untriggered data
+                self.refresh_run_doc()
+                self.runs_collection.update_one({'_id': self.run_doc['_id']},
+                                                {'$set': {'data': [d for d in self.run_doc['data']
+                                                                   if d['type'] != 'untriggered']}})
+
+        finally:
+            # Also if a rescue failed: the rescued pulses should still end up in a properly closed file
+            self.rescue_executor.shutdown()
+            if hasattr(self, 'aqm_output_handle') and self.aqm_output_handle is not None:
+                self.aqm_output_handle.close()
+                self.log.info("Rescued %d acquisition monitor pulses (%0.1f MB) in %0.1f s: %0.1f MB/s" % (
+                    self.rescue_stats['pulses'], self.rescue_stats['bytes'] / 1e6, self.rescue_stats['seconds'],
+                    self.rescue_stats['bytes'] / 1e6 / max(self.rescue_stats['seconds'], 1e-9)))
 
     def rescue_acquisition_monitor_pulses(self, collection, query=None):
         """Saves all acquisition monitor pulses from collection the acquisition monitor data file.
@@ -712,48 +733,155 @@ class MongoDBClearUntriggered(plugin.TransformPlugin, MongoBase):
             query = {}
         query['module'] = self.aqm_module
 
-        # Count first, in case something is badly wrong and we end up saving bazillions of docs we'll at least have
-        # a fair warning...
-        n_to_rescue = collection.count(query)
-        self.log.info("Saving %d acquisition monitor pulses" % n_to_rescue)
-
-        for doc in collection.find(query):
-            self.aqm_output_handle.write(pickle.dumps(doc))
+        # Fetch only the fields we store, in large batches. The default batch is 101 documents or 1MB.
+        start = time.time()
+        cursor = collection.find(query, projection={'_id': False, 'time': True, 'channel': True, 'data': True})
+        cursor.batch_size(int(1e7))
+        n_rescued = 0
+        n_bytes = 0
+        chunk = []
+        for doc in cursor:
+            chunk.append(doc)
+            if len(chunk) >= self.rescue_chunk_size:
+                n_bytes += self.write_aqm_chunk(chunk)
+                n_rescued += len(chunk)
+                chunk = []
+                # In case something is badly wrong and we end up saving bazillions of docs we'll at least have
+                # a fair warning...
+                self.log.info("Saved %d acquisition monitor pulses so far" % n_rescued)
+        if len(chunk):
+            n_bytes += self.write_aqm_chunk(chunk)
+            n_rescued += len(chunk)
 
         # Flush explicitly: we want to save the data even if the event builder crashes before properly closing the file
         self.aqm_output_handle.flush()
 
+        dt = time.time() - start
+        self.log.info("Saved %d acquisition monitor pulses (%0.1f MB) in %0.2f s" % (n_rescued, n_bytes / 1e6, dt))
+        self.rescue_stats['pulses'] += n_rescued
+        self.rescue_stats['bytes'] += n_bytes
+        self.rescue_stats['seconds'] += dt
+
+    def write_aqm_header(self):
+        """Write the header of the acquisition monitor file: a pickled dictionary with the file format version"""
+        # Add some random content to make Boris and ruciax happy
+        # (ensure a unique checksum even if there are no pulses or the DAQ crashes)
+        self.aqm_output_handle.write(pickle.dumps(dict(
+            format_version=AQM_FILE_FORMAT_VERSION,
+            comment="Pax rules! Random numbers of the day: %s" % np.random.randn(3))))
+
+    def write_aqm_chunk(self, docs):
+        """Write pulse docs to the acquisition monitor file as one pickled dictionary of columns:
+            module: the acquisition monitor module number
+            time, channel: numpy arrays
+            data_length: numpy array with the length in bytes of each pulse's data
+            data: bytes, the data of all pulses concatenated
+            compressed: whether the data of each pulse is snappy-compressed
+        Returns number of bytes written.
+        """
+        chunk = pickle.dumps(dict(module=self.aqm_module,
+                                  time=np.array([d['time'] for d in docs], dtype=np.int64),
+                                  channel=np.array([d['channel'] for d in docs], dtype=np.int16),
+                                  data_length=np.array([len(d['data']) for d in docs], dtype=np.int64),
+                                  data=b''.join([d['data'] for d in docs]),
+                                  compressed=self.input_info['compressed']))
+        self.aqm_output_handle.write(chunk)
+        return len(chunk)
+
     def delete_pulses(self, collection, start_mongo_time, stop_mongo_time):
         """Deletes all pulses in collection between start_mongo_time (inclusive) and stop_mongo_time (exclusive),
         both in mongo time units (not pax units!). Rescues acquisition monitor pulses just before deleting.
         """
         query = {'time': {'$gte': start_mongo_time,
                           '$lt': stop_mongo_time}}
-        self.rescue_acquisition_monitor_pulses(collection, query)
+        self.rescue_executor.submit(self.rescue_acquisition_monitor_pulses, collection, dict(query)).result()
         if self.actually_delete:
             collection.delete_many(query)
 
     def drop_collection_named(self, collection_name, executor=None):
         """Drop the collection named collection_name from db, rescueing acquisition monitor pulses first.
-        if executor is passed, will execute the drop command via the pool it represents.
+        if executor is passed, will execute the drop command via the pool it represents, once the rescue is done.
+        Otherwise blocks until the rescue and drop are done.
 
-        This function is NOT parallelizable itself, don't pass it to an executor!
-        We need to block while rescuing acquisition monitor pulses: otherwise, we would get to the final cleanup in
-        shutdown() while there are still collections being rescued.
+        The rescue is submitted to the rescue executor, so this function itself does not block if executor is passed.
+        shutdown() waits for the rescue executor before it looks for remaining collections.
         """
+        rescue = None
         if self.aqm_db is not None:
             if collection_name not in self.already_rescued_collections:
                 self.already_rescued_collections.append(collection_name)
-                self.rescue_acquisition_monitor_pulses(self.aqm_db[collection_name])
+                rescue = self.rescue_executor.submit(self.rescue_collection_named, collection_name)
             else:
                 self.log.warning("Duplicated call to rescue/delete collection %s!" % collection_name)
         if not self.actually_delete:
+            if executor is None and rescue is not None:
+                rescue.result()
             return
         for db in self.dbs:
             if executor is None:
-                db.drop_collection(collection_name)
+                self.drop_after_rescue(db, collection_name, rescue)
             else:
-                executor.submit(db.drop_collection, collection_name)
+                executor.submit(self.drop_after_rescue, db, collection_name, rescue)
+
+    def rescue_collection_named(self, collection_name):
+        """Rescue acquisition monitor pulses from the collection named collection_name.
+        If this fails, the collection is no longer marked as rescued, and the error is kept for raise_failed_rescues.
+        """
+        try:
+            self.rescue_acquisition_monitor_pulses(self.aqm_db[collection_name])
+        except Exception as e:
+            self.already_rescued_collections.remove(collection_name)
+            self.failed_rescues.append((collection_name, e))
+            raise
+
+    def raise_failed_rescues(self):
+        """Raise an error if any rescue of acquisition monitor pulses failed.
+        Called at shutdown before remaining collections are dropped, so the data in them is not lost.
+        """
+        if len(self.failed_rescues):
+            raise RuntimeError("Rescuing acquisition monitor pulses failed for collections %s: %s" % (
+                ', '.join([name for name, _ in self.failed_rescues]),
+                ', '.join([str(e) for _, e in self.failed_rescues])))
+
+    def drop_after_rescue(self, db, collection_name, rescue=None):
+        """Drop collection_name from db, after waiting for the future rescue (if not None) to complete.
+        If the rescue failed, the collection is not dropped.
+        """
+        if rescue is not None:
+            try:
+                rescue.result()
+            except Exception as e:
+                self.log.error("Rescuing acquisition monitor pulses from %s failed (%s), NOT dropping it!" % (
+                    collection_name, e))
+                raise
+        db.drop_collection(collection_name)
+
+
+def load_acquisition_monitor_pulses(filename):
+    """Yields the pulses in an acquisition monitor data file written by MongoDBClearUntriggered,
+    as dictionaries with module, channel, time and (decompressed) data fields.
+    """
+    with open(filename, mode='rb') as f:
+        header = pickle.load(f)
+        version = header.get('format_version') if isinstance(header, dict) else 1
+        if version != AQM_FILE_FORMAT_VERSION:
+            raise ValueError("%s has acquisition monitor file format version %s, can only read version %d. "
+                             "Version 1 files are a stream of pickled pulse documents after a header string: "
+                             "just pickle.load them." % (filename, version, AQM_FILE_FORMAT_VERSION))
+        while True:
+            try:
+                chunk = pickle.load(f)
+            except EOFError:
+                return
+            data_end = np.cumsum(chunk['data_length'])
+            for i in range(len(chunk['time'])):
+                data = chunk['data'][data_end[i] - chunk['data_length'][i]:data_end[i]]
+                if chunk['compressed']:
+                    data = snappy.decompress(data)
+                yield dict(module=chunk['module'],
+                           channel=int(chunk['channel'][i]),
+                           time=int(chunk['time'][i]),
+                           data=data)
 
 
 def pax_to_human_time(num):
@@ -765,31 +893,84 @@ def pax_to_human_time(num):
     return "%3.1f %s" % (num, 's')
 
 
+def prefetch_in_order(batches, fetch, executor, max_in_flight):
+    """Yield (batch, results) for each batch from the iterable batches, in order, where results is a list of the
+    results of fetch(**kwargs) for each kwargs in batch['queries'].
+    The queries of up to max_in_flight batches are kept running in executor, also while the caller works on
+    the results of an earlier batch.
+    If batches yields None, no new batch is available yet: batches is not asked for more until the results of all
+    batches already submitted have been yielded.
+    """
+    batches = iter(batches)
+    in_flight = deque()
+    exhausted = False
+    paused = False
+    ready = None
+
+    while True:
+        # Submit new batches until max_in_flight batches are in flight
+        while not (exhausted or paused) and len(in_flight) < max_in_flight:
+            try:
+                batch = next(batches)
+            except StopIteration:
+                exhausted = True
+                break
+            if batch is None:
+                paused = True
+                break
+            in_flight.append((batch, [executor.submit(fetch, **kwargs) for kwargs in batch['queries']]))
+
+        if ready is not None:
+            yield ready
+            ready = None
+
+        if not len(in_flight):
+            if exhausted:
+                return
+            # All submitted batches are done, ask for new batches again
+            paused = False
+            continue
+
+        # Wait for the earliest batch to complete
+        batch, futures = in_flight.popleft()
+        ready = batch, [f.result() for f in futures]
+
+
+# Monary clients used by get_pulses. Shared by all threads in the process, so connections are made only once.
+monary_clients = MonaryClientPool()
+
+
 def get_pulses(client_maker_config, input_info, collection_name, query, host, get_area=False):
     """Find pulse times according to query using monary.
-    Returns four numpy arrays: times, modules, channels, areas.
+    Returns four numpy arrays: times, modules, channels, areas, sorted by time.
     Areas consists of zeros unless get_area = True, in which we also fetch the 'integral' field.
 
-    The monary client is created inside this function, so we could run it with ProcessPoolExecutor.
+    Monary clients are taken from the process-wide monary_clients pool, so we don't reconnect for every query.
     """
     fields = ['time', 'module', 'channel'] + (['integral'] if get_area else [])
     types = ['int64', 'int32', 'int32'] + (['area'] if get_area else [])
 
     try:
-        client_maker = ClientMaker(client_maker_config)
-
-        monary_client = client_maker.get_client(database_name=input_info['database'],
-                                                uri=input_info['location'],
-                                                host=host,
-                                                monary=True)
-
-        # Somehow monary's block query fails when we have multiple blocks,
-        # we need to take care of copying out the data ourselves, but even if I use .copy it doesn't seem to work
-        # Never mind, just make a big block
-        results = list(monary_client.block_query(input_info['database'], collection_name, query, fields, types,
-                                                 block_size=int(5e8),
-                                                 select_fields=True))
-        monary_client.close()
+        with monary_clients.client(client_maker_config,
+                                   database_name=input_info['database'],
+                                   uri=input_info['location'],
+                                   host=host) as monary_client:
+            # Make the block big enough to get all the data in one block. Leave some margin for pulses
+            # inserted while we query (in live mode).
+            t0 = time.time()
+            expected_count = monary_client.count(input_info['database'], collection_name, query)
+            block_size = int(min(5e8, 1.1 * expected_count + 1000))
+            t1 = time.time()
+
+            # Monary re-uses the arrays of a block for the next block, so we have to copy out the data of each
+            # block before getting the next one.
+            results = []
+            for block in monary_client.block_query(input_info['database'], collection_name, query, fields, types,
+                                                   block_size=block_size,
+                                                   select_fields=True):
+                results.append([np.array(x) for x in block])
+            monary_clients.add_time('counting', t1 - t0)
+            monary_clients.add_time('data transfer', time.time() - t1)
 
     except monary.monary.MonaryError as e:
         if 'Failed to resolve' in str(e):
@@ -815,4 +996,11 @@ def get_pulses(client_maker_config, input_info, collection_name, query, host, ge
             times, modules, channels = results
             areas = np.zeros(len(times), dtype=np.float64)
 
+        # Sort by time. Data from one host is usually nearly sorted already, which the stable sort handles well.
+        # Doing this here means it happens in parallel on the query threads.
+        if np.any(times[1:] < times[:-1]):
+            sort_order = np.argsort(times, kind='mergesort')
+            times, modules, channels, areas = times[sort_order], modules[sort_order], \
+                channels[sort_order], areas[sort_order]
+
     return times, modules, channels, areas
@@ -16,6 +16,7 @@ from rootpy import stl
 import pax  # For version number
 from pax import plugin, datastructure, exceptions
 from pax.datastructure import make_event_proxy
+from pax.retention import peak_array_lengths
 
 ROOT.gROOT.SetBatch(True)
 log = logging.getLogger('ROOTClass_helpers')
@@ -55,10 +56,15 @@ class EncodeROOTClass(plugin.TransformPlugin):
         self.config.setdefault('fields_to_ignore',
                                ('all_hits', 'raw_data', 'sum_waveforms', 'hits', 'pulses'))
         self._custom_types = []
+        if 'raw_data' in self.config['fields_to_ignore']:
+            self.uses_low_level_data = ('hits', 'peak_arrays')
         self.class_is_loaded = False
         self.last_collection = {}
         self.class_code = None
 
+        # Lengths of the C array fields of each ROOT class, filled by _build_model_class
+        self.array_lengths = {}
+
     def transform_event(self, event):
         if self.class_code is None:
             # Generate and load the pax event class code
@@ -123,7 +129,12 @@ class EncodeROOTClass(plugin.TransformPlugin):
                 root_field_type = root_field.typecode
                 if six.PY3:
                     root_field_type = root_field_type.decode("UTF-8")
-                root_field_new = array.array(root_field_type, field_value.tolist())
+                values = field_value.tolist()
+                # Peak arrays released for large events (see pax.retention) are empty:
+                # explicitly pad them with zeros to the length of the C array
+                length = self.array_lengths[obj_name][field_name]
+                values += [0] * (length - len(values))
+                root_field_new = array.array(root_field_type, values)
                 setattr(root_object, field_name, root_field_new)
             else:
                 # Everything else apparently just works magically:
@@ -153,6 +164,7 @@ class EncodeROOTClass(plugin.TransformPlugin):
         list_field_info = model.get_list_field_info()
         class_attributes = ''
         child_classes_code = ''
+        array_lengths = self.array_lengths[model_name] = {}
         for field_name, field_value in sorted(model.get_fields_data()):
             if field_name in self.config['fields_to_ignore']:
                 continue
@@ -173,6 +185,9 @@ class EncodeROOTClass(plugin.TransformPlugin):
                 self.log.debug("List column %s encountered. Type is %s" % (field_name, element_model_name))
                 if element_model_name not in self._custom_types:
                     self._custom_types.append(element_model_name)
+                    if element_model_name == 'Peak':
+                        # Peaks whose arrays were released (see pax.retention) don't have the right array lengths
+                        field_value = [p for p in field_value if len(p.area_per_channel)]
                     if not len(field_value):
                         # This event does not have an instance of the required type, we have to make one.
                         # TODO: These are some very ugly hacks!
@@ -185,18 +200,11 @@ class EncodeROOTClass(plugin.TransformPlugin):
                         elif element_model_name == 'Peak':
                             # Peak has some array fields whose length depends on the configuration.
                             source = element_model()
-                            n_channels = self.config['n_channels']
                             aargh = self.processor.config['BasicProperties.SumWaveformProperties']
-                            n_waveform_samples = int(aargh['peak_waveform_length'] / self.config['sample_duration']) + 1
-                            for _fn, length in ((
-                                ('area_per_channel', n_channels),
-                                ('hits_per_channel', n_channels),
-                                ('coincidence_per_channel', n_channels),
-                                ('tight_coincidence_thresholds', 5),
-                                ('n_saturated_per_channel', n_channels),
-                                ('sum_waveform', n_waveform_samples),
-                                ('sum_waveform_top', n_waveform_samples),
-                            )):
+                            lengths = peak_array_lengths(self.config['n_channels'], self.config['sample_duration'],
+                                                         aargh['peak_waveform_length'])
+                            lengths['tight_coincidence_thresholds'] = 5
+                            for _fn, length in lengths.items():
                                 setattr(source, _fn, np.zeros(length, dtype=getattr(source, _fn).dtype))
                         else:
                             source = element_model()
@@ -210,6 +218,7 @@ class EncodeROOTClass(plugin.TransformPlugin):
                 class_attributes += '\t%s  %s[%d];\n' % (self.get_root_type(field_name,
                                                                             field_value.dtype.type.__name__),
                                                          field_name, len(field_value))
+                array_lengths[field_name] = len(field_value)
 
             # Everything else (int, float, bool)
             else:
@@ -234,6 +243,7 @@ class EncodeROOTClass(plugin.TransformPlugin):
 class WriteROOTClass(plugin.OutputPlugin):
     do_input_check = False
     do_output_check = False
+    uses_low_level_data = ()   # Gets the event encoded by EncodeROOTClass
 
     def startup(self):
         self.config.setdefault('buffer_size', 16000)
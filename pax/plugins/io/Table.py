@@ -6,6 +6,7 @@ import numpy as np
 
 from pax import plugin, exceptions, datastructure
 from pax.formats import flat_data_formats
+from pax.retention import peak_array_lengths
 
 
 class TableWriter(plugin.OutputPlugin):
@@ -72,6 +73,17 @@ class TableWriter(plugin.OutputPlugin):
 
         self.events_ready_for_conversion = 0
 
+        # Length of each numpy array field of each model, see _set_array_field_lengths
+        # Peaks of large events may have had their arrays released (see pax.retention), even all peaks of the first
+        # event we see, so get the peak array lengths from the configuration.
+        self.array_field_lengths = {}
+        try:
+            self.array_field_lengths['Peak'] = peak_array_lengths(
+                self.config['n_channels'], self.config['sample_duration'],
+                self.processor.config['BasicProperties.SumWaveformProperties']['peak_waveform_length'])
+        except KeyError:
+            self.log.debug("No peak waveform length configured, taking peak array lengths from the data.")
+
         # Init the output format
         self.output_format = of = flat_data_formats[self.config['output_format']](log=self.log)
 
@@ -218,11 +230,17 @@ class TableWriter(plugin.OutputPlugin):
             if field_name in self.config['fields_to_ignore']:
                 continue
 
+            if isinstance(field_value, np.ndarray) and field_value.dtype.names is None:
+                field_value = self._pad_array_field(m_name, field_name, field_value)
+
             if isinstance(field_value, list):
                 # This is a model collection field.
                 # Get its type (can't get from the list itself, could be empty)
                 child_class_name = m.get_list_field_info()[field_name]
 
+                if len(field_value) and type(field_value[0]).__name__ not in self.data:
+                    self._set_array_field_lengths(field_value)
+
                 # Store the absolute start index & number of children
                 child_start = self.get_index_of(child_class_name)
                 n_children = len(field_value)
@@ -289,6 +307,25 @@ class TableWriter(plugin.OutputPlugin):
         # Store m_indices + m_data in self.data['tuples']
         self.data[m_name]['tuples'].append(tuple(m_indices + m_data))
 
+    def _set_array_field_lengths(self, models):
+        """Remember the length of the numpy array fields of models, a collection of models we see for the first time.
+        For large events, some peaks' arrays are emptied (see DeleteLowLevelInfo), so take the longest of each field,
+        or the length from the configuration if that is longer.
+        """
+        lengths = dict(self.array_field_lengths.get(type(models[0]).__name__, {}))
+        for m in models:
+            for field_name, field_value in m.get_fields_data():
+                if isinstance(field_value, np.ndarray) and field_value.dtype.names is None:
+                    lengths[field_name] = max(lengths.get(field_name, 0), len(field_value))
+        self.array_field_lengths[type(models[0]).__name__] = lengths
+
+    def _pad_array_field(self, m_name, field_name, x):
+        """Return numpy array field x padded with zeros to the length we store for this field"""
+        length = self.array_field_lengths.get(m_name, {}).get(field_name, len(x))
+        if len(x) >= length:
+            return x
+        return np.concatenate([x, np.zeros(length - len(x), dtype=x.dtype)])
+
     def _numpy_field_dtype(self, name, x):
         """Return field dtype of numpy record with field name name and value (of type of) x
         """
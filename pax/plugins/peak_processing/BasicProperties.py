@@ -7,6 +7,7 @@ from pax import plugin, dsputils
 class BasicProperties(plugin.TransformPlugin):
     """Computes basic properties of each peak, based on the hits.
     """
+    uses_low_level_data = ('hits', 'peak_arrays')
 
     def transform_event(self, event):
         first_top_ch = np.min(np.array(self.config['channels_top']))
@@ -52,6 +53,7 @@ class BasicProperties(plugin.TransformPlugin):
 
 class SumWaveformProperties(plugin.TransformPlugin):
     """Computes properties based on the hits-only sum waveform"""
+    uses_low_level_data = ('hits', 'peak_arrays')
 
     def startup(self):
         self.dt = dt = self.config['sample_duration']
@@ -150,13 +152,26 @@ class SumWaveformProperties(plugin.TransformPlugin):
 
 
 class CountCoincidentNoisePulses(plugin.TransformPlugin):
+    """Counts the noise pulses (pulses without hits) overlapping with each peak.
+    A noise pulse overlaps a peak if it starts before the peak ends, and does not end before the peak starts.
+    Since every pulse ends after it starts, the latter pulses are a subset of the former,
+    so the count is a difference of two searches in the sorted noise pulse bounds.
+    """
+    uses_low_level_data = ()
 
     def transform_event(self, event):
+        if not len(event.peaks):
+            return event
         noise_pulses = [p for p in event.pulses if p.n_hits_found == 0]
-        for peak in event.peaks:
-            for nop in noise_pulses:
-                if nop.left <= peak.right and nop.right >= peak.left:
-                    peak.n_noise_pulses += 1
+        noise_lefts = np.sort(np.array([p.left for p in noise_pulses], dtype=np.int64))
+        noise_rights = np.sort(np.array([p.right for p in noise_pulses], dtype=np.int64))
+        peak_lefts = np.array([peak.left for peak in event.peaks], dtype=np.int64)
+        peak_rights = np.array([peak.right for peak in event.peaks], dtype=np.int64)
+
+        n_noise_pulses = np.searchsorted(noise_lefts, peak_rights, side='right') - \
+            np.searchsorted(noise_rights, peak_lefts, side='left')
+        for peak, n in zip(event.peaks, n_noise_pulses):
+            peak.n_noise_pulses += int(n)
         return event
 
 
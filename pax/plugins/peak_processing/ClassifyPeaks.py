@@ -1,7 +1,50 @@
+import numpy as np
+
 from pax import plugin, units
 
 
-class AdHocClassification1T(plugin.TransformPlugin):
+class PeakClassifier(plugin.TransformPlugin):
+    """Base class for peak classification plugins.
+    The peaks of the event are classified all at once, by rules acting on columns of the event's peak store
+    (see pax.datastructure.PeakStore). Only peaks whose type changes are modified.
+
+    Child classes implement classify(store, to_classify), which must return an array with the new type of each peak
+    in the store. Peaks of type noise or lone_hit are never reclassified.
+    """
+    skip_types = ('noise', 'lone_hit')
+    uses_low_level_data = ()
+
+    def transform_event(self, event):
+        if not len(event.peaks):
+            return event
+        store = event.get_peak_store()
+        old_types = store.scalars['type']
+        to_classify = np.in1d(old_types, self.skip_types, invert=True)
+
+        new_types = np.asarray(self.classify(store, to_classify), dtype=object)
+        new_types[True ^ to_classify] = old_types[True ^ to_classify]
+
+        for peak_i in np.where(new_types != old_types.astype(object))[0]:
+            event.peaks[peak_i].type = str(new_types[peak_i])
+        return event
+
+    def classify(self, store, to_classify):
+        """Return array with the type of each peak in the PeakStore store.
+        to_classify is a boolean array indicating which peaks will be reclassified (types of others are ignored).
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def get_column(store, feature):
+        """Return array with a feature of each peak in store. feature is the name of a scalar peak field
+        (e.g. 'area') or an element of an array field (e.g. 'range_area_decile[9]')."""
+        if feature.endswith(']'):
+            field_name, index = feature[:-1].split('[')
+            return store.arrays[field_name][:, int(index)]
+        return store.scalars[feature]
+
+
+class AdHocClassification1T(PeakClassifier):
 
     def startup(self):
         self.s1_rise_time_bound = self.config['s1_risetime_threshold']
@@ -9,63 +52,53 @@ class AdHocClassification1T(plugin.TransformPlugin):
         self.tight_coincidence_threshold = self.config['tight_coincidence_threshold']
 
     def transform_event(self, event):
+        # rounding peak aft, for future usage like BDT based classification
+        # The classification doesn't depend on it, so we can round after classifying
+        to_round = []
+        if len(event.peaks):
+            store = event.get_peak_store()
+            aft = store.scalars['area_fraction_top']
+            to_round = np.where(np.in1d(store.scalars['type'], self.skip_types, invert=True) &
+                                ((aft < 0) | (aft > 1)))[0]
+            aft = np.clip(aft, 0, 1)
 
-        for peak in event.peaks:
-            # Don't work on noise and lone hit
-            if peak.type in ('noise', 'lone_hit'):
-                continue
-            # rounding peak aft, for future usage like BDT based classification
-            if peak.area_fraction_top < 0:
-                peak.area_fraction_top = 0
-            elif peak.area_fraction_top > 1:
-                peak.area_fraction_top = 1
-
-            # classification based on rise_time and aft
-            if -peak.area_decile_from_midpoint[1] < self.s1_rise_time_bound\
-                    and peak.range_area_decile[9] < self.s1_width_bound:
-                # S1 requirements: Peak rises fast, and width (90p area) small
-                if peak.tight_coincidence >= self.tight_coincidence_threshold:
-                    peak.type = 's1'
-                else:
-                    # Too few PMTs contributing, hard to distinguish from junk
-                    peak.type = 'unknown'
-            else:
-                # No fast rise
-                if peak.n_contributing_channels >= 4:
-                    # Large enough to be considered as S2
-                    peak.type = 's2'
-                else:
-                    # Too few contributing channels, not really S2
-                    peak.type = 'unknown'
+        event = PeakClassifier.transform_event(self, event)
 
+        for peak_i in to_round:
+            event.peaks[peak_i].area_fraction_top = float(aft[peak_i])
         return event
 
+    def classify(self, store, to_classify):
+        # classification based on rise_time and aft
+        # S1 requirements: Peak rises fast, and width (90p area) small
+        s1_like = (-self.get_column(store, 'area_decile_from_midpoint[1]') < self.s1_rise_time_bound) & \
+                  (self.get_column(store, 'range_area_decile[9]') < self.s1_width_bound)
 
-class AdHocClassification(plugin.TransformPlugin):
+        # Too few PMTs contributing, hard to distinguish from junk
+        types = np.array(['unknown'] * len(store), dtype=object)
+        types[s1_like & (store.scalars['tight_coincidence'] >= self.tight_coincidence_threshold)] = 's1'
 
-    def transform_event(self, event):
+        # No fast rise: if large enough, S2. With too few contributing channels, not really S2.
+        types[(True ^ s1_like) & (store.scalars['n_contributing_channels'] >= 4)] = 's2'
+        return types
 
-        for peak in event.peaks:
-            # Don't work on noise and lone_hit
-            if peak.type in ('noise', 'lone_hit'):
-                continue
-
-            width = peak.range_area_decile[5]
-
-            if peak.area > 50:
-                # We don't have to worry about single electrons anymore
-                if width < 100 * units.ns:
-                    peak.type = 's1'
-                elif width > 250 * units.ns:
-                    peak.type = 's2'
-            else:
-                # Worry about SE-S1 identification.
-                if width < 75 * units.ns:
-                    peak.type = 's1'
-                else:
-                    if peak.area < 5:
-                        peak.type = 'coincidence'
-                    elif width > 100 * units.ns:
-                        peak.type = 's2'
 
-        return event
+class AdHocClassification(PeakClassifier):
+
+    def classify(self, store, to_classify):
+        types = store.scalars['type'].astype(object)
+        width = self.get_column(store, 'range_area_decile[5]')
+        area = store.scalars['area']
+
+        # We don't have to worry about single electrons anymore
+        large = area > 50
+        types[large & (width < 100 * units.ns)] = 's1'
+        types[large & (width > 250 * units.ns)] = 's2'
+
+        # Worry about SE-S1 identification.
+        small = True ^ large
+        narrow = width < 75 * units.ns
+        types[small & narrow] = 's1'
+        types[small & (True ^ narrow) & (area < 5)] = 'coincidence'
+        types[small & (True ^ narrow) & (True ^ (area < 5)) & (width > 100 * units.ns)] = 's2'
+        return types
@@ -5,6 +5,7 @@ from pax import plugin
 class HitpatternSpread(plugin.TransformPlugin):
     """Computes the weighted root mean square deviation of the top and bottom hitpattern for each peak
     """
+    uses_low_level_data = ('peak_arrays',)
 
     def startup(self):
 
@@ -19,28 +20,17 @@ class HitpatternSpread(plugin.TransformPlugin):
                     self.locations[array][i][{'x': 0, 'y': 1}[dim]] = self.config['pmts'][ch]['position'][dim]
 
     def transform_event(self, event):
-
-        for peak in event.peaks:
-
-            # No point in computing this for veto peaks
-            if peak.detector != 'tpc':
-                continue
-
-            for array in ('top', 'bottom'):
-
-                hitpattern = peak.area_per_channel[self.pmts[array]]
-
-                if np.all(hitpattern == 0):
-                    # Empty hitpatterns will give error in np.average
+        # Compute the spread of all peaks at once, see PeakStore.hitpattern_summary
+        summaries = {array: event.get_hitpattern_summary(self.pmts[array], self.locations[array])
+                     for array in ('top', 'bottom')}
+
+        # No point in computing this for veto peaks
+        for peak_i in event.get_peak_indices_by_type(detector='tpc'):
+            peak = event.peaks[peak_i]
+            for array, summary in summaries.items():
+                if summary['empty'][peak_i]:
+                    # Empty hitpatterns keep the default spread
                     continue
-
-                # Compute the weighted mean position
-                weighted_mean_position = np.average(self.locations[array], weights=hitpattern, axis=0)
-
-                # Compute weighted average euclidean distance from mean position
-                avg_distance = np.sqrt(np.average(np.sum((self.locations[array] - weighted_mean_position) ** 2, axis=1),
-                                                  weights=hitpattern))
-
-                setattr(peak, '%s_hitpattern_spread' % array, avg_distance)
+                setattr(peak, '%s_hitpattern_spread' % array, float(summary['spread'][peak_i]))
 
         return event
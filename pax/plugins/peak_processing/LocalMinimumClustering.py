@@ -1,12 +1,14 @@
 from pax import plugin, datastructure, dsputils
 from scipy.stats import norm
 import numpy as np
+import numba
 import logging
 from pax.plugins.signal_processing.HitFinder import build_hits
 log = logging.getLogger('LocalMinimumClusteringHelpers')
 
 
 class LocalMinimumClustering(plugin.ClusteringPlugin):
+    uses_low_level_data = ('raw_data', 'hits', 'peak_arrays')
 
     def cluster_peak(self, peak):
         if peak.type == 'lone_hit':
@@ -39,68 +41,66 @@ class LocalMinimumClustering(plugin.ClusteringPlugin):
         Samples at the split points will fall to the right (so if we split [0, 5] on 2, you get [0, 1] and [2, 5]).
         Hits that straddle a split point are themselves split into two hits: peak.hits is updated.
         """
-        # First, split hits that straddle the split points
-        # Hits may have to be split several times; for each split point we modify the 'hits' list, splitting only
-        # the hits we need.
-        hits = peak.hits
-        for x in split_points:
-            x += peak.left   # Convert to index in event
-
-            # Select hits that must be split: start before x and end after it.
-            selection = (hits['left'] <= x) & (hits['right'] > x)
-            hits_to_split = hits[selection]
-
-            # new_hits will be a list of hit arrays, which we concatenate later to make the new 'hits' list
-            # Start with the hits that don't have to be split: we definitely want to retain those!
-            new_hits = [hits[True ^ selection]]
+        split_points = np.sort(np.asarray(split_points, dtype=np.int64))
+        split_points_in_event = split_points + peak.left
 
-            for h in hits_to_split:
-                pulse_i = h['found_in_pulse']
+        # First, split hits that straddle the split points (start at or before a split point and end after it).
+        # All hits from the same pulse are split in one go, so each pulse waveform is only converted once.
+        hits = peak.hits
+        first_split = np.searchsorted(split_points_in_event, hits['left'], side='left')
+        n_splits = np.searchsorted(split_points_in_event, hits['right'], side='left') - first_split
+        hits_to_split = hits[n_splits > 0]
+
+        # new_hits will be a list of hit arrays, which we concatenate later to make the new 'hits' list
+        # Start with the hits that don't have to be split: we definitely want to retain those!
+        new_hits = [hits[n_splits == 0]]
+
+        if len(hits_to_split):
+            n_pieces = n_splits[n_splits > 0] + 1
+            order = np.argsort(hits_to_split['found_in_pulse'], kind='mergesort')
+            hits_to_split = hits_to_split[order]
+            n_pieces = n_pieces[order]
+            pulse_is, group_starts = np.unique(hits_to_split['found_in_pulse'], return_index=True)
+            group_ends = np.append(group_starts[1:], len(hits_to_split))
+
+            for pulse_i, group_start, group_end in zip(pulse_is, group_starts, group_ends):
                 pulse = self.event.pulses[pulse_i]
 
                 # Get the pulse waveform in ADC counts above baseline (because it's what build_hits expect)
                 baseline_to_subtract = self.config['digitizer_reference_baseline'] - pulse.baseline
                 w = baseline_to_subtract - pulse.raw_data.astype(np.float64)
 
-                # Use the hitfinder's build_hits to compute the properties of these hits
-                # Damn this is ugly... but at least we don't have duplicate property computation code
-                hits_buffer = np.zeros(2, dtype=datastructure.Hit.get_dtype())
-                adc_to_pe = dsputils.adc_to_pe(self.config, h['channel'])
-                hit_bounds = np.array([[h['left'], x], [x+1, h['right']]], dtype=np.int64)
-                hit_bounds -= pulse.left   # build_hits expects hit bounds relative to pulse start
-                build_hits(w,
-                           hit_bounds=hit_bounds,
-                           hits_buffer=hits_buffer,
-                           adc_to_pe=adc_to_pe,
-                           channel=h['channel'],
-                           noise_sigma_pe=pulse.noise_sigma * adc_to_pe,
-                           dt=self.config['sample_duration'],
-                           start=pulse.left,
-                           pulse_i=pulse_i,
-                           saturation_threshold=self.config['digitizer_reference_baseline'] - pulse.baseline - 0.5,
-                           central_bounds=hit_bounds)       # TODO: Recompute central bounds in an intelligent way...
+                adc_to_pe = dsputils.adc_to_pe(self.config, pulse.channel)
+                hits_buffer = np.zeros(n_pieces[group_start:group_end].sum(), dtype=datastructure.Hit.get_dtype())
+                n_new_hits = split_hits(w,
+                                        hits=hits_to_split[group_start:group_end],
+                                        split_points=split_points_in_event,
+                                        hits_buffer=hits_buffer,
+                                        adc_to_pe=adc_to_pe,
+                                        noise_sigma_pe=pulse.noise_sigma * adc_to_pe,
+                                        dt=self.config['sample_duration'],
+                                        start=pulse.left,
+                                        pulse_i=pulse_i,
+                                        saturation_threshold=(self.config['digitizer_reference_baseline'] -
+                                                              pulse.baseline - 0.5))
+                hits_buffer = hits_buffer[:n_new_hits]
 
                 # Remove hits with 0 or negative area (very rare, but possible due to rigid integration bound)
-                hits_buffer = hits_buffer[hits_buffer['area'] > 0]
-
-                new_hits.append(hits_buffer)
+                new_hits.append(hits_buffer[hits_buffer['area'] > 0])
 
-            # Now remake the hits list, then go on to the next peak.
-            hits = np.concatenate(new_hits)
+        # Now remake the hits list
+        hits = np.concatenate(new_hits)
 
         # Next, split the peaks, sorting hits to the right peak by their maximum index.
-        # Iterate over left, right bounds of the new peaks
-        boundaries = list(zip([0] + [y+1 for y in split_points], split_points + [float('inf')]))
-        for left, right in boundaries:
-            # Convert to index in event
-            left += peak.left
-            right += peak.left
-
-            # Select hits which have their maximum within this peak bounds
-            # The last new peak must also contain hits at the right bound (though this is unlikely to happen)
-            hs = hits[(hits['index_of_maximum'] >= left) &
-                      (hits['index_of_maximum'] <= right)]
-
+        # The last new peak must also contain hits at the right bound (though this is unlikely to happen)
+        peak_lefts = np.concatenate([[peak.left], split_points_in_event + 1])
+        peak_rights = np.concatenate([split_points_in_event, [peak.right]])
+        hits = hits[hits['index_of_maximum'] >= peak.left]
+        peak_of_hit = np.searchsorted(peak_lefts[1:], hits['index_of_maximum'], side='right')
+        hits = hits[np.argsort(peak_of_hit, kind='mergesort')]
+        hits_per_peak = np.split(hits, np.cumsum(np.bincount(peak_of_hit, minlength=len(peak_lefts)))[:-1])
+
+        for left, right, hs in zip(peak_lefts, peak_rights, hits_per_peak):
             if not len(hs):
                 # Hits have probably been removed by area > 0 condition
                 self.log.info("Localminimumclustering requested creation of peak %s-%s without hits. "
@@ -108,12 +108,62 @@ class LocalMinimumClustering(plugin.ClusteringPlugin):
                               "but it should be very rare." % (left, right))
                 continue
 
-            right = right if right < float('inf') else peak.right
-
-            if not len(hs):
-                raise RuntimeError("Attempt to create a peak without hits in LocalMinimumClustering!")
-
-            yield self.build_peak(hits=hs, detector=peak.detector, left=left, right=right)
+            yield self.build_peak(hits=hs, detector=peak.detector, left=int(left), right=int(right))
+
+
+@numba.jit(numba.int64(numba.float64[:],
+                       numba.from_dtype(datastructure.Hit.get_dtype())[:],
+                       numba.int64[:],
+                       numba.from_dtype(datastructure.Hit.get_dtype())[:],
+                       numba.float64, numba.float64, numba.int64, numba.int64, numba.int64, numba.float64),
+           nopython=True)
+def split_hits(w, hits, split_points, hits_buffer,
+               adc_to_pe, noise_sigma_pe, dt, start, pulse_i, saturation_threshold):
+    """Split hits from one pulse with waveform w (in ADC counts above baseline) at split_points.
+    Split points are indices in the event, and must be sorted. Samples at the split points fall to the left piece.
+    Fills hits_buffer with the pieces, and returns the number of pieces. hits_buffer must be large enough to hold
+    all pieces (number of hits + number of split points in each hit).
+    Hits are split at each split point in turn, as if the hits list was remade after every split point:
+    if the remainder of a hit right of a split point has 0 or negative area, it will not be split any further.
+    Pieces with 0 or negative area are not removed here.
+    """
+    n_pieces = 0
+    hit_bounds = np.zeros((2, 2), dtype=np.int64)
+    for hit_i in range(len(hits)):
+        channel = hits[hit_i].channel
+        left = hits[hit_i].left
+        right = hits[hit_i].right
+
+        for split_i in range(np.searchsorted(split_points, left), len(split_points)):
+            x = split_points[split_i]
+            if x >= right:
+                break
+            hit_bounds[0, 0] = left
+            hit_bounds[0, 1] = x
+            hit_bounds[1, 0] = x + 1
+            hit_bounds[1, 1] = right
+            hit_bounds -= start     # build_hits expects hit bounds relative to pulse start
+            build_hits(w,
+                       hit_bounds,
+                       hits_buffer[n_pieces:n_pieces + 2],
+                       adc_to_pe,
+                       channel,
+                       noise_sigma_pe,
+                       dt,
+                       start,
+                       pulse_i,
+                       saturation_threshold,
+                       hit_bounds)       # TODO: Recompute central bounds in an intelligent way...
+            n_pieces += 1
+            left = x + 1
+            if hits_buffer[n_pieces].area <= 0:
+                # The remainder will be removed, so it is not split any further
+                break
+
+        # Keep the remainder of the hit right of the last split point
+        n_pieces += 1
+
+    return n_pieces
 
 
 def find_split_points(w, min_height, min_ratio):
@@ -139,12 +189,7 @@ def find_split_points(w, min_height, min_ratio):
 
         partial_xindex = np.arange(right-left)[::2]
 
-        # Some issue with memory usage by lowess, 10000/5000 samples will require 1/.18 Gb memory
-        # Skip abnormal long peaks
-        if right-left > 5e3:
-            continue
-        else:
-            _w = dsputils.smooth_lowess(w[left:right][::2], partial_xindex, frac=30/(right-left))
+        _w = dsputils.smooth_lowess(w[left:right][::2], partial_xindex, frac=30/(right-left))
         dw = np.diff(_w, n=1)
         minima = np.where((np.hstack((dw, -1)) > 0) & (np.hstack((1, dw)) <= 0))[0]
         maxima = np.where((np.hstack((dw, 1)) <= 0) & (np.hstack((-1, dw)) > 0))[0]
@@ -8,6 +8,7 @@ from pax.dsputils import saturation_correction
 class S2SpatialCorrection(plugin.TransformPlugin):
     """Compute S2 spatial(x,y) area correction
     """
+    uses_low_level_data = ()
 
     def startup(self):
         if 'xy_posrec_preference' not in self.config:
@@ -40,6 +41,7 @@ class S2SpatialCorrection(plugin.TransformPlugin):
 class S2SaturationCorrection(plugin.TransformPlugin):
     """Compute S2 saturation(x,y,pmtpattern) area correction
     """
+    uses_low_level_data = ('peak_arrays',)
 
     def startup(self):
         self.s2_patterns = self.processor.simulator.s2_patterns
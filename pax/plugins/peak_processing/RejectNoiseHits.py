@@ -17,16 +17,18 @@ class RejectNoiseHits(plugin.ClusteringPlugin):
         self.base_penalties = {int(k): v for k, v in self.config.get('base_penalties', {}).items()}
 
     def transform_event(self, event):
+        n_channels = event.n_channels
+
         # Penalty for each noise pulse
         penalty_per_ch = event.noise_pulses_in * self.config['penalty_per_noise_pulse']
 
         # Penalty for each lone hit
         lone_hits = event.get_peaks_by_type(desired_type='lone_hit', detector='all')
         self.log.debug("This event has %d lone hits" % len(lone_hits))
-        for lone_hit_peak in lone_hits:
-            channel = lone_hit_peak.hits[0]['channel']
-            event.lone_hits_per_channel_before[channel] += 1
-            penalty_per_ch[channel] += self.config['penalty_per_lone_hit']
+        lone_hits_per_channel = np.bincount(np.array([p.hits[0]['channel'] for p in lone_hits], dtype=np.int64),
+                                            minlength=n_channels)
+        event.lone_hits_per_channel_before += lone_hits_per_channel.astype(np.int16)
+        penalty_per_ch = penalty_per_ch + lone_hits_per_channel * self.config['penalty_per_lone_hit']
 
         # Add base penalties
         for channel, penalty in self.base_penalties.items():
@@ -37,52 +39,62 @@ class RejectNoiseHits(plugin.ClusteringPlugin):
                                        self.config['penalty_geq_this_is_suspicious'])[0]
         event.is_channel_suspicious[suspicious_channels] = True
 
-        peaks_to_delete = []
         rejected_hits = []
-        for peak_i, peak in enumerate(event.peaks):
-
-            suspicious_channels_in_peak = np.intersect1d(peak.contributing_channels, suspicious_channels)
-            if len(suspicious_channels_in_peak) == 0:
-                continue
-
-            # Which channels should we reject in this peak?
-            # First compute the 'witness area' for this peak: area not in suspicious channels
+        if len(suspicious_channels) and len(event.peaks):
+            # Concatenate the hits of all peaks, and remember which peak each hit belongs to
+            hits_per_peak = np.array([len(p.hits) for p in event.peaks])
+            hit_start = np.concatenate([[0], np.cumsum(hits_per_peak)])
+            hits = np.concatenate([p.hits for p in event.peaks])
+            peak_id = np.repeat(np.arange(len(event.peaks)), hits_per_peak)
+            channel = hits['channel'].astype(np.int64)
+            in_suspicious_channel = event.is_channel_suspicious[channel]
+
+            # Which channels should we reject in each peak?
+            # First compute the 'witness area' for each peak: area not in suspicious channels
             # We reject channels whose penalty is larger than the witness area
-            witness_area = np.sum(peak.area_per_channel[True ^ event.is_channel_suspicious])
-            channels_to_reject = [ch for ch in suspicious_channels_in_peak if penalty_per_ch[ch] > witness_area]
-            # self.log.debug('Witness area %s, penalties: %s' % (witness_area,
-            #                                                    [penalty_per_ch[ch]
-            #                                                     for ch in suspicious_channels_in_peak]))
-            if len(channels_to_reject) == 0:
-                continue
-
-            # Keep only hits not in the channels_to_reject
-            cut = np.in1d(peak.hits['channel'], channels_to_reject)
-            for hit_i in np.where(cut)[0]:
-                rejected_hits.append(peak.hits[hit_i])
-                event.n_hits_rejected[peak.hits[hit_i]['channel']] += 1
-
-            # Has the peak become empty? Then mark it for deletion.
-            if np.all(cut):
-                self.log.debug('Peak %d consists completely of rejected hits and will be deleted!' % peak_i)
-                peaks_to_delete.append(peak_i)
-                continue
-
-            else:
-                # Else replace the peak with a new peak containing only the remaining hits
-                event.peaks[peak_i] = self.build_peak(hits=peak.hits[True ^ cut], detector=peak.detector)
-
-        # Delete any peaks which have gone empty
-        event.peaks = [p for i, p in enumerate(event.peaks) if i not in peaks_to_delete]
+            witness_area = np.bincount(peak_id, weights=hits['area'] * ~in_suspicious_channel,
+                                       minlength=len(event.peaks))
+
+            # Total area of each (peak, suspicious channel) combination: only contributing channels (area > 0) count
+            suspicious_hits = np.where(in_suspicious_channel)[0]
+            peak_channel = peak_id[suspicious_hits] * n_channels + channel[suspicious_hits]
+            peak_channels, hit_to_peak_channel = np.unique(peak_channel, return_inverse=True)
+            area_in_peak_channel = np.bincount(hit_to_peak_channel, weights=hits['area'][suspicious_hits])
+            reject_peak_channel = ((area_in_peak_channel > 0) &
+                                   (penalty_per_ch[peak_channels % n_channels] >
+                                    witness_area[peak_channels // n_channels]))
+
+            # Keep only hits not in the channels to reject
+            cut = np.zeros(len(hits), dtype=np.bool_)
+            cut[suspicious_hits] = reject_peak_channel[hit_to_peak_channel]
+            rejected_hits = hits[cut]
+            event.n_hits_rejected += np.bincount(channel[cut], minlength=n_channels).astype(np.int16)
+
+            peaks_to_delete = []
+            for peak_i in np.unique(peak_id[cut]):
+                peak = event.peaks[peak_i]
+                peak_cut = cut[hit_start[peak_i]:hit_start[peak_i + 1]]
+
+                # Has the peak become empty? Then mark it for deletion.
+                if np.all(peak_cut):
+                    self.log.debug('Peak %d consists completely of rejected hits and will be deleted!' % peak_i)
+                    peaks_to_delete.append(peak_i)
+                else:
+                    # Else replace the peak with a new peak containing only the remaining hits
+                    event.peaks[peak_i] = self.build_peak(hits=peak.hits[True ^ peak_cut], detector=peak.detector)
+
+            # Delete any peaks which have gone empty
+            if len(peaks_to_delete):
+                peaks_to_delete = set(peaks_to_delete)
+                event.peaks = [p for i, p in enumerate(event.peaks) if i not in peaks_to_delete]
 
         # Count the remaining number of lone hits per channel
-        for peak in event.peaks:
-            if peak.n_contributing_channels == 1:
-                event.lone_hits_per_channel[peak.lone_hit_channel] += 1
+        lone_hit_channels = np.array([peak.lone_hit_channel for peak in event.peaks
+                                      if peak.n_contributing_channels == 1], dtype=np.int64)
+        event.lone_hits_per_channel += np.bincount(lone_hit_channels, minlength=n_channels).astype(np.int16)
 
         # Rebuild the event.all_hits field.
         if len(rejected_hits):
-            rejected_hits = np.array(rejected_hits)
             rejected_hits['is_rejected'] = True
             event.all_hits = np.concatenate([rejected_hits] + [p.hits for p in event.peaks])
 
@@ -38,7 +38,7 @@ class PosRecNeuralNet(plugin.PosRecPlugin):
 
         data.close()
 
-    def reconstruct_position(self, peak):
+    def reconstruct_position(self, peak, hitpattern_summary):
         input_areas = peak.area_per_channel[self.input_channels]
 
         # Run the neural net
@@ -17,7 +17,7 @@ class PosRecRobustWeightedMean(plugin.PosRecPlugin):
         self.outer_ring_pmts = self.config['outer_ring_pmts']
         self.outer_ring_multiplication_factor = self.config.get('outer_ring_multiplication_factor', 1)
 
-    def reconstruct_position(self, peak):
+    def reconstruct_position(self, peak, hitpattern_summary):
         # Upweigh the outer ring to compensate for their partial obscuration by the TPC wall
         area_per_channel = peak.area_per_channel.copy()
         area_per_channel[self.outer_ring_pmts] *= self.outer_ring_multiplication_factor
@@ -12,7 +12,7 @@ class PosRecThreeDPatternFit(plugin.PosRecPlugin):
         self.config.setdefault('statistic', 'likelihood_poisson')
         self.config.setdefault('only_s1s', True)
 
-    def reconstruct_position(self, peak):
+    def reconstruct_position(self, peak, hitpattern_summary):
         """Reconstruct position by optimizing hitpattern goodness of fit to per-PMT LCE map."""
         if self.config['only_s1s'] and peak.type != 's1':
             return None
@@ -20,7 +20,7 @@ class PosRecTopPatternFit(plugin.PosRecPlugin):
         # Load the S2 hitpattern fitter
         self.pf = self.processor.simulator.s2_patterns
 
-    def reconstruct_position(self, peak):
+    def reconstruct_position(self, peak, hitpattern_summary):
         """Reconstruct position by optimizing hitpattern goodness of fit to per-PMT LCE map.
         Secondly, append a goodness_of_fit value and ndf to existing ReconstructedPosition objects.
         """
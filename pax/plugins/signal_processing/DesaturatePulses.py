@@ -13,18 +13,47 @@ class DesaturatePulses(plugin.TransformPlugin):
 
     def startup(self):
         self.reference_baseline = self.config['digitizer_reference_baseline']
+        self.tpc_channels = np.array(self.config['channels_in_detector']['tpc'])
+        self.large_after_pulsing_channels = np.array(self.config['large_after_pulsing_channels'], dtype=np.int64)
 
     def transform_event(self, event):
-        tpc_channels = np.array(self.config['channels_in_detector']['tpc'])
+        if not len(event.pulses):
+            return event
+        pulse_left = np.array([p.left for p in event.pulses], dtype=np.int64)
+        pulse_right = np.array([p.right for p in event.pulses], dtype=np.int64)
+        pulse_channel = np.array([p.channel for p in event.pulses], dtype=np.int64)
+        pulse_maximum = np.array([p.maximum for p in event.pulses], dtype=np.float64)
+        pulse_baseline = np.array([p.baseline for p in event.pulses], dtype=np.float64)
 
         # Boolean array, tells us which pulses are saturated
-        is_saturated = np.array([p.maximum >= self.reference_baseline - p.baseline - 0.5
-                                 for p in event.pulses])
-
-        for pulse_i, pulse in enumerate(event.pulses):
-            # Consider only saturated pulses in the TPC
-            if not is_saturated[pulse_i] or pulse.channel not in tpc_channels:
-                continue
+        is_saturated = pulse_maximum >= self.reference_baseline - pulse_baseline - 0.5
+        in_tpc = np.in1d(pulse_channel, self.tpc_channels)
+
+        # Consider only saturated pulses in the TPC
+        to_desaturate = np.where(is_saturated & in_tpc)[0]
+        if not len(to_desaturate):
+            return event
+
+        # Interval index of the pulses that can serve as reference: non-saturated pulses in TPC channels
+        # without large afterpulsing, sorted by left edge.
+        # Since no reference pulse is longer than max_length, the pulses overlapping [left, right]
+        # all have their left edge in (left - max_length, right).
+        reference_ids = np.where((True ^ is_saturated) &
+                                 in_tpc &
+                                 (True ^ np.in1d(pulse_channel, self.large_after_pulsing_channels)))[0]
+        reference_ids = reference_ids[np.argsort(pulse_left[reference_ids], kind='mergesort')]
+        reference_left = pulse_left[reference_ids]
+        reference_right = pulse_right[reference_ids]
+        if len(reference_ids):
+            max_length = (reference_right - reference_left).max() + 1
+        else:
+            max_length = 0
+
+        # Waveforms in pe/bin of the reference pulses, computed only when needed
+        reference_waveforms = {}
+
+        for pulse_i in to_desaturate:
+            pulse = event.pulses[pulse_i]
 
             # Where is the current pulse saturated?
             saturated = pulse.raw_data <= 0            # Boolean array, True if sample is saturated
@@ -35,17 +64,27 @@ class DesaturatePulses(plugin.TransformPlugin):
             _where_saturated_diff = np.where(_where_saturated_diff > self.config['reference_region_samples'])[0]
             _where_saturated_list = np.split(_where_saturated_all, _where_saturated_diff+1)
 
-            # Find all pulses in TPC channels that overlap with the saturated & reference region
-            other_pulses = [p for i, p in enumerate(event.pulses)
-                            if p.left < pulse.right and p.right > pulse.left and
-                            not is_saturated[i] and
-                            p.channel in tpc_channels and
-                            p.channel not in self.config['large_after_pulsing_channels']]
+            # Find all reference pulses that overlap with the saturated & reference region
+            candidates = slice(np.searchsorted(reference_left, pulse.left - max_length, side='right'),
+                               np.searchsorted(reference_left, pulse.right, side='left'))
+            other_pulse_ids = reference_ids[candidates][reference_right[candidates] > pulse.left]
 
-            if not len(other_pulses):
+            if not len(other_pulse_ids):
                 # Rare case where no other pulses available, one channel going crazy?
                 continue
 
+            # Compute the (gain-weighted) sum waveform of the non-saturated pulses,
+            # over just the part that overlaps with this pulse
+            sumw = np.zeros(len(pulse.raw_data))
+            for i in np.sort(other_pulse_ids):
+                if i not in reference_waveforms:
+                    reference_waveforms[i] = self.waveform_in_pe(event.pulses[i])
+                p_w = reference_waveforms[i]
+                offset = pulse_left[i] - pulse.left
+                start = max(0, offset)
+                stop = min(len(sumw), offset + len(p_w))
+                sumw[start:stop] += p_w[start - offset:stop - offset]
+
             for peak_i, _where_saturated in enumerate(_where_saturated_list):
                 try:
                     first_saturated = _where_saturated.min()
@@ -57,18 +96,6 @@ class DesaturatePulses(plugin.TransformPlugin):
                 reference_slice = slice(max(0, first_saturated - self.config['reference_region_samples']),
                                         first_saturated)
 
-                # Compute the (gain-weighted) sum waveform of the non-saturated pulses
-                min_left = min([p.left for p in other_pulses + [pulse]])
-                max_right = max([p.right for p in other_pulses + [pulse]])
-                sumw = np.zeros(max_right - min_left + 1)
-                for p in other_pulses:
-                    offset = p.left - min_left
-                    sumw[offset:offset + len(p.raw_data)] += self.waveform_in_pe(p)
-
-                # Crop it to include just the part that overlaps with this pulse
-                offset = pulse.left - min_left
-                sumw = sumw[offset:offset + len(pulse.raw_data)]
-
                 # Compute the ratio of this channel's waveform / the nonsaturated waveform in the reference region
                 w = self.waveform_in_pe(pulse)
                 if len(sumw[reference_slice][sumw[reference_slice] > 1]) \
@@ -2,6 +2,8 @@ import numba
 import numpy as np
 
 from pax import plugin
+from pax.plugins.signal_processing.CheckPulses import concatenate_adjacent_pulses, check_pulse_bounds, \
+    count_pulses_per_channel
 
 
 class PulseProperties(plugin.TransformPlugin):
@@ -60,6 +62,108 @@ class PulseProperties(plugin.TransformPlugin):
         return event
 
 
+class PreparePulses(plugin.TransformPlugin):
+    """Prepare the pulses for hitfinding in one pass over the event's pulses. Does, in this order, what these do:
+      - CheckPulses.SortPulses: sort pulses by channel, then left;
+      - CheckPulses.ConcatenateAdjacentPulses, if concatenate_adjacent_pulses is True;
+      - PulseProperties.PulseProperties, with the same options. The properties of all pulses are computed by one
+        call to compute_all_pulse_properties;
+      - CheckPulses.CheckBoundsAndCount, with the same options.
+    The concatenation and bounds check are done by the same functions those plugins use (see CheckPulses).
+    """
+    warning_given = False
+
+    def startup(self):
+        self.concatenate_adjacent_pulses = self.config.get('concatenate_adjacent_pulses', False)
+        self.truncate_pulses_partially_outside = self.config.get('truncate_pulses_partially_outside', False)
+        self.allow_pulse_completely_outside = self.config.get('allow_pulse_completely_outside', False)
+        self.reference_baseline = float(self.config['digitizer_reference_baseline'])
+        self.n_baseline = self.config.get('baseline_samples', 50)
+        self.shrink_data_threshold = self.config.get('shrink_data_threshold', float('inf'))
+        self.shrink_data_samples = self.config.get('shrink_data_samples', self.n_baseline)
+
+    def transform_event(self, event):
+        # Sanity check for sample_duration
+        if not self.config['sample_duration'] == event.sample_duration:
+            raise ValueError('Event %s quotes sample duration = %s ns, but sample_duration is set to %s!' % (
+                event.event_number, event.sample_duration, self.config['sample_duration']))
+
+        pulses = event.pulses
+        if len(pulses):
+            # Sort by channel, then left. Like sorted, lexsort is stable.
+            sort_order = np.lexsort((np.array([p.left for p in pulses], dtype=np.int64),
+                                     np.array([p.channel for p in pulses], dtype=np.int64)))
+            pulses = [pulses[i] for i in sort_order]
+
+            if self.concatenate_adjacent_pulses:
+                pulses = concatenate_adjacent_pulses(pulses, self.log)
+            self.compute_properties(pulses)
+            pulses = check_pulse_bounds(pulses, event.length(),
+                                        truncate_partially_outside=self.truncate_pulses_partially_outside,
+                                        allow_completely_outside=self.allow_pulse_completely_outside,
+                                        log=self.log)
+        event.pulses = pulses
+
+        # Count the number of pulses per channel
+        event.n_pulses_per_channel = count_pulses_per_channel(pulses, self.config['n_channels'])
+        event.n_pulses = event.n_pulses_per_channel.sum()
+
+        return event
+
+    def compute_properties(self, pulses):
+        """Compute the baseline, noise, etc. of the pulses, like PulseProperties does"""
+        # If the raw data has the pulse properties pre-computed, no action is taken from the first such pulse
+        n_to_do = len(pulses)
+        precomputed = np.where(True ^ np.isnan([p.minimum for p in pulses]))[0]
+        if len(precomputed):
+            if not self.warning_given:
+                self.log.info("Pulse properties have already been computed, doing nothing.")
+                self.warning_given = True
+            n_to_do = precomputed[0]
+        if not n_to_do:
+            return
+        pulses_to_do = pulses[:n_to_do]
+
+        pulse_lengths = np.array([len(p.raw_data) for p in pulses_to_do], dtype=np.int64)
+        pulse_start = np.zeros(n_to_do + 1, dtype=np.int64)
+        np.cumsum(pulse_lengths, out=pulse_start[1:])
+        results = np.zeros((n_to_do, 5), dtype=np.float64)
+        compute_all_pulse_properties(np.concatenate([p.raw_data for p in pulses_to_do]),
+                                     pulse_start, self.reference_baseline, self.n_baseline,
+                                     np.zeros(max(1, pulse_lengths.max()), dtype=np.float64),
+                                     results)
+
+        shrink = len(pulses) > self.shrink_data_threshold
+        for pulse, r in zip(pulses_to_do, results.tolist()):
+            pulse.baseline, pulse.baseline_increase, pulse.noise_sigma, pulse.minimum, pulse.maximum = r
+
+            if shrink:
+                # Remove the start and end of each pulse, see PulseProperties
+                pulse.raw_data = pulse.raw_data[self.shrink_data_samples:-self.shrink_data_samples]
+                pulse.right -= self.n_baseline
+                pulse.left += self.n_baseline
+
+
+@numba.jit(nopython=True)
+def compute_all_pulse_properties(raw_data, pulse_start, reference_baseline, baseline_samples, w_buffer, results):
+    """Compute the pulse properties of several pulses, see compute_pulse_properties.
+    :param raw_data: raw data of all pulses concatenated. Pulse i is raw_data[pulse_start[i]:pulse_start[i+1]].
+    :param w_buffer: float64 array at least as long as the longest pulse, used to hold the inverted waveform
+    :param results: (n_pulses, 5) float64 array, will be filled with the properties of each pulse
+    """
+    for pulse_i in range(len(pulse_start) - 1):
+        offset = pulse_start[pulse_i]
+        length = pulse_start[pulse_i + 1] - offset
+
+        # Subtract reference baseline, invert (so hits point up from baseline)
+        for k in range(length):
+            w_buffer[k] = reference_baseline - np.float64(raw_data[offset + k])
+
+        r = compute_pulse_properties(w_buffer[:length], baseline_samples)
+        for j in range(5):
+            results[pulse_i, j] = r[j]
+
+
 @numba.jit(numba.typeof((1.0, 1.0, 1.0, 1.0, 1.0))(numba.float64[:], numba.int64),
            nopython=True)
 def compute_pulse_properties(w, baseline_samples):
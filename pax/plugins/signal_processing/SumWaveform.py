@@ -1,84 +1,100 @@
 import numpy as np
 import numba
 
-from pax import plugin, datastructure, recarray_tools, dsputils
+from pax import plugin, datastructure, dsputils
 
 
 class SumWaveform(plugin.TransformPlugin):
 
     def startup(self):
         self.detector_by_channel = dsputils.get_detector_by_channel(self.config)
+        n_channels = self.config['n_channels']
 
-    def transform_event(self, event):
-
-        # Initialize empty waveforms for each detector
-        # One with only hits, one with raw data
+        # Names of the sum waveforms, in the order they are added to the event
+        # One with only hits, one with raw data for each detector, then top and bottom tpc hits-only waveforms
+        self.waveform_names = []
+        self.waveform_detectors = []
+        self.waveform_channels = []
         for postfix in ('', '_raw'):
             for detector, chs in self.config['channels_in_detector'].items():
-                event.sum_waveforms.append(datastructure.SumWaveform(
-                    samples=np.zeros(event.length(), dtype=np.float32),
-                    name=detector + postfix,
-                    channel_list=np.array(list(chs), dtype=np.uint16),
-                    detector=detector
-                ))
-
-        # Make dictionary mapping pulse -> non-rejected hits found in pulse
-        # Assumes hits are still sorted by pulse
-        event.all_hits = np.sort(event.all_hits, order='found_in_pulse')
-        hits_per_pulse = recarray_tools.dict_group_by(event.all_hits[True ^ event.all_hits['is_rejected']],
-                                                      'found_in_pulse')
-
-        # Add top and bottom tpc sum waveforms
+                self.waveform_names.append(detector + postfix)
+                self.waveform_detectors.append(detector)
+                self.waveform_channels.append(list(chs))
         for q in ('top', 'bottom'):
-            event.sum_waveforms.append(datastructure.SumWaveform(
-                samples=np.zeros(event.length(), dtype=np.float32),
-                name='tpc_%s' % q,
-                channel_list=np.array(self.config['channels_%s' % q], dtype=np.uint16),
-                detector='tpc'
-            ))
-
-        for pulse_i, pulse in enumerate(event.pulses):
-            channel = pulse.channel
-
-            # Do some initialization only when we switch channel
-            # The 'current_channel' variable can't be pulled outside the loop, that would hurt performance
-            # (trust me, try it and time it)
-            if pulse_i == 0 or channel != current_channel:      # noqa
-                current_channel = channel                       # noqa
-                detector = self.detector_by_channel[channel]
-                adc_to_pe = dsputils.adc_to_pe(self.config, channel)
-
-                if detector == 'tpc':
-                    if channel in self.config['channels_top']:
-                        sum_w = event.get_sum_waveform('tpc_top')
-                    else:
-                        sum_w = event.get_sum_waveform('tpc_bottom')
-                else:
-                    sum_w = event.get_sum_waveform(detector)
-
-            # Don't consider dead channels
-            if self.config['gains'][channel] == 0:
+            self.waveform_names.append('tpc_%s' % q)
+            self.waveform_detectors.append('tpc')
+            self.waveform_channels.append(self.config['channels_%s' % q])
+
+        # For each channel: index of the hits-only and raw sum waveform it contributes to, and conversion factor
+        # to pe/bin. Dead channels (gain 0) and channels outside any detector contribute to nothing (-1).
+        self.hits_waveform_index = -1 * np.ones(n_channels, dtype=np.int64)
+        self.raw_waveform_index = -1 * np.ones(n_channels, dtype=np.int64)
+        self.adc_to_pe = np.zeros(n_channels, dtype=np.float64)
+        for channel, detector in self.detector_by_channel.items():
+            if channel >= n_channels or self.config['gains'][channel] == 0:
                 continue
+            if detector == 'tpc':
+                if channel in self.config['channels_top']:
+                    self.hits_waveform_index[channel] = self.waveform_names.index('tpc_top')
+                else:
+                    self.hits_waveform_index[channel] = self.waveform_names.index('tpc_bottom')
+            else:
+                self.hits_waveform_index[channel] = self.waveform_names.index(detector)
+            self.raw_waveform_index[channel] = self.waveform_names.index(detector + '_raw')
+            self.adc_to_pe[channel] = dsputils.adc_to_pe(self.config, channel)
 
-            # Get the pulse waveform in pe/bin
-            baseline_to_subtract = self.config['digitizer_reference_baseline'] - pulse.baseline
-            w = baseline_to_subtract - pulse.raw_data.astype(np.float64)
-            w *= adc_to_pe
-
-            sum_w_raw = event.get_sum_waveform(detector+'_raw').samples
-            sum_w_raw[pulse.left:pulse.right+1] += w
-
-            hits = hits_per_pulse.get(pulse_i, None)
-            if hits is None:
-                continue
-
-            w_hits_only = w.copy()
-            # Obtain an array of same length as w, indicating whether the sample is in a hit or not
-            mask = np.zeros(len(w), dtype=np.bool)
-            set_if_in_ranges(mask, hits['left'] - pulse.left, hits['right'] - pulse.left)
-            w_hits_only[True ^ mask] = 0
-
-            sum_w.samples[pulse.left:pulse.right+1] += w_hits_only
+    def transform_event(self, event):
+        pulses = event.pulses
+        n_pulses = len(pulses)
+        for pulse in pulses:
+            if pulse.channel not in self.detector_by_channel:
+                raise KeyError("Pulse in channel %d, which is not in any detector" % pulse.channel)
+            if pulse.channel >= self.config['n_channels']:
+                raise IndexError("Pulse in channel %d, but there are only %d channels" % (pulse.channel,
+                                                                                          self.config['n_channels']))
+
+        # Table of pulse properties, and all pulse data concatenated
+        pulse_left = np.array([p.left for p in pulses], dtype=np.int64)
+        pulse_channel = np.array([p.channel for p in pulses], dtype=np.int64)
+        pulse_baseline = np.array([p.baseline for p in pulses], dtype=np.float64)
+        pulse_lengths = np.array([len(p.raw_data) for p in pulses], dtype=np.int64)
+        pulse_start = np.zeros(n_pulses + 1, dtype=np.int64)
+        np.cumsum(pulse_lengths, out=pulse_start[1:])
+        # The compiled code can't check bounds, so we must do it here
+        out_of_event = (pulse_left < 0) | (pulse_left + pulse_lengths > event.length())
+        if np.any(out_of_event):
+            pulse_i = np.where(out_of_event)[0][0]
+            raise ValueError("Pulse %d (samples %d-%d) extends beyond the event (%d samples)" % (
+                pulse_i, pulse_left[pulse_i], pulse_left[pulse_i] + pulse_lengths[pulse_i] - 1, event.length()))
+        # Use floats: pulses corrected by DesaturatePulses have float raw data, which may not fit in an int16
+        if n_pulses:
+            raw_data = np.concatenate([p.raw_data for p in pulses]).astype(np.float64, copy=False)
+        else:
+            raw_data = np.zeros(0, dtype=np.float64)
+
+        # Non-rejected hits, sorted by pulse
+        event.all_hits = np.sort(event.all_hits, order='found_in_pulse')
+        hits = event.all_hits[True ^ event.all_hits['is_rejected']]
+
+        # All sum waveforms are rows of one array
+        sum_waveforms = np.zeros((len(self.waveform_names), event.length()), dtype=np.float32)
+        build_sum_waveforms(raw_data, pulse_start, pulse_left, pulse_channel, pulse_baseline,
+                            hits['found_in_pulse'].astype(np.int64),
+                            hits['left'].astype(np.int64),
+                            hits['right'].astype(np.int64),
+                            self.config['digitizer_reference_baseline'],
+                            self.adc_to_pe, self.hits_waveform_index, self.raw_waveform_index,
+                            np.zeros(max(1, pulse_lengths.max() if n_pulses else 1), dtype=np.bool_),
+                            sum_waveforms)
+
+        for name, detector, chs, samples in zip(self.waveform_names, self.waveform_detectors,
+                                                self.waveform_channels, sum_waveforms):
+            event.sum_waveforms.append(datastructure.SumWaveform(
+                samples=samples,
+                name=name,
+                channel_list=np.array(chs, dtype=np.uint16),
+                detector=detector
+            ))
 
         # Sum the tpc top and bottom tpc waveforms
         event.get_sum_waveform('tpc').samples = event.get_sum_waveform('tpc_top').samples + \
@@ -87,8 +103,53 @@ class SumWaveform(plugin.TransformPlugin):
         return event
 
 
-@numba.jit(numba.void(numba.bool_[:], numba.int64[:], numba.int64[:]), nopython=True)
-def set_if_in_ranges(w, left, right):
-    """Set samples in w to True between ranges indicated by left and right (both inclusive)"""
-    for i in range(len(left)):
-        w[left[i]:right[i]+1] = True
+@numba.jit(numba.void(numba.float64[:], numba.int64[:], numba.int64[:], numba.int64[:], numba.float64[:],
+                      numba.int64[:], numba.int64[:], numba.int64[:],
+                      numba.float64, numba.float64[:], numba.int64[:], numba.int64[:],
+                      numba.bool_[:], numba.float32[:, :]),
+           nopython=True)
+def build_sum_waveforms(raw_data, pulse_start, pulse_left, pulse_channel, pulse_baseline,
+                        hit_pulse, hit_left, hit_right,
+                        reference_baseline, adc_to_pe, hits_waveform_index, raw_waveform_index,
+                        mask, sum_waveforms):
+    """Add all pulses to the raw sum waveforms, and their samples in hits to the hits-only sum waveforms.
+    :param raw_data: raw data of all pulses concatenated. Pulse i is raw_data[pulse_start[i]:pulse_start[i+1]].
+    :param hit_pulse, hit_left, hit_right: pulse index and bounds (inclusive, in event) of the hits,
+                                           sorted by pulse index.
+    :param hits_waveform_index, raw_waveform_index: row in sum_waveforms each channel contributes to, or -1
+    :param mask: scratch array at least as long as the longest pulse
+    :param sum_waveforms: n_waveforms * event length array, sum waveforms are added to it.
+    """
+    hit_i = 0
+    n_hits = len(hit_pulse)
+    for pulse_i in range(len(pulse_left)):
+        # Skip hits of pulses we don't look at (there shouldn't be any)
+        while hit_i < n_hits and hit_pulse[hit_i] < pulse_i:
+            hit_i += 1
+        first_hit = hit_i
+        while hit_i < n_hits and hit_pulse[hit_i] == pulse_i:
+            hit_i += 1
+
+        channel = pulse_channel[pulse_i]
+        raw_index = raw_waveform_index[channel]
+        if raw_index < 0:
+            # Dead channel
+            continue
+        hits_index = hits_waveform_index[channel]
+        left = pulse_left[pulse_i]
+        length = pulse_start[pulse_i + 1] - pulse_start[pulse_i]
+        baseline_to_subtract = reference_baseline - pulse_baseline[pulse_i]
+        conversion = adc_to_pe[channel]
+
+        # Indicate whether each sample is in a hit or not
+        mask[:length] = False
+        for j in range(first_hit, hit_i):
+            for k in range(max(0, hit_left[j] - left), min(length, hit_right[j] - left + 1)):
+                mask[k] = True
+
+        for k in range(length):
+            # Get the pulse waveform in pe/bin
+            w = (baseline_to_subtract - raw_data[pulse_start[pulse_i] + k]) * conversion
+            sum_waveforms[raw_index, left + k] += w
+            if mask[k]:
+                sum_waveforms[hits_index, left + k] += w
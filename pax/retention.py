@@ -0,0 +1,151 @@
+"""Retention of low-level event data: release memory-hungry data (raw pulse data, hits and per-peak arrays)
+of large events as soon as no plugin needs it anymore.
+
+Plugins declare which kinds of low-level data they use in their uses_low_level_data attribute
+(see pax.plugin.ProcessPlugin). Data is released by replacing arrays with empty ones, rather than zeroing them,
+so the memory is actually returned.
+"""
+import logging
+from collections import defaultdict
+
+import numpy as np
+import psutil
+
+from pax.datastructure import Event
+
+#: Kinds of low-level data which can be released:
+#:  raw_data: the raw_data of the pulses (the pulses themselves are kept)
+#:  hits: event.all_hits and the hits of each peak
+#:  peak_arrays: the per-channel arrays and sum waveforms of each peak (see PEAK_ARRAY_FIELDS)
+LOW_LEVEL_DATA = ('raw_data', 'hits', 'peak_arrays')
+
+PEAK_ARRAY_FIELDS = ('area_per_channel', 'hits_per_channel', 'coincidence_per_channel', 'n_saturated_per_channel',
+                     'sum_waveform', 'sum_waveform_top')
+
+
+def peak_array_lengths(n_channels, sample_duration, peak_waveform_length):
+    """Returns dictionary with the length of each of the PEAK_ARRAY_FIELDS of peaks whose arrays were not released,
+    given the number of channels, and the sample_duration and peak_waveform_length (see SumWaveformProperties).
+    """
+    n_waveform_samples = int(peak_waveform_length / sample_duration) + 1
+    return dict(area_per_channel=n_channels,
+                hits_per_channel=n_channels,
+                coincidence_per_channel=n_channels,
+                n_saturated_per_channel=n_channels,
+                sum_waveform=n_waveform_samples,
+                sum_waveform_top=n_waveform_samples)
+
+
+def low_level_data_size(event):
+    """Returns dictionary with the number of bytes used by each kind of low-level data in the event.
+    Arrays which are views into others (e.g. hits of peaks, sliced from all_hits) are counted by their own size only.
+    """
+    return dict(raw_data=sum([p.raw_data.nbytes for p in event.pulses]),
+                hits=event.all_hits.nbytes + sum([p.hits.nbytes for p in event.peaks]),
+                peak_arrays=sum([getattr(p, field_name).nbytes
+                                 for p in event.peaks for field_name in PEAK_ARRAY_FIELDS]))
+
+
+def largest_peak_indices(event, n=5):
+    """Returns list of indices in event.peaks of the first n S1s and S2s in the TPC, in the order of event.s1s()
+    (by tight coincidence, then area) and event.s2s() (by area).
+    """
+    return [event.get_peak_index(p) for p in event.s1s()[:n] + event.s2s()[:n]]
+
+
+def release_raw_data(event, keep=()):
+    """Replace the raw data of all pulses by empty arrays. keep is ignored."""
+    for pulse in event.pulses:
+        pulse.raw_data = np.zeros(0, dtype=pulse.raw_data.dtype)
+
+
+def release_hits(event, keep=()):
+    """Replace event.all_hits and the hits of all peaks, except those with index in keep, by empty arrays.
+    The hits of the kept peaks are copied, so they no longer hold on to a larger array they were sliced from.
+    """
+    event.all_hits = np.zeros(0, dtype=event.all_hits.dtype)
+    keep = set(keep)
+    for i, peak in enumerate(event.peaks):
+        if i in keep:
+            peak.hits = peak.hits.copy()
+        else:
+            peak.hits = np.zeros(0, dtype=peak.hits.dtype)
+    event.invalidate_peak_cache()
+
+
+def release_peak_arrays(event, keep=()):
+    """Replace the per-channel arrays and sum waveforms of all peaks, except those with index in keep, by empty arrays.
+    Also drops the event's cached PeakStore, which holds copies of these arrays.
+    """
+    keep = set(keep)
+    for i, peak in enumerate(event.peaks):
+        if i in keep:
+            continue
+        for field_name in PEAK_ARRAY_FIELDS:
+            setattr(peak, field_name, np.zeros(0, dtype=getattr(peak, field_name).dtype))
+    event.invalidate_peak_cache()
+
+
+RELEASE_FUNCTIONS = dict(raw_data=release_raw_data,
+                         hits=release_hits,
+                         peak_arrays=release_peak_arrays)
+
+
+class RetentionPolicy(object):
+    """Releases the low-level data of events whose low-level data takes more than budget bytes,
+    as soon as the last plugin using it (according to its uses_low_level_data) has run.
+    The peaks with index in largest_peak_indices(event) keep their hits and per-peak arrays.
+
+    Also keeps track of the memory use (resident set size) of the process after each event, and its maximum.
+    """
+
+    def __init__(self, plugins, budget=float('inf')):
+        self.log = logging.getLogger('RetentionPolicy')
+        self.budget = budget
+        self.peak_rss = 0
+        self.bytes_released = defaultdict(int)
+        self.n_events_released = 0
+        self.process = psutil.Process()
+
+        # Plugin index -> list of kinds of data to release after that plugin has run
+        # Data used by the last plugin is never released: we're done with the event anyway.
+        self.release_after = defaultdict(list)
+        for kind in LOW_LEVEL_DATA:
+            users = [i for i, p in enumerate(plugins)
+                     if p.uses_low_level_data is None or kind in p.uses_low_level_data]
+            if users and users[-1] < len(plugins) - 1:
+                self.release_after[users[-1]].append(kind)
+                self.log.debug("%s will be released after %s" % (kind, plugins[users[-1]].name))
+
+    def after_plugin(self, plugin_i, event):
+        """Release low-level data no longer needed after the plugin_i'th plugin has processed event"""
+        kinds = self.release_after.get(plugin_i)
+        if not kinds or self.budget == float('inf') or not isinstance(event, Event):
+            # Nothing to release, or the event has already been encoded for output
+            return
+        sizes = low_level_data_size(event)
+        if sum(sizes.values()) <= self.budget:
+            return
+        keep = largest_peak_indices(event)
+        for kind in kinds:
+            RELEASE_FUNCTIONS[kind](event, keep)
+            self.bytes_released[kind] += sizes[kind]
+        self.n_events_released += 1
+        self.log.debug("Event %d: low-level data takes %0.1f MB, released %s" % (
+            event.event_number, sum(sizes.values()) / 1e6, ', '.join(kinds)))
+
+    def after_event(self, event):
+        """Record the memory use after processing event"""
+        rss = self.process.memory_info().rss
+        self.log.debug("Event %s: RSS %0.1f MB" % (getattr(event, 'event_number', '?'), rss / 1e6))
+        self.peak_rss = max(self.peak_rss, rss)
+
+    def report(self):
+        """Log the peak memory use and how much low-level data was released"""
+        if self.peak_rss:
+            self.log.info("Largest RSS after an event: %0.1f MB" % (self.peak_rss / 1e6))
+        if self.n_events_released:
+            self.log.info("Released low-level data %d times, freeing %s" % (
+                self.n_events_released,
+                ', '.join(['%0.1f MB of %s' % (self.bytes_released[kind] / 1e6, kind)
+                           for kind in LOW_LEVEL_DATA if kind in self.bytes_released])))
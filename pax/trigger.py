@@ -3,8 +3,10 @@ from collections import defaultdict
 from copy import deepcopy
 from glob import glob
 import inspect
+import io
 import logging
 import os
+import threading
 import time
 import zipfile
 import zlib
@@ -17,6 +19,11 @@ from pax.utils import PAX_DIR
 from pax.datastructure import TriggerSignal
 from pax.exceptions import InvalidConfigurationError
 
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
 
 pulse_dtype = np.dtype([('time', np.int64),
                         ('pmt', np.int32),
@@ -33,7 +40,8 @@ class TriggerData(object):
         self.last_time_searched = 0                                 # Last time searched while querying this batch
         self.signals = np.array([], dtype=TriggerSignal.get_dtype())
         self.event_ranges = np.zeros((0, 2), dtype=np.int64)        # Event (left, right) time ranges (in ns)
-        self.signals_by_event = []                                  # Signals to save with each event
+        # (first, last) index in signals of the signals to save with each event
+        self.signal_indices_by_event = np.zeros((0, 2), dtype=np.int64)
         self.batch_info_doc = dict()                                # Status info about batch, saved by monitor
 
         # Deleted in early stages
@@ -87,11 +95,9 @@ class Trigger(object):
         ##
         # Initialize trigger monitor stuff
         ##
-        self.trigger_monitor_collection = trigger_monitor_collection
+        self.monitor_cache = []         # Cache of (data_type, doc), with doc document to insert into db / write to zip.
         if trigger_monitor_collection is None:
             self.log.info("No trigger monitor collection provided: won't write trigger monitor data to MongoDB")
-        self.monitor_cache = []         # Cache of (data_type, doc), with doc document to insert into db / write to zip.
-        self.data_type_counter = defaultdict(float)    # Counts how often a document of each data type has been inserted
 
         # Create a zipfile to store the trigger monitor data, if config says so
         # (the data is additionaly stored in a MongoDB, if trigger_monitor_collection was passed)
@@ -105,15 +111,25 @@ class Trigger(object):
                     pass
                 else:
                     raise
-            self.trigger_monitor_file = zipfile.ZipFile(trigger_monitor_file_path, mode='w')
+            trigger_monitor_file = zipfile.ZipFile(trigger_monitor_file_path, mode='w')
         else:
             self.log.info("Not trigger monitor file path provided: won't write trigger monitor data to Zipfile")
-            self.trigger_monitor_file = None
+            trigger_monitor_file = None
+
+        # The monitor data is encoded and written by a separate thread, so slow storage doesn't stall the trigger.
+        if trigger_monitor_file is not None or trigger_monitor_collection is not None:
+            self.monitor_writer = TriggerMonitorWriter(
+                trigger_monitor_file=trigger_monitor_file,
+                trigger_monitor_collection=trigger_monitor_collection,
+                max_queue_size=self.config.get('monitor_queue_size', 100),
+                min_binary_array_size=self.config.get('monitor_min_binary_array_size', 1000))
+        else:
+            self.monitor_writer = None
 
         self.end_of_run_info = defaultdict(float)
         self.end_of_run_info.update(pulses_read=0,
                                     signals_found=0,
-                                    trigger_monitor_data_format_version=2,
+                                    trigger_monitor_data_format_version=3,
                                     events_built=0,
                                     start_timestamp=time.time(),
                                     pax_version=pax.__version__,
@@ -166,21 +182,29 @@ class Trigger(object):
 
         self.previous_last_time_searched = 0
 
-    def run(self, last_time_searched, start_times=tuple(), channels=None, modules=None, areas=None, last_data=False):
+    def run(self, last_time_searched, start_times=tuple(), channels=None, modules=None, areas=None, last_data=False,
+            presorted=False):
         """Run on the specified data, yields ((start time, stop time), signals in event, event type identifier)
+        If presorted=True, start_times, channels, modules and areas must be lists with an array for each of several
+        streams of pulses (e.g. from different reader hosts), each sorted by time. These are merged rather than
+        sorted.
         """
         data = TriggerData(last_time_searched=last_time_searched, last_data=last_data)
-        data.input_data = dict(start_times=start_times, channels=channels, modules=modules, areas=areas)
+        data.input_data = dict(start_times=start_times, channels=channels, modules=modules, areas=areas,
+                               presorted=presorted)
+        if presorted:
+            pulses_read = sum([len(x) for x in start_times])
+        else:
+            pulses_read = len(start_times)
 
         # Hand over to each of the trigger plugins in turn.
         for plugin in self.plugins:
             self.log.debug("Passing data to plugin %s" % plugin.name)
             plugin.process(data)
         self.log.info("Trigger found %d event ranges, %d signals in %d pulses." % (
-            len(data.event_ranges), len(data.signals), len(start_times)))
+            len(data.event_ranges), len(data.signals), pulses_read))
 
         # Update and save the batch info doc
-        pulses_read = len(start_times)
         signals_found = len(data.signals)
         events_built = len(data.event_ranges)
         if events_built:
@@ -195,6 +219,8 @@ class Trigger(object):
                                         total_event_duration=total_event_duration,
                                         batch_duration=last_time_searched - self.previous_last_time_searched,
                                         is_last_data=data.last_data))
+        if self.monitor_writer is not None:
+            data.batch_info_doc['monitor_queue_depth'] = self.monitor_writer.queue.qsize()
         self.save_monitor_data('batch_info', data.batch_info_doc)
 
         # Update the end of run info
@@ -203,30 +229,20 @@ class Trigger(object):
         self.end_of_run_info['events_built'] += events_built
         self.end_of_run_info['total_event_duration'] += total_event_duration
 
-        # Store any documents in the monitor cache to disk / database
+        # Hand any documents in the monitor cache to the writer thread, which stores them to disk / database
         # We don't want to do break the trigger logic every time some plugin calls save_monitor_data, so this happens
-        # only at the end of each batch
+        # only at the end of each batch. If the writer falls too far behind, this blocks until it catches up.
         if len(self.monitor_cache):
-            if self.trigger_monitor_file is not None:
-                for data_type, d in self.monitor_cache:
-                    try:
-                        self.trigger_monitor_file.writestr("%s=%012d" % (data_type, self.data_type_counter[data_type]),
-                                                           zlib.compress(bson.BSON.encode(d)))
-                    except bson.errors.InvalidDocument:
-                        self.log.fatal("Error converting trigger monitor document to bson: %s" % d)
-                        raise
-                    self.data_type_counter[data_type] += 1
-
-            if self.trigger_monitor_collection is not None:
-                self.log.debug("Inserting %d trigger monitor documents into MongoDB" % len(self.monitor_cache))
-                result = self.trigger_monitor_collection.insert_many([d for _, d in self.monitor_cache])
-                self.log.debug("Inserted docs ids: %s" % result.inserted_ids)
+            if self.monitor_writer is not None:
+                self.monitor_writer.put(self.monitor_cache)
             self.monitor_cache = []
 
-        # Yield the events to the processor
+        # Yield the events to the processor. Signals of each event are a slice of the batch's signals array.
+        have_signals = len(data.signal_indices_by_event) > 0
         for event_i, (start, stop) in enumerate(data.event_ranges):
-            if data.signals_by_event:
-                yield (start, stop), data.signals_by_event[event_i]
+            if have_signals:
+                first, last = data.signal_indices_by_event[event_i]
+                yield (start, stop), data.signals[first:last + 1]
             else:
                 yield (start, stop), []
 
@@ -236,10 +252,14 @@ class Trigger(object):
         for p in self.plugins:
             p.shutdown()
 
-        # Close the trigger data file.
+        # Write the remaining monitor data and close the trigger data file.
         # Note this must be done after shutting down the plugins, they may add something on shutdown as well.
-        if self.trigger_monitor_file is not None:
-            self.trigger_monitor_file.close()
+        if self.monitor_writer is not None:
+            if len(self.monitor_cache):
+                self.monitor_writer.put(self.monitor_cache)
+                self.monitor_cache = []
+            self.monitor_writer.close()
+            self.end_of_run_info['max_monitor_queue_depth'] = self.monitor_writer.max_queue_depth
 
         # Add end-of-run info for the runs database
         self.end_of_run_info.update(dict(end_trigger_processing_timestamp=time.time()))
@@ -253,12 +273,128 @@ class Trigger(object):
           data_type: string indicating what kind of data this is (e.g. count_of_lone_pulses).
           data: either
             a dictionary with things bson.BSON.encode() will not crash on, or
-            a numpy array. It will be converted to a list, to ensure it is queryable by the DAQ website.
+            a numpy array. Small arrays are converted to a list, to ensure they are queryable by the DAQ website;
+            large ones are stored as an npy blob (see encode_monitor_doc).
           metadata: more data. Just convenience so you can pass numpy array as data, then something else as well.
         """
         if isinstance(data, np.ndarray):
-            data = {'data': data.tolist()}
+            # Copy, since plugins may reuse the array. It is encoded later by the writer thread.
+            data = {'data': data.copy()}
         data['data_type'] = data_type
         if metadata is not None:
             data.update(metadata)
         self.monitor_cache.append((data_type, data))
+
+
+class TriggerMonitorWriter(object):
+    """Writes trigger monitor documents to a zipfile and/or MongoDB collection in a background thread.
+    Documents are handed over in batches (lists of (data_type, doc)) through a bounded queue; the thread
+    encodes everything available in the queue at once, writes it to the zipfile and does one unordered bulk insert.
+    Errors in the thread are raised in the trigger's thread on the next put or on close.
+    """
+
+    def __init__(self, trigger_monitor_file=None, trigger_monitor_collection=None,
+                 max_queue_size=100, min_binary_array_size=1000):
+        self.log = logging.getLogger('TriggerMonitorWriter')
+        self.trigger_monitor_file = trigger_monitor_file
+        self.trigger_monitor_collection = trigger_monitor_collection
+        self.min_binary_array_size = min_binary_array_size
+        self.data_type_counter = defaultdict(float)    # Counts how often a document of each data type has been written
+        self.max_queue_depth = 0
+        self.exception = None
+
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.thread = threading.Thread(target=self.write_loop, name='TriggerMonitorWriter')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def put(self, docs):
+        """Queue a list of (data_type, doc) for writing. Blocks if the queue is full."""
+        self.raise_if_failed()
+        self.max_queue_depth = max(self.max_queue_depth, self.queue.qsize() + 1)
+        self.queue.put(docs)
+
+    def close(self):
+        """Write all queued documents, stop the thread and close the zipfile"""
+        self.queue.put(None)
+        self.thread.join()
+        if self.trigger_monitor_file is not None:
+            self.trigger_monitor_file.close()
+        self.raise_if_failed()
+
+    def raise_if_failed(self):
+        if self.exception is not None:
+            raise self.exception
+
+    def write_loop(self):
+        done = False
+        while not done:
+            # Get all batches currently waiting in the queue
+            batches = [self.queue.get()]
+            while True:
+                try:
+                    batches.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if batches[-1] is None:
+                done = True
+                batches = batches[:-1]
+
+            if self.exception is not None:
+                # We already failed: discard the data, so the trigger doesn't block on a full queue.
+                # It will raise the exception soon.
+                continue
+            try:
+                self.write([x for docs in batches for x in docs])
+            except Exception as e:
+                self.log.exception("Error writing trigger monitor data")
+                self.exception = e
+
+    def write(self, docs):
+        docs = [(data_type, encode_monitor_doc(d, self.min_binary_array_size)) for data_type, d in docs]
+        if not len(docs):
+            return
+
+        if self.trigger_monitor_file is not None:
+            for data_type, d in docs:
+                try:
+                    self.trigger_monitor_file.writestr("%s=%012d" % (data_type, self.data_type_counter[data_type]),
+                                                       zlib.compress(bson.BSON.encode(d)))
+                except bson.errors.InvalidDocument:
+                    self.log.fatal("Error converting trigger monitor document to bson: %s" % d)
+                    raise
+                self.data_type_counter[data_type] += 1
+
+        if self.trigger_monitor_collection is not None:
+            self.log.debug("Inserting %d trigger monitor documents into MongoDB" % len(docs))
+            result = self.trigger_monitor_collection.insert_many([d for _, d in docs], ordered=False)
+            self.log.debug("Inserted docs ids: %s" % result.inserted_ids)
+
+
+def encode_monitor_doc(doc, min_binary_array_size=1000):
+    """Return trigger monitor document with numpy array values made BSON-encodable.
+    Arrays with at least min_binary_array_size elements are stored as npy blobs (bytes of np.save),
+    with field_format = 'npy' added to the document; smaller arrays are converted to lists.
+    """
+    result = dict()
+    for k, v in doc.items():
+        if isinstance(v, np.ndarray):
+            if v.size >= min_binary_array_size:
+                f = io.BytesIO()
+                np.save(f, v, allow_pickle=False)
+                v = bson.binary.Binary(f.getvalue())
+                result['%s_format' % k] = 'npy'
+            else:
+                v = v.tolist()
+        result[k] = v
+    return result
+
+
+def decode_monitor_doc(doc):
+    """Inverse of encode_monitor_doc: converts npy blobs in a trigger monitor document back to numpy arrays"""
+    doc = dict(doc)
+    for k in list(doc.keys()):
+        if doc.get('%s_format' % k) == 'npy':
+            doc[k] = np.load(io.BytesIO(doc[k]), allow_pickle=False)
+            del doc['%s_format' % k]
+    return doc
@@ -1,5 +1,5 @@
 import numpy as np
-from collections import OrderedDict
+import numba
 from pax.trigger import TriggerPlugin
 from pax import exceptions
 
@@ -8,91 +8,173 @@ class DeadTimeTally(TriggerPlugin):
     """Counts the total dead time due to each veto system (HEV, busy) and stores it in the trigger data
     TODO: once we start operating the high-energy veto, we need to monitor the exact time either one of them is on.
 
-    I have not tested the speed at all: if it is slow, we need to move the loop over times to numba.
+    The on/off state machine runs in numba over all acquisition monitor pulses in a batch at once,
+    see tally_dead_time. The state of each system (active, start of current dead time, tally so far)
+    is kept in arrays on the plugin, so dead time straddling batches is accounted correctly.
     """
 
     def startup(self):
         # Read the on/off status channels from the configuration
-        self.systems = OrderedDict()
+        self.system_names = []
         self.special_channels = {}
+        on_channels = {}
+        off_channels = {}
         for detector, channels in self.trigger.pax_config['DEFAULT']['channels_in_detector'].items():
             if detector.endswith('_on') or detector.endswith('_off'):
                 assert len(channels) == 1
                 channel = channels[0]
                 system, status = detector.split('_')
-                if system not in self.systems:
-                    self.systems[system] = {'active': False, 'start_of_current_dead_time': 0, 'dead_time_tally': 0}
+                if system not in self.system_names:
+                    self.system_names.append(system)
                 if status == 'on':
-                    self.systems[system]['on_channel'] = channel
+                    on_channels[system] = channel
                 elif status == 'off':
-                    self.systems[system]['off_channel'] = channel
+                    off_channels[system] = channel
                 else:
                     raise exceptions.InvalidConfigurationError("Veto system status must be "
                                                                "'on' or 'off', not %s" % status)
                 self.special_channels[channel] = {'system': system, 'means_on': status == 'on'}
 
-        self.log.info("Dead time tally info: %s" % str(self.systems))
-        self.log.info("Special channels: %s" % str(self.special_channels))
-        self.next_save_time = self.config['dark_rate_save_interval']
-
-    def save_monitor_data(self):
-        # Save the dead time in this interval
-        dead_times = {'time': self.next_save_time}
-        for system_name, system in self.systems.items():
+        # Build channel -> (system index, means_on) lookup arrays for the numba state machine.
+        # Channels which are not on/off channels get system index -1.
+        n_systems = len(self.system_names)
+        max_channel = max(self.special_channels.keys()) if len(self.special_channels) else 0
+        self.channel_to_system = -1 * np.ones(max_channel + 1, dtype=np.int64)
+        self.channel_means_on = np.zeros(max_channel + 1, dtype=np.bool_)
+        for channel, ch_info in self.special_channels.items():
+            self.channel_to_system[channel] = self.system_names.index(ch_info['system'])
+            self.channel_means_on[channel] = ch_info['means_on']
 
-            if system['active']:
-                # The system is currently active!
-                # Register dead time up to the save boundary, then change the start time to the boundary
-                system['dead_time_tally'] += self.next_save_time - system['start_of_current_dead_time']
-                system['start_of_current_dead_time'] = self.next_save_time
+        # State of each system, preserved between batches
+        self.active = np.zeros(n_systems, dtype=np.bool_)
+        self.start_of_current_dead_time = np.zeros(n_systems, dtype=np.int64)
+        self.dead_time_tally = np.zeros(n_systems, dtype=np.int64)
 
-            dead_times[system_name] = int(system['dead_time_tally'])   # numpy int crap
-            system['dead_time_tally'] = 0
+        self.log.info("Dead time tally systems: %s" % str(dict(on_channels=on_channels, off_channels=off_channels)))
+        self.log.info("Special channels: %s" % str(self.special_channels))
+        self.next_save_time = int(self.config['dark_rate_save_interval'])
 
-        self.trigger.save_monitor_data('dead_time_info', dead_times)
+    def save_monitor_data(self, save_time, dead_times):
+        """Save the dead time of each system (array ordered like self.system_names) in the interval ending at
+        save_time"""
+        doc = {'time': int(save_time)}
+        for system_i, system_name in enumerate(self.system_names):
+            doc[system_name] = int(dead_times[system_i])   # numpy int crap
+        self.trigger.save_monitor_data('dead_time_info', doc)
 
     def process(self, data):
-        self.save_interval = self.config['dark_rate_save_interval']
+        self.save_interval = int(self.config['dark_rate_save_interval'])
         special_pulses = data.pulses[np.in1d(data.pulses['pmt'], list(self.special_channels.keys()))]
         special_pulses.sort(order='time')
         self.log.info("Found %d signals in on/off acquisition monitor channels" % len(special_pulses))
 
-        invalid_state_message_to = self.log.warning
-        for p in special_pulses:
-
-            while p['time'] >= self.next_save_time:
-                self.save_monitor_data()
-                self.next_save_time += self.save_interval
-
-            ch_info = self.special_channels[p['pmt']]
-            system_name = ch_info['system']
-            system = self.systems[system_name]
-            if system['active']:
-                if ch_info['means_on']:
-                    invalid_state_message_to("%s-on signal received while system was already active! The signal has"
-                                             " been ignored; similar invalid state messages have been suppressed "
-                                             "for this batch." % system_name)
-                    invalid_state_message_to = self.log.debug
-                else:
-                    # System has turned off
-                    system['active'] = False
-                    system['dead_time_tally'] += p['time'] - system['start_of_current_dead_time']
-            else:
-                if ch_info['means_on']:
-                    # System has turned on
-                    system['active'] = True
-                    system['start_of_current_dead_time'] = p['time']
-                else:
-                    invalid_state_message_to("%s-off signal received while system was not yet active! The signal has"
-                                             " been ignored; similar invalid state messages have been suppressed "
-                                             "for this batch." % system_name)
-                    invalid_state_message_to = self.log.debug
+        # If this is the last data, we must also save all intervals up to the last time searched,
+        # even if there are no pulses there.
+        # If there is no dead time anywhere in the run, this is actually the only time we store information!
+        flush_until = int(data.last_time_searched) if data.last_data else -1
+        last_time = max(special_pulses['time'][-1] if len(special_pulses) else -1, flush_until)
+        if last_time >= self.next_save_time:
+            n_intervals = int((last_time - self.next_save_time) // self.save_interval) + 1
+        else:
+            n_intervals = 0
+
+        n_systems = len(self.system_names)
+        dead_times = np.zeros((n_intervals, n_systems), dtype=np.int64)
+        invalid_on = np.zeros(n_systems, dtype=np.int64)
+        invalid_off = np.zeros(n_systems, dtype=np.int64)
+        first_save_time = self.next_save_time
+
+        self.next_save_time = tally_dead_time(times=special_pulses['time'].astype(np.int64),
+                                              channels=special_pulses['pmt'].astype(np.int64),
+                                              channel_to_system=self.channel_to_system,
+                                              channel_means_on=self.channel_means_on,
+                                              active=self.active,
+                                              start_of_current_dead_time=self.start_of_current_dead_time,
+                                              dead_time_tally=self.dead_time_tally,
+                                              next_save_time=self.next_save_time,
+                                              save_interval=self.save_interval,
+                                              flush_until=flush_until,
+                                              dead_times_buffer=dead_times,
+                                              invalid_on=invalid_on,
+                                              invalid_off=invalid_off)
+
+        for interval_i in range(n_intervals):
+            self.save_monitor_data(first_save_time + interval_i * self.save_interval, dead_times[interval_i])
+
+        for system_i, system_name in enumerate(self.system_names):
+            if invalid_on[system_i]:
+                self.log.warning("%d %s-on signals received while system was already active! These signals have "
+                                 "been ignored." % (invalid_on[system_i], system_name))
+            if invalid_off[system_i]:
+                self.log.warning("%d %s-off signals received while system was not yet active! These signals have "
+                                 "been ignored." % (invalid_off[system_i], system_name))
 
         if data.last_data:
             # Save the dead time info for the final part of the run
-            # If there is no dead time anywhere in the run, this is actually the only time
-            # we store information!
-            while data.last_time_searched >= self.next_save_time:
-                self.save_monitor_data()
-                self.next_save_time += self.save_interval
-            self.save_monitor_data()
+            final_dead_times = np.zeros(n_systems, dtype=np.int64)
+            close_interval(self.next_save_time, self.active, self.start_of_current_dead_time,
+                           self.dead_time_tally, final_dead_times)
+            self.save_monitor_data(self.next_save_time, final_dead_times)
+            self.next_save_time += self.save_interval
+
+
+@numba.jit(nopython=True)
+def close_interval(save_time, active, start_of_current_dead_time, dead_time_tally, dead_times_out):
+    """Store the dead time of each system in the interval ending at save_time in dead_times_out,
+    then reset the tallies. Active systems have their dead time registered up to the save boundary,
+    and their dead time start moved to the boundary.
+    """
+    for system_i in range(len(active)):
+        if active[system_i]:
+            dead_time_tally[system_i] += save_time - start_of_current_dead_time[system_i]
+            start_of_current_dead_time[system_i] = save_time
+        dead_times_out[system_i] = dead_time_tally[system_i]
+        dead_time_tally[system_i] = 0
+
+
+@numba.jit(nopython=True)
+def tally_dead_time(times, channels, channel_to_system, channel_means_on,
+                    active, start_of_current_dead_time, dead_time_tally,
+                    next_save_time, save_interval, flush_until,
+                    dead_times_buffer, invalid_on, invalid_off):
+    """Run the veto on/off state machine over time-sorted acquisition monitor pulses.
+     - channel_to_system, channel_means_on: lookup arrays giving the system index and on/off meaning of each channel
+     - active, start_of_current_dead_time, dead_time_tally: per-system state, modified in-place
+     - next_save_time, save_interval: whenever a pulse at or after next_save_time is encountered,
+       the dead time in the interval is stored in the next row of dead_times_buffer.
+     - flush_until: after all pulses are processed, also store all intervals ending at or before this time.
+     - invalid_on, invalid_off: per-system counts of on (off) signals received while already on (off).
+    Returns the new next_save_time.
+    """
+    interval_i = 0
+    for pulse_i in range(len(times)):
+        t = times[pulse_i]
+        while t >= next_save_time:
+            close_interval(next_save_time, active, start_of_current_dead_time, dead_time_tally,
+                           dead_times_buffer[interval_i])
+            interval_i += 1
+            next_save_time += save_interval
+
+        system_i = channel_to_system[channels[pulse_i]]
+        if active[system_i]:
+            if channel_means_on[channels[pulse_i]]:
+                invalid_on[system_i] += 1
+            else:
+                # System has turned off
+                active[system_i] = False
+                dead_time_tally[system_i] += t - start_of_current_dead_time[system_i]
+        else:
+            if channel_means_on[channels[pulse_i]]:
+                # System has turned on
+                active[system_i] = True
+                start_of_current_dead_time[system_i] = t
+            else:
+                invalid_off[system_i] += 1
+
+    while flush_until >= next_save_time:
+        close_interval(next_save_time, active, start_of_current_dead_time, dead_time_tally,
+                       dead_times_buffer[interval_i])
+        interval_i += 1
+        next_save_time += save_interval
+
+    return next_save_time
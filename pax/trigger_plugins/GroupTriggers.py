@@ -10,28 +10,30 @@ class GroupTriggers(TriggerPlugin):
 
     def process(self, data):
         trigger_times = data.signals[data.signals['trigger']]['left_time']
-        event_ranges = []
         left_ext = self.config['left_extension']
         right_ext = self.config['right_extension']
         max_l = self.config['max_event_length']
-        truncated_events = 0
-        dead_time_due_to_truncation = 0
 
-        for group_of_tr in split_on_gap(trigger_times, self.config['event_separation']):
-            start = group_of_tr[0] - left_ext
-            stop = group_of_tr[-1] + right_ext
-            if stop - start > max_l:
-                self.log.warning("Event %d-%d too long (%0.2f ms), truncated to %0.2f ms. "
-                                 "Consider changing trigger settings!" % (start, stop,
-                                                                          (stop - start) / units.ms,
-                                                                          max_l / units.ms))
-                dead_time_due_to_truncation += stop - start - max_l
-                stop = start + max_l
-                truncated_events += 1
+        # Find the index of the first and last trigger in each group
+        first_i, last_i = group_boundaries(trigger_times, self.config['event_separation'])
 
-            event_ranges.append((start, stop))
+        event_ranges = np.zeros((len(first_i), 2), dtype=np.int64)
+        event_ranges[:, 0] = trigger_times[first_i] - left_ext
+        event_ranges[:, 1] = trigger_times[last_i] + right_ext
 
-        data.event_ranges = np.array(event_ranges, dtype=np.int64)
+        # Truncate events which are too long
+        event_lengths = event_ranges[:, 1] - event_ranges[:, 0]
+        is_truncated = event_lengths > max_l
+        truncated_events = int(np.sum(is_truncated))
+        dead_time_due_to_truncation = int(np.sum(event_lengths[is_truncated] - max_l))
+        for start, stop in event_ranges[is_truncated]:
+            self.log.warning("Event %d-%d too long (%0.2f ms), truncated to %0.2f ms. "
+                             "Consider changing trigger settings!" % (start, stop,
+                                                                      (stop - start) / units.ms,
+                                                                      max_l / units.ms))
+        event_ranges[is_truncated, 1] = event_ranges[is_truncated, 0] + max_l
+
+        data.event_ranges = event_ranges
 
         data.batch_info_doc['truncated_events'] = truncated_events
         data.batch_info_doc['dead_time_due_to_truncation'] = dead_time_due_to_truncation
@@ -39,10 +41,11 @@ class GroupTriggers(TriggerPlugin):
         self.trigger.end_of_run_info['dead_time_due_to_truncation'] += dead_time_due_to_truncation
 
 
-def split_on_gap(a, threshold):
-    """Split a into list of arrays, each separated by threshold or more"""
+def group_boundaries(a, threshold):
+    """Return (first indices, last indices) of groups in sorted array a, each separated by threshold or more"""
     if not len(a):
-        return []
-    if len(a) < 2:
-        return [a]
-    return np.split(a, np.where(np.diff(a) >= threshold)[0] + 1)
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    gap_i = np.where(np.diff(a) >= threshold)[0]
+    first_i = np.concatenate(([0], gap_i + 1))
+    last_i = np.concatenate((gap_i, [len(a) - 1]))
+    return first_i.astype(np.int64), last_i.astype(np.int64)
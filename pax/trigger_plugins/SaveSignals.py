@@ -17,16 +17,11 @@ class SaveSignals(TriggerPlugin):
         is_in_event = np.zeros(len(data.signals), dtype=np.bool)
 
         if len(data.signals) and len(data.event_ranges):
-            # sig_group_ind will hold, for each event,the start and stop (inclusive) index of signals
-            sig_idx = np.zeros((len(data.event_ranges), 2), dtype=np.int)
+            # sig_idx will hold, for each event, the start and stop (inclusive) index of signals.
+            # The trigger hands out each event's signals as a slice of data.signals using these indices.
+            sig_idx = np.zeros((len(data.event_ranges), 2), dtype=np.int64)
             group_signals(data.signals, data.event_ranges, sig_idx, is_in_event)
-
-            # It's ok to do a for loop in python over the events here,
-            # there's a python loop anyway for sending events out
-            signals_by_event = []
-            for event_i in range(len(data.event_ranges)):
-                signals_by_event.append(data.signals[sig_idx[event_i][0]:sig_idx[event_i][1] + 1])
-            data.signals_by_event = signals_by_event
+            data.signal_indices_by_event = sig_idx
 
         if self.save_mode:
             sigs = data.signals
@@ -29,6 +29,9 @@ class SortData(TriggerPlugin):
 
     def process(self, data):
         ind = data.input_data
+        if ind.get('presorted'):
+            self.merge_streams(data)
+            return
 
         # Find the sort order of the data.
         sort_order = np.argsort(ind['start_times'])
@@ -52,6 +55,102 @@ class SortData(TriggerPlugin):
         data.pulses = pulses
         del data.input_data
 
+    def merge_streams(self, data):
+        """Merge several streams of pulses, each already sorted by time, into one sorted pulses array.
+        data.input_data's values are lists with an array for each stream.
+        """
+        ind = data.input_data
+        times = ind['start_times']
+        n_streams = len(times)
+
+        # Concatenate the streams. Stream i is times[stream_start[i]:stream_start[i+1]], etc.
+        stream_start = np.zeros(n_streams + 1, dtype=np.int64)
+        np.cumsum([len(x) for x in times], out=stream_start[1:])
+        pulses = np.zeros(stream_start[-1], dtype=pulse_dtype)
+
+        have_pmts = ind['channels'] is not None and ind['modules'] is not None
+        have_areas = ind['areas'] is not None
+
+        def concatenate(arrays, dtype):
+            if not n_streams:
+                return np.zeros(0, dtype=dtype)
+            return np.concatenate([np.asarray(x, dtype=dtype) for x in arrays])
+
+        # Dummy arrays for missing fields, so numba sees the same types in both cases
+        merge_sorted_streams(
+            concatenate(times, np.int64),
+            concatenate(ind['channels'], np.int64) if have_pmts else np.zeros(0, dtype=np.int64),
+            concatenate(ind['modules'], np.int64) if have_pmts else np.zeros(0, dtype=np.int64),
+            concatenate(ind['areas'], np.float64) if have_areas else np.zeros(0, dtype=np.float64),
+            stream_start, have_pmts, have_areas, self.pmt_lookup, self.n_channels,
+            pulses['time'], pulses['pmt'], pulses['area'])
+
+        data.pulses = pulses
+        del data.input_data
+
+
+@numba.jit(nopython=True)
+def merge_sorted_streams(times, channels, modules, areas, stream_start, have_pmts, have_areas, pmt_lookup, n_channels,
+                         pulse_times, pulse_pmts, pulse_areas):
+    """k-way merge of several streams of pulses. times, channels, modules and areas contain the pulses of all streams
+    concatenated: stream i is times[stream_start[i]:stream_start[i+1]], etc.
+    Each stream's times must be sorted. Pulses with equal times are ordered by stream.
+    Writes the merged times, pmt numbers (from pmt_lookup, or n_channels if not have_pmts) and areas
+    (or 0 if not have_areas) to pulse_times, pulse_pmts and pulse_areas.
+    Keeps a binary heap of streams ordered by their next pulse time, so this takes O(n log k) time.
+    """
+    n_streams = len(stream_start) - 1
+    # Index in the concatenated arrays of the next pulse of each stream
+    position = stream_start[:-1].copy()
+
+    # Build the heap of streams with pulses left
+    heap = np.zeros(n_streams, dtype=np.int64)
+    n_heap = 0
+    for stream_i in range(n_streams):
+        if stream_start[stream_i + 1] > stream_start[stream_i]:
+            heap[n_heap] = stream_i
+            n_heap += 1
+    for i in range(n_heap // 2 - 1, -1, -1):
+        _sift_down(heap, n_heap, i, times, position)
+
+    for pulse_i in range(len(pulse_times)):
+        # The stream at the top of the heap has the earliest next pulse
+        stream_i = heap[0]
+        j = position[stream_i]
+        pulse_times[pulse_i] = times[j]
+        if have_pmts:
+            pulse_pmts[pulse_i] = pmt_lookup[modules[j], channels[j]]
+        else:
+            pulse_pmts[pulse_i] = n_channels
+        if have_areas:
+            pulse_areas[pulse_i] = areas[j]
+
+        position[stream_i] += 1
+        if position[stream_i] == stream_start[stream_i + 1]:
+            # Stream is done, replace it with the last stream in the heap
+            n_heap -= 1
+            heap[0] = heap[n_heap]
+        _sift_down(heap, n_heap, 0, times, position)
+
+
+@numba.jit(nopython=True)
+def _sift_down(heap, n_heap, i, times, position):
+    """Restore the heap property below heap index i. Streams are compared by their next pulse time, then index."""
+    while True:
+        smallest = i
+        for child in (2 * i + 1, 2 * i + 2):
+            if child < n_heap:
+                a = heap[child]
+                b = heap[smallest]
+                t_a = times[position[a]]
+                t_b = times[position[b]]
+                if t_a < t_b or (t_a == t_b and a < b):
+                    smallest = child
+        if smallest == i:
+            return
+        heap[i], heap[smallest] = heap[smallest], heap[i]
+        i = smallest
+
 
 @numba.jit(nopython=True)
 def get_pmt_numbers(channels, modules, pmts_buffer, pmt_lookup):
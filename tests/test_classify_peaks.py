@@ -0,0 +1,79 @@
+import unittest
+
+import numpy as np
+
+from pax import units
+from pax.datastructure import Event, Peak
+from pax.plugins.peak_processing.ClassifyPeaks import AdHocClassification, AdHocClassification1T
+
+
+def make_event(peak_kwargs):
+    e = Event.empty_event()
+    for kwargs in peak_kwargs:
+        e.peaks.append(Peak(detector='tpc', **kwargs))
+    return e
+
+
+def adhoc_classification_peak_by_peak(event):
+    """Reference implementation of AdHocClassification.transform_event: the XENON100 rules, one peak at a time"""
+    for peak in event.peaks:
+        # Don't work on noise and lone_hit
+        if peak.type in ('noise', 'lone_hit'):
+            continue
+
+        width = peak.range_area_decile[5]
+
+        if peak.area > 50:
+            # We don't have to worry about single electrons anymore
+            if width < 100 * units.ns:
+                peak.type = 's1'
+            elif width > 250 * units.ns:
+                peak.type = 's2'
+        else:
+            # Worry about SE-S1 identification.
+            if width < 75 * units.ns:
+                peak.type = 's1'
+            else:
+                if peak.area < 5:
+                    peak.type = 'coincidence'
+                elif width > 100 * units.ns:
+                    peak.type = 's2'
+
+    return event
+
+
+class TestClassifyPeaks(unittest.TestCase):
+
+    def test_adhoc_1t(self):
+        plugin = AdHocClassification1T(dict(s1_risetime_threshold=70,
+                                            s1_width_threshold=300,
+                                            tight_coincidence_threshold=2), processor=None)
+        fast = dict(area_decile_from_midpoint=-10 * np.ones(11), range_area_decile=100 * np.ones(11))
+        slow = dict(area_decile_from_midpoint=-500 * np.ones(11), range_area_decile=1000 * np.ones(11))
+        e = make_event([dict(type='unknown', tight_coincidence=3, area_fraction_top=1.5, **fast),
+                        dict(type='unknown', tight_coincidence=1, **fast),
+                        dict(type='unknown', n_contributing_channels=10, area_fraction_top=-0.2, **slow),
+                        dict(type='unknown', n_contributing_channels=2, **slow),
+                        dict(type='lone_hit', tight_coincidence=3, area_fraction_top=1.5, **fast)])
+        e = plugin.transform_event(e)
+        self.assertEqual([p.type for p in e.peaks], ['s1', 'unknown', 's2', 'unknown', 'lone_hit'])
+        self.assertEqual([p.area_fraction_top for p in e.peaks], [1, 0, 0, 0, 1.5])
+
+    def test_adhoc_matches_peak_by_peak(self):
+        plugin = AdHocClassification({}, processor=None)
+        rs = np.random.RandomState(0)
+        for _ in range(10):
+            peak_kwargs = []
+            for _ in range(50):
+                range_area_decile = np.zeros(11)
+                range_area_decile[5] = rs.choice([np.nan, 75, 100, 250, rs.uniform(0, 400)])
+                peak_kwargs.append(dict(type=str(rs.choice(['unknown', 's1', 's2', 'noise', 'lone_hit'])),
+                                        area=float(rs.choice([5, 50, 10 ** rs.uniform(-1, 3)])),
+                                        range_area_decile=range_area_decile))
+            result = plugin.transform_event(make_event(peak_kwargs))
+            should_get = adhoc_classification_peak_by_peak(make_event(peak_kwargs))
+            self.assertEqual([p.type for p in result.peaks], [p.type for p in should_get.peaks])
+
+
+if __name__ == '__main__':
+    unittest.main()
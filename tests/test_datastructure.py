@@ -11,7 +11,9 @@ import unittest
 
 import numpy as np
 
-from pax.datastructure import Event, Peak, SumWaveform
+from pax import data_model
+from pax.datastructure import Event, Peak, SumWaveform, Interaction
+from pax.plugin import TransformPlugin
 
 
 class TestDatastructure(unittest.TestCase):
@@ -107,6 +109,155 @@ class TestDatastructure(unittest.TestCase):
             self.assertIsInstance(s2s[i], Peak)
             self.assertEqual(s2s[i].area, area)
 
+    def test_peak_lookup_cache(self):
+        e = Event.empty_event()
+        for area, peak_type in [(3.0, 's2'), (1.0, 's1'), (2.0, 's2')]:
+            e.peaks.append(Peak({'area': area,
+                                 'type': peak_type,
+                                 'detector': 'tpc'}))
+        self.assertEqual([p.area for p in e.s2s()], [3.0, 2.0])
+        self.assertEqual(e.get_peak_indices_by_type('s2').tolist(), [0, 2])
+        self.assertEqual(e.get_peak_index(e.peaks[2]), 2)
+        with self.assertRaises(ValueError):
+            e.get_peak_index(Peak())
+
+        # Modifying a peak requires an explicit invalidation; appending a peak or replacing the peaks list
+        # invalidates the cache automatically
+        e.peaks[0].area = 1.5
+        self.assertEqual([p.area for p in e.s2s()], [1.5, 2.0])
+        e.invalidate_peak_cache()
+        self.assertEqual([p.area for p in e.s2s()], [2.0, 1.5])
+        e.peaks.append(Peak({'area': 5.0, 'type': 's2', 'detector': 'tpc'}))
+        self.assertEqual([p.area for p in e.s2s()], [5.0, 2.0, 1.5])
+        self.assertEqual(e.get_peak_index(e.peaks[3]), 3)
+        e.peaks = e.peaks[1:]
+        self.assertEqual(e.get_peak_indices_by_type('s2').tolist(), [1, 2])
+        self.assertEqual(e.get_peak_index(e.peaks[0]), 0)
+
+        # The returned lists can be modified without affecting the cache
+        e.s2s().pop()
+        self.assertEqual(len(e.s2s()), 2)
+
+    def test_peak_store(self):
+        e = Event.empty_event()
+        for i, (area, peak_type) in enumerate([(3.0, 's2'), (1.0, 's1'), (2.0, 'lone_hit')]):
+            e.peaks.append(Peak(area=area,
+                                type=peak_type,
+                                detector='tpc',
+                                left=i,
+                                area_per_channel=np.arange(4, dtype=np.float64) * area,
+                                sum_waveform=np.ones(i + 1, dtype=np.float32)))
+        store = e.get_peak_store()
+        self.assertIs(store, e.get_peak_store())
+        self.assertEqual(len(store), 3)
+        np.testing.assert_array_equal(store.scalars['area'], [3.0, 1.0, 2.0])
+        np.testing.assert_array_equal(store.scalars['left'], [0, 1, 2])
+        self.assertEqual(store.scalars['type'].tolist(), ['s2', 's1', 'lone_hit'])
+        self.assertEqual(store.arrays['area_per_channel'].shape, (3, 4))
+        self.assertEqual(store.arrays['range_area_decile'].shape, (3, 11))
+        self.assertEqual(store.ragged['sum_waveform'][1].tolist(), [0, 1, 3, 6])
+
+        # The store is a copy, which is rebuilt after invalidating the cache
+        e.peaks[1].area_per_channel *= 2
+        e.peaks[0].type = 's1'
+        self.assertIs(e.get_peak_store(), store)
+        np.testing.assert_array_equal(store.arrays['area_per_channel'][1], [0, 1, 2, 3])
+        e.invalidate_peak_cache()
+        new_store = e.get_peak_store()
+        self.assertIsNot(new_store, store)
+        np.testing.assert_array_equal(new_store.arrays['area_per_channel'][1], [0, 2, 4, 6])
+        self.assertEqual(new_store.scalars['type'].tolist(), ['s1', 's1', 'lone_hit'])
+
+        view = new_store.peak_view(0)
+        self.assertEqual(view.area, 3.0)
+        self.assertEqual(view.type, 's1')
+        np.testing.assert_array_equal(view.area_per_channel, e.peaks[0].area_per_channel)
+
+    def test_peak_cache_between_plugins(self):
+        class Reclassify(TransformPlugin):
+            def transform_event(self, event):
+                event.peaks[0].type = 's1'
+                return event
+
+        e = Event.empty_event()
+        e.peaks.append(Peak(area=1.0, type='s2', detector='tpc'))
+        self.assertEqual(len(e.s2s()), 1)
+        Reclassify({}, processor=None).process_event(e)
+        self.assertEqual(len(e.s2s()), 0)
+        self.assertEqual(len(e.s1s()), 1)
+
+    def test_hitpattern_summary(self):
+        e = Event.empty_event()
+        pmt_locations = np.array([[0, 0], [1, 0], [0, 1], [5, 5]], dtype=np.float64)
+        for area_per_channel in ([1, 1, 0, 0], [0, 0, 2, 0], [0, 0, 0, 0], [1, 2, 3, 4]):
+            e.peaks.append(Peak(area_per_channel=np.array(area_per_channel + [7], dtype=np.float64)))
+
+        summary = e.get_hitpattern_summary([0, 1, 2, 3], pmt_locations)
+        self.assertIs(summary, e.get_hitpattern_summary([0, 1, 2, 3], pmt_locations))
+        np.testing.assert_array_equal(summary['area'], [2, 2, 0, 10])
+        np.testing.assert_array_equal(summary['max_pmt'][[0, 1, 3]], [0, 2, 3])
+        np.testing.assert_array_equal(summary['empty'], [False, False, True, False])
+        np.testing.assert_almost_equal(summary['mean_position'][[0, 1]], [[0.5, 0], [0, 1]])
+        np.testing.assert_almost_equal(summary['spread'][[0, 1]], [0.5, 0])
+        self.assertTrue(np.all(np.isnan(summary['mean_position'][2])))
+        self.assertTrue(np.isnan(summary['spread'][2]))
+
+        # Compare with the weighted averages computed directly
+        hitpattern = e.peaks[3].area_per_channel[:4]
+        mean_position = np.average(pmt_locations, weights=hitpattern, axis=0)
+        np.testing.assert_almost_equal(summary['mean_position'][3], mean_position)
+        np.testing.assert_almost_equal(summary['spread'][3], np.sqrt(np.average(
+            np.sum((pmt_locations - mean_position) ** 2, axis=1), weights=hitpattern)))
+
+        # Peaks with all area in one channel have exactly that channel's position and zero spread
+        e = Event.empty_event()
+        rs = np.random.RandomState(0)
+        pmt_locations = rs.uniform(-50, 50, size=(20, 2))
+        for channel in range(20):
+            area_per_channel = np.zeros(20)
+            area_per_channel[channel] = 10 ** rs.uniform(-1, 5)
+            e.peaks.append(Peak(area_per_channel=area_per_channel))
+        summary = e.get_hitpattern_summary(np.arange(20), pmt_locations)
+        np.testing.assert_array_equal(summary['mean_position'], pmt_locations)
+        np.testing.assert_array_equal(summary['spread'], np.zeros(20))
+
+    def test_casting(self):
+        p = Peak()
+        p.area = 3
+        self.assertIsInstance(p.area, float)
+        p.left = np.int32(4)
+        self.assertIs(type(p.left), int)
+        with self.assertRaises(TypeError):
+            p.left = 'four'
+        with self.assertRaises(TypeError):
+            p.area_per_channel = np.zeros(3, dtype=np.int8)
+        with self.assertRaises(AttributeError):
+            p.not_a_field = 3
+
+    def test_validation_off(self):
+        data_model.set_validation(False)
+        try:
+            p = Peak()
+            p.left = 'four'
+            self.assertEqual(p.left, 'four')
+            # No casting or dtype checks either, also not on construction
+            p.area = 3
+            self.assertIs(type(p.area), int)
+            p.area_per_channel = np.zeros(3, dtype=np.int8)
+            self.assertEqual(Interaction(s1='one').s1, 'one')
+        finally:
+            data_model.set_validation(True)
+
+        # All checks are back on
+        with self.assertRaises(TypeError):
+            p.left = 'four'
+        with self.assertRaises(TypeError):
+            p.area_per_channel = np.zeros(3, dtype=np.int8)
+        with self.assertRaises(TypeError):
+            Interaction(s1='one')
+        p.area = 3
+        self.assertIsInstance(p.area, float)
+
     def test_waveform_string_name(self):
         w = SumWaveform()
         self.assertIsInstance(w, SumWaveform)
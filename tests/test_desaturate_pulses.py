@@ -0,0 +1,71 @@
+import unittest
+
+import numpy as np
+
+from pax import datastructure
+from pax.plugins.signal_processing.DesaturatePulses import DesaturatePulses
+
+
+class TestDesaturatePulses(unittest.TestCase):
+
+    def setUp(self):
+        self.config = dict(n_channels=10,
+                           channels_in_detector={'tpc': list(range(8)), 'veto': [8, 9]},
+                           gains=[2e6] * 10,
+                           digitizer_reference_baseline=16000,
+                           sample_duration=7.3e10,     # Just makes adc_to_pe about 0.01
+                           digitizer_voltage_range=2.25,
+                           digitizer_bits=14,
+                           pmt_circuit_load_resistor=50,
+                           external_amplification=10,
+                           reference_region_samples=100,
+                           reference_region_samples_treshold=10,
+                           large_after_pulsing_channels=[7],
+                           convolution_length=100)
+        self.plugin = DesaturatePulses(self.config, processor=None)
+
+    def make_pulse(self, channel, left, amplitude, length=2000):
+        """Return pulse with a gaussian signal of amplitude (in ADC counts) in the middle, and its unclipped signal"""
+        signal = amplitude * np.exp(-0.5 * ((np.arange(length) - length / 2) / 200) ** 2)
+        raw_data = np.clip(np.round(self.config['digitizer_reference_baseline'] - signal), 0, 2**14 - 1)
+        raw_data = raw_data.astype(np.int16)
+        return datastructure.Pulse(channel=channel, left=left, right=left + length - 1,
+                                   raw_data=raw_data, baseline=0,
+                                   maximum=float((self.config['digitizer_reference_baseline'] - raw_data).max())), \
+            signal
+
+    def make_event(self, pulses):
+        return datastructure.Event(n_channels=self.config['n_channels'],
+                                   start_time=0,
+                                   sample_duration=10,
+                                   stop_time=int(1e6),
+                                   pulses=pulses)
+
+    def test_desaturate(self):
+        pulses = []
+        for ch in range(1, 7):
+            pulses.append(self.make_pulse(ch, 1000, 10000)[0])
+        saturated_pulse, signal = self.make_pulse(0, 1000, 50000)
+        # A saturated pulse far away from all others can't be corrected
+        lonely_pulse = self.make_pulse(2, 50000, 50000)[0]
+        e = self.plugin.transform_event(self.make_event(pulses + [saturated_pulse, lonely_pulse]))
+
+        corrected = e.pulses[6].raw_data
+        self.assertEqual(corrected.dtype, np.float64)
+        true_area = signal.sum()
+        self.assertGreater(((self.config['digitizer_reference_baseline'] - corrected)).sum(), 0.95 * true_area)
+        self.assertEqual(e.pulses[7].raw_data.dtype, np.int16)
+        for p in e.pulses[:6]:
+            self.assertEqual(p.raw_data.dtype, np.int16)
+
+    def test_no_reference(self):
+        # Only other pulse is in a channel with large afterpulsing, or partly overlapping in the veto
+        saturated_pulse = self.make_pulse(0, 1000, 50000)[0]
+        e = self.plugin.transform_event(self.make_event([self.make_pulse(7, 1000, 10000)[0],
+                                                         self.make_pulse(8, 1000, 10000)[0],
+                                                         saturated_pulse]))
+        self.assertEqual(e.pulses[2].raw_data.dtype, np.int16)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import unittest
+
+import numpy as np
+
+from pax import dsputils
+
+
+def smooth_lowess_dense(y, x, frac=1.0/2.0):
+    """Reference O(n^2) implementation of dsputils.smooth_lowess, using dense weight matrices"""
+    n = len(x)
+    neighborhood = np.ceil(frac*n)
+    w = np.clip(np.abs((x[:, None]-x[None, :])/neighborhood), 0.0, 1.0)
+    w = (1-w**3)**3
+    xmatrix = np.tile(x, n).reshape(n, n)
+    ymatrix = np.tile(y, n).reshape(n, n)
+    Ya = np.sum(w * ymatrix, axis=1) / np.sum(w, axis=1)
+    Xa = np.sum(w * xmatrix, axis=1) / np.sum(w, axis=1)
+    Yb = np.sum(w * xmatrix * ymatrix, axis=1) / np.sum(w * xmatrix, axis=1)
+    Xb = np.sum(w * xmatrix * xmatrix, axis=1) / np.sum(w * xmatrix, axis=1)
+    return Ya + (Yb - Ya) / (Xb - Xa) * (x - Xa)
+
+
+class TestSmoothLowess(unittest.TestCase):
+
+    def test_matches_dense(self):
+        np.random.seed(0)
+        for n, frac in ((100, 0.5), (1000, 30/2000), (1500, 0.05)):
+            x = np.arange(n)[::2].astype(np.float64)
+            y = np.exp(-(x - n/3)**2 / (n/10)**2) + 0.1 * np.random.randn(len(x))
+            np.testing.assert_allclose(dsputils.smooth_lowess(y, x, frac=frac),
+                                       smooth_lowess_dense(y, x, frac=frac),
+                                       rtol=1e-9, atol=1e-12)
+
+    def test_long_waveform(self):
+        # Would take ~80 Gb of memory with dense weight matrices
+        n = int(1e5)
+        x = np.arange(n).astype(np.float64)
+        y = np.sin(x / 1000)
+        result = dsputils.smooth_lowess(y, x, frac=30/n)
+        self.assertEqual(len(result), n)
+        np.testing.assert_allclose(result, y, atol=1e-3)
+
+
+if __name__ == '__main__':
+    unittest.main()
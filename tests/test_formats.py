@@ -0,0 +1,120 @@
+import os
+import unittest
+import tempfile
+import shutil
+
+import numpy as np
+
+from pax.formats import ColumnarDump, HDF5Dump
+
+
+def make_peaks(n, first_event=0):
+    peaks = np.zeros(n, dtype=[('Event', np.int64),
+                               ('area', np.float64),
+                               ('type', 'S32'),
+                               ('range_area_decile', np.float64, (11,))])
+    peaks['Event'] = first_event + np.arange(n) // 10
+    peaks['area'] = np.arange(n)
+    peaks['type'] = np.array([b's1', b's2', b'lone_hit'])[np.arange(n) % 3]
+    peaks['range_area_decile'] = np.arange(n)[:, np.newaxis] * np.ones(11)
+    return peaks
+
+
+class TestColumnarFormat(unittest.TestCase):
+
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+        self.peaks = np.concatenate([make_peaks(1000), make_peaks(1000, first_event=100)])
+
+        fmt = ColumnarDump()
+        fmt.row_group_size = 300
+        fmt.open(self.dirname, mode='w')
+        fmt.write_data({'Peak': self.peaks[:1000]})
+        fmt.write_data({'Peak': self.peaks[1000:]})
+        fmt.close()
+
+        self.fmt = ColumnarDump()
+        self.fmt.open(self.dirname, mode='r')
+
+    def tearDown(self):
+        self.fmt.close()
+        shutil.rmtree(self.dirname)
+
+    def test_read_back(self):
+        self.assertEqual(self.fmt.data_types_present, ['Peak'])
+        self.assertEqual(self.fmt.n_in_data('Peak'), len(self.peaks))
+        self.assertEqual(len(self.fmt.tables['Peak']['row_groups']), 8)
+        np.testing.assert_array_equal(self.fmt.read_data('Peak'), self.peaks)
+        np.testing.assert_array_equal(self.fmt.read_data('Peak', 250, 1350), self.peaks[250:1350])
+
+    def test_select_columns(self):
+        result = self.fmt.read_data('Peak', columns=['area'])
+        self.assertEqual(result.dtype.names, ('area',))
+        np.testing.assert_array_equal(result['area'], self.peaks['area'])
+
+    def test_predicate(self):
+        # Row groups outside the predicate range should not be read at all
+        read_row_groups = []
+        original_read = self.fmt._read_row_group
+
+        def counting_read(df_name, row_group, columns):
+            read_row_groups.append(row_group)
+            return original_read(df_name, row_group, columns)
+        self.fmt._read_row_group = counting_read
+
+        result = self.fmt.select('Peak', columns=['Event', 'area'],
+                                 predicate=[('Event', '>=', 150), ('type', '==', 's2')])
+        should_get = self.peaks[(self.peaks['Event'] >= 150) & (self.peaks['type'] == b's2')]
+        self.assertEqual(result.dtype.names, ('Event', 'area'))
+        np.testing.assert_array_equal(result['area'], should_get['area'])
+        self.assertEqual(len(read_row_groups), 3)
+
+        # Nothing passes
+        self.assertEqual(len(self.fmt.select('Peak', predicate=[('area', '>', 1e6)])), 0)
+
+    def test_iter_chunks(self):
+        chunks = list(self.fmt.iter_chunks('Peak', chunk_size=200))
+        self.assertTrue(all([len(c) <= 200 for c in chunks]))
+        np.testing.assert_array_equal(np.concatenate(chunks), self.peaks)
+
+    def test_predicate_nan(self):
+        # NaN values must not hide the other rows in the row group from predicates
+        dirname = tempfile.mkdtemp()
+        try:
+            x = np.zeros(30, dtype=[('x', np.float64)])
+            x['x'][:10] = [np.nan] + list(range(1, 10))
+            x['x'][10:20] = np.nan
+            x['x'][20:] = [np.nan] + [3] * 9
+            fmt = ColumnarDump()
+            fmt.row_group_size = 10
+            fmt.open(dirname, mode='w')
+            fmt.write_data({'Interaction': x})
+            fmt.close()
+
+            fmt = ColumnarDump()
+            fmt.open(dirname, mode='r')
+            self.assertEqual(fmt.select('Interaction', predicate=[('x', '>', 5)])['x'].tolist(), [6, 7, 8, 9])
+            self.assertEqual(len(fmt.select('Interaction', predicate=[('x', '!=', 3)])), 9 + 10 + 1)
+            fmt.close()
+        finally:
+            shutil.rmtree(dirname)
+
+
+class TestHDF5Format(unittest.TestCase):
+
+    def test_iter_chunks(self):
+        dirname = tempfile.mkdtemp()
+        peaks = make_peaks(1000)
+        fmt = HDF5Dump()
+        fmt.open(os.path.join(dirname, 'test.hdf5'), mode='w')
+        fmt.write_data({'Peak': peaks})
+        chunks = list(fmt.iter_chunks('Peak', chunk_size=300))
+        fmt.close()
+        shutil.rmtree(dirname)
+
+        self.assertEqual([len(c) for c in chunks], [300, 300, 300, 100])
+        np.testing.assert_array_equal(np.concatenate(chunks), peaks)
+
+
+if __name__ == '__main__':
+    unittest.main()
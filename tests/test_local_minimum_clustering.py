@@ -0,0 +1,54 @@
+import unittest
+
+import numpy as np
+
+from pax import datastructure
+from pax.plugins.signal_processing.HitFinder import build_hits
+from pax.plugins.peak_processing.LocalMinimumClustering import split_hits
+
+
+def split_hits_one_by_one(w, hits, split_points, **kwargs):
+    """Reference implementation of split_hits: split each straddling hit at each split point in turn,
+    remaking the hits list after every split point."""
+    for x in split_points:
+        selection = (hits['left'] <= x) & (hits['right'] > x)
+        new_hits = [hits[True ^ selection]]
+        for h in hits[selection]:
+            hits_buffer = np.zeros(2, dtype=datastructure.Hit.get_dtype())
+            hit_bounds = np.array([[h['left'], x], [x+1, h['right']]], dtype=np.int64) - kwargs['start']
+            build_hits(w, hit_bounds, hits_buffer, kwargs['adc_to_pe'], h['channel'], kwargs['noise_sigma_pe'],
+                       kwargs['dt'], kwargs['start'], kwargs['pulse_i'], kwargs['saturation_threshold'], hit_bounds)
+            new_hits.append(hits_buffer[hits_buffer['area'] > 0])
+        hits = np.concatenate(new_hits)
+    return hits
+
+
+class TestSplitHits(unittest.TestCase):
+
+    def test_matches_one_by_one(self):
+        np.random.seed(0)
+        start = 100
+        w = np.random.randn(500) + 5 * np.sin(np.arange(500) / 20.) ** 2
+        w[250:260] = -50    # Make some pieces have negative area
+
+        hits = np.zeros(6, dtype=datastructure.Hit.get_dtype())
+        hits['channel'] = 3
+        hits['left'] = np.array([0, 50, 120, 200, 240, 400]) + start
+        hits['right'] = np.array([30, 300, 130, 245, 480, 499]) + start
+        split_points = np.array([20, 60, 125, 210, 250, 262, 450], dtype=np.int64) + start
+
+        kwargs = dict(adc_to_pe=0.5, noise_sigma_pe=0.1, dt=10, start=start, pulse_i=7, saturation_threshold=1e3)
+        straddling = [np.any((split_points >= h['left']) & (split_points < h['right'])) for h in hits]
+        hits_buffer = np.zeros(len(hits) * (len(split_points) + 1), dtype=datastructure.Hit.get_dtype())
+        n = split_hits(w, hits[straddling], split_points, hits_buffer, **kwargs)
+        result = hits_buffer[:n]
+        result = np.concatenate([hits[np.invert(straddling)], result[result['area'] > 0]])
+
+        should_get = split_hits_one_by_one(w, hits, split_points, **kwargs)
+        result.sort(order='left')
+        should_get.sort(order='left')
+        np.testing.assert_array_equal(result, should_get)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+import logging
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import snappy
+
+
+class FakeCollection(object):
+    """Stand-in for a pymongo collection of pulse documents"""
+
+    def __init__(self, docs):
+        self.docs = docs
+        self.dropped = False
+
+    def find(self, query, projection=None):
+        assert not self.dropped
+        docs = [{k: v for k, v in d.items() if projection is None or projection.get(k)}
+                for d in self.docs if d['module'] == query['module']]
+        return FakeCursor(docs)
+
+
+class BrokenCollection(FakeCollection):
+
+    def find(self, query, projection=None):
+        raise IOError("Lost connection to the database")
+
+
+class FakeCursor(list):
+
+    def batch_size(self, n):
+        pass
+
+
+class FakeDB(dict):
+
+    def drop_collection(self, name):
+        self[name].dropped = True
+
+
+class TestRescueAcquisitionMonitorPulses(unittest.TestCase):
+
+    def setUp(self):
+        # Importing the MongoDB plugins needs pymongo, snappy and monary
+        from pax.plugins.io.MongoDB import MongoDBClearUntriggered, load_acquisition_monitor_pulses
+        self.load_acquisition_monitor_pulses = load_acquisition_monitor_pulses
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, 'acquisition_monitor_data.pickles')
+
+        # Make a clear untriggered plugin without connecting to any database
+        p = MongoDBClearUntriggered.__new__(MongoDBClearUntriggered)
+        p.log = logging.getLogger('MongoDBClearUntriggered')
+        p.actually_delete = True
+        p.already_rescued_collections = []
+        p.failed_rescues = []
+        p.aqm_module = 42
+        p.input_info = {'compressed': True}
+        p.rescue_chunk_size = 3
+        p.rescue_stats = defaultdict(float)
+        p.executor = ThreadPoolExecutor(max_workers=5)
+        p.rescue_executor = ThreadPoolExecutor(max_workers=1)
+        p.aqm_output_handle = open(self.filename, mode='wb')
+        p.write_aqm_header()
+        self.plugin = p
+
+    def tearDown(self):
+        self.plugin.executor.shutdown()
+        self.plugin.rescue_executor.shutdown()
+        self.plugin.aqm_output_handle.close()
+        shutil.rmtree(self.tempdir)
+
+    def test_rescue(self):
+        docs = [dict(module=42 if i % 2 else 0, channel=i % 8, time=1000 * i,
+                     data=snappy.compress(b'\x01\x00' * i)) for i in range(20)]
+        coll = FakeCollection(docs)
+        self.plugin.dbs = [FakeDB(coll=coll)]
+        self.plugin.aqm_db = self.plugin.dbs[0]
+
+        self.plugin.drop_collection_named('coll', self.plugin.executor)
+        self.plugin.executor.shutdown()
+        self.assertTrue(coll.dropped)
+        self.plugin.aqm_output_handle.close()
+
+        rescued = list(self.load_acquisition_monitor_pulses(self.filename))
+        self.assertEqual(len(rescued), 10)
+        for d, r in zip([d for d in docs if d['module'] == 42], rescued):
+            self.assertEqual(r['module'], 42)
+            self.assertEqual(r['channel'], d['channel'])
+            self.assertEqual(r['time'], d['time'])
+            self.assertEqual(r['data'], snappy.decompress(d['data']))
+        self.assertEqual(self.plugin.rescue_stats['pulses'], 10)
+
+    def test_failed_rescue(self):
+        coll = BrokenCollection([])
+        self.plugin.dbs = [FakeDB(coll=coll)]
+        self.plugin.aqm_db = self.plugin.dbs[0]
+
+        self.plugin.drop_collection_named('coll', self.plugin.executor)
+        self.plugin.executor.shutdown()
+        self.assertFalse(coll.dropped)
+
+        # The collection can be rescued again, and shutdown will raise before dropping remaining collections
+        self.assertEqual(self.plugin.already_rescued_collections, [])
+        self.assertEqual([name for name, _ in self.plugin.failed_rescues], ['coll'])
+        with self.assertRaises(RuntimeError):
+            self.plugin.raise_failed_rescues()
+
+        # The acquisition monitor file is still closed at shutdown
+        with self.assertRaises(RuntimeError):
+            self.plugin.shutdown()
+        self.assertTrue(self.plugin.aqm_output_handle.closed)
+        self.assertEqual(list(self.load_acquisition_monitor_pulses(self.filename)), [])
+
+    def test_old_file_format(self):
+        # Files with a plain string header hold pickled pulse documents, not column chunks
+        with open(self.filename, mode='wb') as f:
+            f.write(pickle.dumps("Pax rules!"))
+            f.write(pickle.dumps(dict(module=42, channel=1, time=0, data=b'')))
+        with self.assertRaises(ValueError):
+            list(self.load_acquisition_monitor_pulses(self.filename))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+import logging
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+class FakeGetPulses(object):
+    """Stand-in for get_pulses which takes latency seconds, and keeps track of how many queries run at once"""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+
+    def __call__(self, batch_i, host):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(self.latency)
+        with self.lock:
+            self.running -= 1
+        return batch_i, host
+
+
+def make_batches(n, hosts=('eb0', 'eb1')):
+    return [dict(queries=[dict(batch_i=i, host=host) for host in hosts], batch_i=i) for i in range(n)]
+
+
+class TestPrefetch(unittest.TestCase):
+
+    def setUp(self):
+        # Importing the MongoDB plugins needs pymongo, snappy and monary
+        from pax.plugins.io.MongoDB import prefetch_in_order
+        self.prefetch_in_order = prefetch_in_order
+
+    def test_order(self):
+        fetch = FakeGetPulses(0.01)
+        with ThreadPoolExecutor(max_workers=20) as executor:
+            result = list(self.prefetch_in_order(make_batches(20), fetch, executor, max_in_flight=5))
+        self.assertEqual([batch['batch_i'] for batch, _ in result], list(range(20)))
+        for batch, results in result:
+            self.assertEqual(results, [(batch['batch_i'], 'eb0'), (batch['batch_i'], 'eb1')])
+        # At most max_in_flight batches with two hosts each are queried at once
+        self.assertLessEqual(fetch.max_running, 10)
+        self.assertGreater(fetch.max_running, 2)
+
+    def test_overlap(self):
+        # Querying and triggering take 0.05 sec per batch each: they should overlap
+        n, latency = 10, 0.05
+        fetch = FakeGetPulses(latency)
+        t0 = time.time()
+        with ThreadPoolExecutor(max_workers=20) as executor:
+            for batch, results in self.prefetch_in_order(make_batches(n), fetch, executor, max_in_flight=2):
+                time.sleep(latency)
+        self.assertLess(time.time() - t0, 1.5 * n * latency)
+
+    def test_no_data_yet(self):
+        # If batches yields None, all batches already submitted must be done before it is asked for more.
+        done = []
+
+        def batches():
+            for batch in make_batches(3):
+                yield batch
+            yield None
+            self.assertEqual(done, [0, 1, 2])
+            for batch in make_batches(5)[3:]:
+                yield batch
+
+        with ThreadPoolExecutor(max_workers=20) as executor:
+            for batch, results in self.prefetch_in_order(batches(), FakeGetPulses(0.01), executor, max_in_flight=10):
+                done.append(batch['batch_i'])
+        self.assertEqual(done, list(range(5)))
+
+
+class FakeTrigger(object):
+    """Stand-in for the trigger, which records the plugin's last_time_searched whenever it gets new data"""
+
+    def __init__(self, plugin):
+        self.plugin = plugin
+        self.seen = []
+
+    def run(self, last_time_searched, **kwargs):
+        self.seen.append((last_time_searched, self.plugin.last_time_searched))
+        return []
+
+    def shutdown(self):
+        return {}
+
+
+class TestReadUntriggered(unittest.TestCase):
+
+    def setUp(self):
+        # Importing the MongoDB plugins needs pymongo, snappy and monary
+        from pax.plugins.io import MongoDB
+        self.MongoDB = MongoDB
+        self.get_pulses = MongoDB.get_pulses
+        MongoDB.get_pulses = self.fake_get_pulses
+
+    def tearDown(self):
+        self.MongoDB.get_pulses = self.get_pulses
+
+    @staticmethod
+    def fake_get_pulses(**kwargs):
+        time.sleep(0.01)
+        return tuple([np.zeros(0, dtype=np.int64)] * 4)
+
+    def test_last_time_searched(self):
+        # Make a read untriggered plugin for a finished run with 10 batch windows of data, without a database
+        p = self.MongoDB.MongoDBReadUntriggered.__new__(self.MongoDB.MongoDBReadUntriggered)
+        p.log = logging.getLogger('MongoDBReadUntriggered')
+        p.config = dict(skip_ahead=0, can_get_area=False, delete_data=False, prefetch_batches=5)
+        p.processor = type('FakeProcessor', (object,), dict(config={'DEFAULT': {}}))
+        p.cm = type('FakeClientMaker', (object,), dict(config={}))
+        p.refresh_run_info = lambda: None
+        p.data_taking_ended = True
+        p.secret_mode = True
+        p.uri_for_monitor = 'nowhere'
+        p.batch_window = 100
+        p.sample_duration = 10
+        p.last_pulse_time = 1000
+        p.initial_start_time = 0
+        p.max_query_workers = 4
+        p.hosts = ['eb0']
+        p.split_hosts = False
+        p.split_collections = False
+        p.run_doc = {'name': 'run'}
+        p.input_info = {}
+        p.trigger = FakeTrigger(p)
+
+        self.assertEqual(list(p.get_events()), [])
+        # The batches are planned ahead, but last_time_searched (reported in the pipeline status) only advances
+        # once the trigger gets a batch
+        self.assertEqual([t for t, _ in p.trigger.seen], [100 * (i + 1) for i in range(len(p.trigger.seen))])
+        self.assertGreater(len(p.trigger.seen), 10)
+        for t, last_time_searched in p.trigger.seen:
+            self.assertEqual(t, last_time_searched)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,7 +3,9 @@ import unittest
 import numpy as np
 from numpy import testing as np_testing
 
-from pax.plugins.peak_processing.BasicProperties import integrate_until_fraction, put_w_in_center_of_field
+from pax import datastructure
+from pax.plugins.peak_processing.BasicProperties import integrate_until_fraction, put_w_in_center_of_field, \
+    CountCoincidentNoisePulses
 
 
 class TestPeakProperties(unittest.TestCase):
@@ -22,6 +24,26 @@ class TestPeakProperties(unittest.TestCase):
         integrate_until_fraction(w, fractions_desired, result)
         np_testing.assert_almost_equal(result, fractions_desired, decimal=4)
 
+    def test_count_coincident_noise_pulses(self):
+        np.random.seed(0)
+        pulses = []
+        for i in range(200):
+            left = np.random.randint(0, 10000)
+            pulses.append(datastructure.Pulse(channel=0, left=left, right=left + np.random.randint(0, 100),
+                                              n_hits_found=np.random.randint(0, 2)))
+        peaks = []
+        for i in range(50):
+            left = np.random.randint(0, 10000)
+            peaks.append(datastructure.Peak(left=left, right=left + np.random.randint(0, 1000)))
+        event = datastructure.Event(n_channels=1, start_time=0, stop_time=int(1e6), sample_duration=10,
+                                    pulses=pulses, peaks=peaks)
+
+        event = CountCoincidentNoisePulses({}, processor=None).transform_event(event)
+        for peak in event.peaks:
+            self.assertEqual(peak.n_noise_pulses, len([p for p in pulses
+                                                       if p.n_hits_found == 0 and
+                                                       p.left <= peak.right and p.right >= peak.left]))
+
     def test_store_waveform(self):
         field = np.zeros(5)
         put_w_in_center_of_field(np.ones(3), field, 0)
@@ -9,8 +9,12 @@ Tests for `pax` module.
 """
 import unittest
 
+import numpy as np
+
 from pax import core, plugin
 from pax.datastructure import Event, Peak
+from pax.plugins.posrec.MaxPMT import PosRecMaxPMT
+from pax.plugins.posrec.WeightedSum import PosRecWeightedSum
 
 
 class TestPosRecWeightedSum(unittest.TestCase):
@@ -37,5 +41,52 @@ class TestPosRecWeightedSum(unittest.TestCase):
         self.assertEqual(self.posrec_plugin.__class__.__name__, 'PosRecWeightedSum')
 
 
+class TestPosRecFromHitpatternSummary(unittest.TestCase):
+
+    def setUp(self):
+        # Three top pmts and one bottom pmt, no processor or data files needed
+        locations = [(12.3, -4.5), (-7.1, 0.2), (3.3, 9.9), (0, 0)]
+        self.config = dict(channels_top=[0, 1, 2],
+                           channels_in_detector={'tpc': [0, 1, 2, 3]},
+                           pmts=[{'position': {'x': x, 'y': y}} for x, y in locations])
+        self.locations = np.array(locations)
+
+    def example_event(self, hitpatterns):
+        e = Event.empty_event()
+        for hitpattern in hitpatterns:
+            e.peaks.append(Peak({'left': 5,
+                                 'right': 9,
+                                 'type': 's2',
+                                 'detector': 'tpc',
+                                 'area_per_channel': np.array(hitpattern, dtype=np.float64)}))
+        return e
+
+    def test_posrec(self):
+        hitpatterns = [[0, 3.7, 0, 10], [1, 2, 0.5, 0], [0, 0, 0, 5]]
+        max_pmt = PosRecMaxPMT(self.config, processor=None)
+        weighted_sum = PosRecWeightedSum(self.config, processor=None)
+        e = weighted_sum.transform_event(max_pmt.transform_event(self.example_event(hitpatterns)))
+
+        for peak, hitpattern in zip(e.peaks, hitpatterns):
+            max_pmt_position, weighted_sum_position = peak.reconstructed_positions
+            self.assertEqual(max_pmt_position.algorithm, 'PosRecMaxPMT')
+            self.assertEqual(weighted_sum_position.algorithm, 'PosRecWeightedSum')
+            if not sum(hitpattern[:3]):
+                # No area in the top pmts: both give up
+                self.assertTrue(np.isnan(max_pmt_position.x))
+                self.assertTrue(np.isnan(weighted_sum_position.x))
+                continue
+            np.testing.assert_array_equal([max_pmt_position.x, max_pmt_position.y],
+                                          self.locations[np.argmax(hitpattern[:3])])
+            np.testing.assert_almost_equal([weighted_sum_position.x, weighted_sum_position.y],
+                                           np.average(self.locations[:3], weights=hitpattern[:3], axis=0))
+
+        # The summary of the peak's hitpattern is passed explicitly, so plugins can be used outside transform_event
+        summary = e.get_hitpattern_summary(max_pmt.pmts, max_pmt.pmt_locations)
+        np.testing.assert_array_equal(
+            max_pmt.reconstruct_position(e.peaks[0], {key: values[0] for key, values in summary.items()}),
+            self.locations[1])
+
+
 if __name__ == '__main__':
     unittest.main()
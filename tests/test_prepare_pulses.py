@@ -0,0 +1,96 @@
+import unittest
+
+import numpy as np
+
+from pax import datastructure, exceptions
+from pax.plugins.signal_processing.PulseProperties import PreparePulses, PulseProperties, compute_pulse_properties
+from pax.plugins.signal_processing.CheckPulses import SortPulses, ConcatenateAdjacentPulses, CheckBoundsAndCount
+
+
+class TestPreparePulses(unittest.TestCase):
+
+    def setUp(self):
+        self.config = dict(n_channels=10,
+                           sample_duration=10,
+                           digitizer_reference_baseline=16000,
+                           baseline_samples=5,
+                           concatenate_adjacent_pulses=True,
+                           truncate_pulses_partially_outside=True,
+                           allow_pulse_completely_outside=True)
+
+    def make_event(self, pulse_bounds, stop_time=int(1e6)):
+        return datastructure.Event(n_channels=self.config['n_channels'],
+                                   start_time=0,
+                                   sample_duration=self.config['sample_duration'],
+                                   stop_time=stop_time,
+                                   pulses=[datastructure.Pulse(channel=ch, left=l, right=r,
+                                                               raw_data=16000 - np.arange(r - l + 1, dtype=np.int16))
+                                           for ch, l, r in pulse_bounds])
+
+    def test_sort_and_concatenate(self):
+        plugin = PreparePulses(self.config, processor=None)
+        e = plugin.transform_event(self.make_event([(2, 0, 9), (1, 10, 19), (1, 0, 9), (1, 30, 39), (1, 20, 24)]))
+        self.assertEqual([[p.channel, p.left, p.right] for p in e.pulses],
+                         [[1, 0, 24], [1, 30, 39], [2, 0, 9]])
+        np.testing.assert_array_equal(e.pulses[0].raw_data,
+                                      np.concatenate([16000 - np.arange(10), 16000 - np.arange(10),
+                                                      16000 - np.arange(5)]))
+        self.assertEqual(e.n_pulses, 3)
+        self.assertEqual(e.n_pulses_per_channel.tolist(), [0, 2, 1, 0, 0, 0, 0, 0, 0, 0])
+
+        # Pulse properties are as computed by compute_pulse_properties
+        for p in e.pulses:
+            expected = compute_pulse_properties(16000 - p.raw_data.astype(np.float64), 5)
+            self.assertEqual((p.baseline, p.baseline_increase, p.noise_sigma, p.minimum, p.maximum), expected)
+
+        self.config['concatenate_adjacent_pulses'] = False
+        plugin = PreparePulses(self.config, processor=None)
+        e = plugin.transform_event(self.make_event([(2, 0, 9), (1, 10, 19), (1, 0, 9)]))
+        self.assertEqual([[p.channel, p.left, p.right] for p in e.pulses],
+                         [[1, 0, 9], [1, 10, 19], [2, 0, 9]])
+
+    def test_bounds(self):
+        # Event is 100 samples long
+        plugin = PreparePulses(self.config, processor=None)
+        e = plugin.transform_event(self.make_event([(1, -5, 9), (2, 90, 109), (3, 200, 209), (4, 10, 19)],
+                                                   stop_time=1000))
+        self.assertEqual([[p.channel, p.left, p.right, len(p.raw_data)] for p in e.pulses],
+                         [[1, 0, 9, 10], [2, 90, 99, 10], [4, 10, 19, 10]])
+        self.assertEqual(e.n_pulses, 3)
+
+        self.config['allow_pulse_completely_outside'] = False
+        plugin = PreparePulses(self.config, processor=None)
+        with self.assertRaises(exceptions.PulseBeyondEventError):
+            plugin.transform_event(self.make_event([(3, 200, 209)], stop_time=1000))
+
+    def test_same_as_separate_plugins(self):
+        rs = np.random.RandomState(0)
+        prepare_pulses = PreparePulses(self.config, processor=None)
+        plugins = [plugin_class(self.config, processor=None)
+                   for plugin_class in (SortPulses, ConcatenateAdjacentPulses, PulseProperties, CheckBoundsAndCount)]
+        for _ in range(20):
+            pulse_bounds = []
+            for _ in range(20):
+                channel, left = rs.randint(0, self.config['n_channels']), rs.randint(-20, 120)
+                if rs.uniform() < 0.3 and len(pulse_bounds):
+                    # Directly after the previous pulse
+                    channel, left = pulse_bounds[-1][0], pulse_bounds[-1][2] + 1
+                pulse_bounds.append((channel, left, left + rs.randint(0, 20)))
+            pulse_bounds = [b for b in pulse_bounds if b[2] > -10]
+
+            e = prepare_pulses.transform_event(self.make_event(pulse_bounds, stop_time=1000))
+            should_get = self.make_event(pulse_bounds, stop_time=1000)
+            for plugin in plugins:
+                should_get = plugin.transform_event(should_get)
+
+            self.assertEqual(len(e.pulses), len(should_get.pulses))
+            for p1, p2 in zip(e.pulses, should_get.pulses):
+                self.assertEqual((p1.channel, p1.left, p1.right, p1.baseline, p1.noise_sigma),
+                                 (p2.channel, p2.left, p2.right, p2.baseline, p2.noise_sigma))
+                np.testing.assert_array_equal(p1.raw_data, p2.raw_data)
+            np.testing.assert_array_equal(e.n_pulses_per_channel, should_get.n_pulses_per_channel)
+            self.assertEqual(e.n_pulses, should_get.n_pulses)
+
+
+if __name__ == '__main__':
+    unittest.main()
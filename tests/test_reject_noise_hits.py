@@ -0,0 +1,112 @@
+import unittest
+
+import numpy as np
+
+from pax import datastructure
+from pax.plugins.peak_processing.RejectNoiseHits import RejectNoiseHits
+
+
+def reject_noise_hits_peak_by_peak(plugin, event):
+    """Reference implementation of RejectNoiseHits.transform_event: decide which channels to reject for each peak
+    in turn, collecting the rejected hits one by one."""
+    penalty_per_ch = event.noise_pulses_in * plugin.config['penalty_per_noise_pulse']
+
+    for lone_hit_peak in event.get_peaks_by_type(desired_type='lone_hit', detector='all'):
+        channel = lone_hit_peak.hits[0]['channel']
+        event.lone_hits_per_channel_before[channel] += 1
+        penalty_per_ch[channel] += plugin.config['penalty_per_lone_hit']
+
+    for channel, penalty in plugin.base_penalties.items():
+        penalty_per_ch[channel] += penalty
+
+    suspicious_channels = np.where(penalty_per_ch >= plugin.config['penalty_geq_this_is_suspicious'])[0]
+    event.is_channel_suspicious[suspicious_channels] = True
+
+    peaks_to_delete = []
+    rejected_hits = []
+    for peak_i, peak in enumerate(event.peaks):
+        suspicious_channels_in_peak = np.intersect1d(peak.contributing_channels, suspicious_channels)
+        if len(suspicious_channels_in_peak) == 0:
+            continue
+        witness_area = np.sum(peak.area_per_channel[True ^ event.is_channel_suspicious])
+        channels_to_reject = [ch for ch in suspicious_channels_in_peak if penalty_per_ch[ch] > witness_area]
+        if len(channels_to_reject) == 0:
+            continue
+        cut = np.in1d(peak.hits['channel'], channels_to_reject)
+        for hit_i in np.where(cut)[0]:
+            rejected_hits.append(peak.hits[hit_i])
+            event.n_hits_rejected[peak.hits[hit_i]['channel']] += 1
+        if np.all(cut):
+            peaks_to_delete.append(peak_i)
+        else:
+            event.peaks[peak_i] = plugin.build_peak(hits=peak.hits[True ^ cut], detector=peak.detector)
+
+    event.peaks = [p for i, p in enumerate(event.peaks) if i not in peaks_to_delete]
+
+    for peak in event.peaks:
+        if peak.n_contributing_channels == 1:
+            event.lone_hits_per_channel[peak.lone_hit_channel] += 1
+
+    if len(rejected_hits):
+        rejected_hits = np.array(rejected_hits)
+        rejected_hits['is_rejected'] = True
+        event.all_hits = np.concatenate([rejected_hits] + [p.hits for p in event.peaks])
+
+    return event
+
+
+class TestRejectNoiseHits(unittest.TestCase):
+
+    def setUp(self):
+        self.n_channels = 20
+        self.plugin = RejectNoiseHits(dict(n_channels=self.n_channels,
+                                           penalty_per_noise_pulse=1,
+                                           penalty_per_lone_hit=1,
+                                           penalty_geq_this_is_suspicious=3,
+                                           base_penalties={'5': 3, '6': 10}),
+                                      processor=None)
+
+    def make_event(self, seed):
+        """Return event with random peaks: lone hits in a few noisy channels, and small and large peaks"""
+        rs = np.random.RandomState(seed)
+        event = datastructure.Event(n_channels=self.n_channels,
+                                    start_time=0,
+                                    sample_duration=10,
+                                    stop_time=int(1e6))
+        event.noise_pulses_in = rs.randint(0, 3, size=self.n_channels).astype(np.int16)
+        for peak_i in range(30):
+            if rs.uniform() < 0.4:
+                channels = [rs.choice([0, 1, 2, 5])]
+            else:
+                channels = rs.randint(0, self.n_channels, size=rs.randint(2, 15))
+            hits = np.zeros(len(channels), dtype=datastructure.Hit.get_dtype())
+            hits['channel'] = channels
+            hits['left'] = 1000 * peak_i + rs.randint(0, 50, size=len(hits))
+            hits['right'] = hits['left'] + 10
+            hits['index_of_maximum'] = hits['left'] + 5
+            hits['area'] = 10 ** rs.uniform(-1, 1.5, size=len(hits))
+            if len(hits) > 2:
+                # Hits with negative area don't make a channel contribute
+                hits['area'][0] = -1
+            event.peaks.append(self.plugin.build_peak(hits=hits, detector='tpc'))
+        event.all_hits = np.concatenate([p.hits for p in event.peaks])
+        return event
+
+    def test_matches_peak_by_peak(self):
+        for seed in range(5):
+            result = self.plugin.transform_event(self.make_event(seed))
+            should_get = reject_noise_hits_peak_by_peak(self.plugin, self.make_event(seed))
+
+            self.assertGreater(should_get.n_hits_rejected.sum(), 0)
+            for field_name in ('lone_hits_per_channel_before', 'lone_hits_per_channel',
+                               'is_channel_suspicious', 'n_hits_rejected', 'all_hits'):
+                np.testing.assert_array_equal(getattr(result, field_name), getattr(should_get, field_name))
+            self.assertEqual(len(result.peaks), len(should_get.peaks))
+            for p1, p2 in zip(result.peaks, should_get.peaks):
+                np.testing.assert_array_equal(p1.hits, p2.hits)
+                self.assertEqual(p1.type, p2.type)
+                self.assertEqual(p1.area, p2.area)
+
+
+if __name__ == '__main__':
+    unittest.main()
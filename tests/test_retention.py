@@ -0,0 +1,155 @@
+import gc
+import os
+import shutil
+import tempfile
+import unittest
+import weakref
+
+import numpy as np
+
+from pax import retention
+from pax.datastructure import Event, Peak, Pulse
+from pax.plugins.DeleteLowLevelInfo import DeleteLowLevelInfo
+from pax.plugins.io.Table import TableWriter
+
+
+class FakeProcessor(object):
+    config = {'BasicProperties.SumWaveformProperties': dict(peak_waveform_length=990)}
+
+    def get_metadata(self):
+        return dict(configuration={})
+
+
+class FakePlugin(object):
+
+    def __init__(self, name, uses_low_level_data):
+        self.name = name
+        self.uses_low_level_data = uses_low_level_data
+
+
+def make_event():
+    e = Event.empty_event()
+    e.pulses = [Pulse(channel=0, left=0, raw_data=np.zeros(1000, dtype=np.int16)) for _ in range(10)]
+    e.all_hits = np.zeros(100, dtype=e.all_hits.dtype)
+    for i, (area, peak_type) in enumerate([(10, 's1'), (5, 's2'), (1, 'unknown'), (20, 's2')]):
+        e.peaks.append(Peak(area=area, type=peak_type, detector='tpc',
+                            hits=e.all_hits[10 * i:10 * (i + 1)],
+                            area_per_channel=np.ones(100, dtype=np.float64),
+                            sum_waveform=np.ones(100, dtype=np.float32)))
+    return e
+
+
+class TestRetention(unittest.TestCase):
+
+    def test_release_after_last_user(self):
+        plugins = [FakePlugin('A', None),
+                   FakePlugin('B', ('raw_data', 'hits')),
+                   FakePlugin('C', ('hits',)),
+                   FakePlugin('D', ())]
+        policy = retention.RetentionPolicy(plugins, budget=1000)
+        self.assertEqual(dict(policy.release_after), {1: ['raw_data'], 2: ['hits'], 0: ['peak_arrays']})
+
+        e = make_event()
+        sizes = retention.low_level_data_size(e)
+        self.assertEqual(sizes['raw_data'], 10 * 1000 * 2)
+
+        policy.after_plugin(1, e)
+        self.assertEqual(sum([len(p.raw_data) for p in e.pulses]), 0)
+        self.assertEqual(len(e.pulses), 10)
+        self.assertEqual(len(e.all_hits), 100)
+        self.assertEqual(policy.bytes_released['raw_data'], sizes['raw_data'])
+
+        policy.after_plugin(2, e)
+        self.assertEqual(len(e.all_hits), 0)
+        # The largest S1 and S2s keep their hits, as copies
+        self.assertEqual([len(p.hits) for p in e.peaks], [10, 10, 0, 10])
+        self.assertIsNone(e.peaks[0].hits.base)
+
+        # Events below the budget are untouched
+        policy = retention.RetentionPolicy(plugins, budget=1e9)
+        e = make_event()
+        policy.after_plugin(1, e)
+        self.assertEqual(len(e.pulses[0].raw_data), 1000)
+
+    def test_memory_use(self):
+        policy = retention.RetentionPolicy([], budget=1000)
+        policy.after_event(make_event())
+        self.assertGreater(policy.peak_rss, 0)
+
+    def test_largest_peak_indices(self):
+        e = make_event()
+        self.assertEqual(retention.largest_peak_indices(e), [0, 3, 1])
+        self.assertEqual(retention.largest_peak_indices(e, n=1), [0, 3])
+
+        # S1s are ranked like in event.s1s(): by tight coincidence first, then area
+        e.peaks.append(Peak(area=1, type='s1', detector='tpc', tight_coincidence=3))
+        self.assertEqual(retention.largest_peak_indices(e, n=1), [4, 3])
+
+    def test_store_freed(self):
+        e = make_event()
+        store = weakref.ref(e.get_peak_store())
+        retention.release_peak_arrays(e, keep=[0])
+        gc.collect()
+        self.assertIsNone(store())
+        self.assertEqual(len(e.peaks[0].area_per_channel), 100)
+
+    def test_delete_low_level_info(self):
+        e = make_event()
+        plugin = DeleteLowLevelInfo(dict(low_level_data_budget=1000), processor=None)
+        e = plugin.transform_event(e)
+        self.assertEqual([len(p.area_per_channel) for p in e.peaks], [100, 100, 0, 100])
+        self.assertEqual([len(p.sum_waveform) for p in e.peaks], [100, 100, 0, 100])
+        # Hits are only kept for the S1
+        self.assertEqual([len(p.hits) for p in e.peaks], [10, 0, 0, 0])
+        self.assertEqual(len(e.all_hits), 0)
+
+    def write_table(self, events):
+        """Write events with TableWriter to a numpy file, return the Peak table"""
+        tempdir = tempfile.mkdtemp()
+        try:
+            output_name = os.path.join(tempdir, 'output')
+            plugin = TableWriter(dict(output_format='numpy',
+                                      output_name=output_name,
+                                      append_data=False,
+                                      overwrite_data=True,
+                                      string_data_length=32,
+                                      buffer_size=50,
+                                      write_in_chunks=True,
+                                      n_channels=100,
+                                      sample_duration=10,
+                                      fields_to_ignore=['sum_waveforms', 'all_hits', 'raw_data']),
+                                 processor=FakeProcessor())
+            for e in events:
+                plugin.write_event(e)
+            plugin.shutdown()
+            return np.load(output_name + '.npz')['Peak']
+        finally:
+            shutil.rmtree(tempdir)
+
+    def test_table_output(self):
+        # The first peak of the first event gets its arrays emptied, the second event is not shrunk
+        e = make_event()
+        e.peaks.insert(0, Peak(area=0.5, type='unknown', detector='tpc'))
+        e = DeleteLowLevelInfo(dict(low_level_data_budget=1000), processor=None).transform_event(e)
+        self.assertEqual(len(e.peaks[0].area_per_channel), 0)
+
+        peaks = self.write_table([e, make_event()])
+        self.assertEqual(len(peaks), 9)
+        self.assertEqual(peaks['area_per_channel'].shape, (9, 100))
+        self.assertEqual(peaks['area_per_channel'].sum(axis=1).tolist(), [0, 100, 100, 0, 100] + [100] * 4)
+
+    def test_table_output_all_released(self):
+        # A large event without S1s or S2s: all its peaks lose their arrays
+        e = make_event()
+        for p in e.peaks:
+            p.type = 'unknown'
+        retention.release_peak_arrays(e, keep=retention.largest_peak_indices(e))
+        self.assertEqual([len(p.sum_waveform) for p in e.peaks], [0] * 4)
+
+        peaks = self.write_table([e, make_event()])
+        self.assertEqual(peaks['area_per_channel'].shape, (8, 100))
+        self.assertEqual(peaks['sum_waveform'].sum(axis=1).tolist(), [0] * 4 + [100] * 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
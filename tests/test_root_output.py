@@ -54,9 +54,35 @@ class TestRootOutput(unittest.TestCase):
                                                  np.array(list(root_peak.area_per_channel)),
                                                  decimal=4)
 
+    def test_released_peak_arrays(self):
+        # Make DeleteLowLevelInfo release the arrays of all but the largest peaks
+        mypax = core.Processor(config_names='XENON100', config_dict={
+            'pax': {'events_to_process': [0],
+                    'output_name': 'test_root_output_released'},
+            'DeleteLowLevelInfo': {'shrink_data_threshold': 0}})
+        mypax.run()
+        n_channels = mypax.config['DEFAULT']['n_channels']
+        del mypax
+
+        f = ROOT.TFile('test_root_output_released.root')
+        t = f.Get('tree')
+        t.GetEntry(0)
+        n_released = 0
+        for root_peak in t.events.peaks:
+            area_per_channel = np.array(list(root_peak.area_per_channel))
+            self.assertEqual(len(area_per_channel), n_channels)
+            if root_peak.area > 0 and np.all(area_per_channel == 0):
+                # The empty array was padded with zeros
+                self.assertTrue(np.all(np.array(list(root_peak.sum_waveform)) == 0))
+                n_released += 1
+            else:
+                self.assertAlmostEqual(root_peak.area, area_per_channel.sum(), delta=0.0001 * max(1, root_peak.area))
+        self.assertGreater(n_released, 0)
+        f.Close()
+
     def tearDown(self):
-        if os.path.exists('test_root_output.root'):
-            os.remove('test_root_output.root')
+        for fn in glob.glob('test_root_output*.root'):
+            os.remove(fn)
         for fn in glob.glob('pax_event_class*'):
             os.remove(fn)
 
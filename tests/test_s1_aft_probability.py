@@ -0,0 +1,42 @@
+import unittest
+
+import numpy as np
+
+from pax.plugins.interaction_processing.S1AreaFractionTopProbability import \
+    s1_area_fraction_top_probability, s1_area_fraction_top_probabilities, binom_test, binom_test_array
+
+
+class TestS1AreaFractionTopProbability(unittest.TestCase):
+
+    def test_binom_test(self):
+        np.random.seed(0)
+        n = np.random.randint(1, 2000, size=500).astype(np.float64)
+        k = np.floor(np.random.uniform(0, 1, size=500) * (n + 1))
+        k = np.minimum(k, n)
+        p = np.random.uniform(0.01, 0.99, size=500)
+        # Include some special cases: k = 0, k = n, non-integer k and n
+        k[:5] = 0
+        k[5:10] = n[5:10]
+        k[10:20] += 0.3
+        n[10:20] += 0.6
+        result = binom_test_array(k, n, p)
+        should_get = np.array([binom_test(k[i], n[i], p[i]) for i in range(len(n))])
+        np.testing.assert_allclose(result, should_get, rtol=1e-10)
+
+    def test_s1_probabilities(self):
+        np.random.seed(1)
+        m = 300
+        aft_prob = np.random.uniform(0.1, 0.6, size=m)
+        area = 10 ** np.random.uniform(0, 3, size=m)
+        aft = np.random.uniform(0, 1, size=m)
+        n_hits = np.round(np.minimum(area, 20) * np.random.uniform(0.5, 1, size=m))
+        hits_fraction_top = np.round(aft * n_hits) / np.maximum(n_hits, 1)
+
+        result = s1_area_fraction_top_probabilities(aft_prob, area, aft, n_hits, hits_fraction_top)
+        should_get = [s1_area_fraction_top_probability(aft_prob[i], area[i], aft[i], n_hits[i], hits_fraction_top[i])
+                      for i in range(m)]
+        np.testing.assert_allclose(result, should_get, rtol=1e-10)
+
+
+if __name__ == '__main__':
+    unittest.main()
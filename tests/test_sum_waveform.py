@@ -0,0 +1,69 @@
+import unittest
+
+import numpy as np
+
+from pax import datastructure, dsputils
+from pax.plugins.signal_processing.SumWaveform import SumWaveform
+
+
+class TestSumWaveform(unittest.TestCase):
+
+    def setUp(self):
+        self.config = dict(n_channels=4,
+                           channels_in_detector={'tpc': [0, 1, 2], 'veto': [3]},
+                           channels_top=[0],
+                           channels_bottom=[1, 2],
+                           gains=[2e6] * 4,
+                           digitizer_reference_baseline=16000,
+                           sample_duration=10,
+                           digitizer_voltage_range=2.25,
+                           digitizer_bits=14,
+                           pmt_circuit_load_resistor=50,
+                           external_amplification=10)
+        self.plugin = SumWaveform(self.config, processor=None)
+
+    def make_event(self, pulses, hits=None):
+        e = datastructure.Event(n_channels=self.config['n_channels'],
+                                start_time=0,
+                                sample_duration=10,
+                                stop_time=1000,
+                                pulses=pulses)
+        if hits is not None:
+            e.all_hits = hits
+        return e
+
+    def test_desaturated_pulse(self):
+        # DesaturatePulses gives float raw data, with amplitudes that may not fit in an int16
+        amplitude = np.array([100, 40000, 50000, 100], dtype=np.float64)
+        pulses = [datastructure.Pulse(channel=1, left=10, right=13, baseline=0,
+                                      raw_data=self.config['digitizer_reference_baseline'] - amplitude),
+                  datastructure.Pulse(channel=0, left=20, right=23, baseline=0,
+                                      raw_data=(16000 - np.array([1, 2, 3, 4])).astype(np.int16))]
+        hits = np.zeros(1, dtype=datastructure.Hit.get_dtype())
+        hits['found_in_pulse'] = 0
+        hits['left'] = 11
+        hits['right'] = 12
+        e = self.plugin.transform_event(self.make_event(pulses, hits))
+
+        adc_to_pe = dsputils.adc_to_pe(self.config, 1)
+        np.testing.assert_allclose(e.get_sum_waveform('tpc_raw').samples[10:14], amplitude * adc_to_pe, rtol=1e-6)
+        np.testing.assert_allclose(e.get_sum_waveform('tpc_bottom').samples[10:14],
+                                   [0, 40000 * adc_to_pe, 50000 * adc_to_pe, 0], rtol=1e-6)
+        np.testing.assert_allclose(e.get_sum_waveform('tpc_raw').samples[20:24],
+                                   np.array([1, 2, 3, 4]) * adc_to_pe, rtol=1e-6)
+        self.assertEqual(e.get_sum_waveform('tpc_top').samples.sum(), 0)
+
+    def test_bounds(self):
+        raw_data = np.ones(10, dtype=np.int16) * 16000
+        with self.assertRaises(ValueError):
+            self.plugin.transform_event(self.make_event([datastructure.Pulse(channel=0, left=95, right=104,
+                                                                             raw_data=raw_data)]))
+        self.config['channels_in_detector']['veto'] = [3, 7]
+        plugin = SumWaveform(self.config, processor=None)
+        with self.assertRaises(IndexError):
+            plugin.transform_event(self.make_event([datastructure.Pulse(channel=7, left=0, right=9,
+                                                                        raw_data=raw_data)]))
+
+
+if __name__ == '__main__':
+    unittest.main()
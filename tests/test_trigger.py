@@ -9,8 +9,17 @@ from pax.datastructure import TriggerSignal
 from pax.trigger_plugins.FindSignals import signal_finder
 from pax.trigger_plugins.SaveSignals import group_signals
 from pax.trigger_plugins.DeadTimeTally import DeadTimeTally
+from pax.trigger_plugins.SortData import SortData, merge_sorted_streams
 from pax.exceptions import TriggerGroupSignals
+import os
+import shutil
 import tempfile
+import threading
+import time
+import zipfile
+import zlib
+
+import bson
 
 
 class TestSignalFinder(unittest.TestCase):
@@ -131,6 +140,128 @@ class TestGroupTriggers(unittest.TestCase):
         np.testing.assert_array_equal(data.event_ranges,
                                       np.array([[0, 1], [4, 5], [10, 10]], dtype=np.int))
 
+        # Test truncation of too long events
+        tp = GroupTriggers(trig, dict(event_separation=3,
+                                      max_event_length=0,
+                                      left_extension=0,
+                                      right_extension=0))
+        tp.process(data)
+        np.testing.assert_array_equal(data.event_ranges,
+                                      np.array([[0, 0], [4, 4], [10, 10]], dtype=np.int))
+        self.assertEqual(data.batch_info_doc['truncated_events'], 2)
+        self.assertEqual(data.batch_info_doc['dead_time_due_to_truncation'], 2)
+
+
+class TestMergeSortedStreams(unittest.TestCase):
+
+    def test_merge(self):
+        np.random.seed(0)
+        pmt_lookup = np.arange(20, dtype=np.int64).reshape(2, 10)
+        # Some empty streams, and streams with many equal times
+        lengths = [0, 100, 1, 0, 1000, 37]
+        times = [np.sort(np.random.randint(0, 200, n)).astype(np.int64) for n in lengths]
+        channels = [np.random.randint(0, 10, n).astype(np.int64) for n in lengths]
+        modules = [np.random.randint(0, 2, n).astype(np.int64) for n in lengths]
+        areas = [np.random.rand(n) for n in lengths]
+
+        n = sum(lengths)
+        pulse_times = np.zeros(n, dtype=np.int64)
+        pulse_pmts = np.zeros(n, dtype=np.int64)
+        pulse_areas = np.zeros(n, dtype=np.float64)
+        stream_start = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        merge_sorted_streams(np.concatenate(times), np.concatenate(channels), np.concatenate(modules),
+                             np.concatenate(areas), stream_start, True, True, pmt_lookup, 20,
+                             pulse_times, pulse_pmts, pulse_areas)
+
+        # Result should be the same as a stable sort of the concatenated streams
+        sort_order = np.argsort(np.concatenate(times), kind='mergesort')
+        np.testing.assert_array_equal(pulse_times, np.concatenate(times)[sort_order])
+        np.testing.assert_array_equal(pulse_areas, np.concatenate(areas)[sort_order])
+        np.testing.assert_array_equal(pulse_pmts,
+                                      (10 * np.concatenate(modules) + np.concatenate(channels))[sort_order])
+
+    def test_sort_data_presorted(self):
+        class FakeTrigger(object):
+            pax_config = dict(DEFAULT=dict(pmts=[dict(pmt_position=i, digitizer=dict(module=i // 2, channel=i % 2))
+                                                 for i in range(4)]))
+        plugin = SortData(trigger=FakeTrigger(), config={})
+
+        times = [np.array([1, 5, 9]), np.array([], dtype=np.int64), np.array([2, 5])]
+        data = trigger.TriggerData()
+        data.input_data = dict(start_times=times, channels=[[0, 1, 0], [], [1, 1]], modules=[[0, 0, 1], [], [1, 0]],
+                               areas=None, presorted=True)
+        plugin.process(data)
+        self.assertEqual(data.pulses['time'].tolist(), [1, 2, 5, 5, 9])
+        self.assertEqual(data.pulses['pmt'].tolist(), [0, 3, 1, 1, 2])
+
+        # Without pmt information, or any streams
+        for times in ([np.array([3, 4]), np.array([1])], []):
+            data = trigger.TriggerData()
+            data.input_data = dict(start_times=times, channels=None, modules=None, areas=None, presorted=True)
+            plugin.process(data)
+            self.assertEqual(data.pulses['time'].tolist(), sorted(np.concatenate([[]] + times).tolist()))
+            self.assertTrue(np.all(data.pulses['pmt'] == 4))
+
+
+class FakeCollection(object):
+    """Stand-in for a pymongo collection, whose inserts block until allow_inserts is set"""
+
+    def __init__(self):
+        self.docs = []
+        self.allow_inserts = threading.Event()
+
+    def insert_many(self, docs, ordered=True):
+        self.allow_inserts.wait()
+        self.docs.extend(docs)
+
+        class InsertManyResult(object):
+            inserted_ids = list(range(len(docs)))
+        return InsertManyResult()
+
+
+class TestTriggerMonitor(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_monitor_writer(self):
+        config = configuration.load_configuration('XENON1T')
+        config['Trigger']['trigger_monitor_file_path'] = os.path.join(self.tempdir, 'trigger_monitor_data.zip')
+        collection = FakeCollection()
+        trig = trigger.Trigger(config, trigger_monitor_collection=collection)
+
+        n_batches = 3
+        big_array = np.arange(5000).reshape(50, 100)
+        for i in range(n_batches):
+            trig.save_monitor_data('big_array', big_array)
+            trig.save_monitor_data('small_array', np.arange(3))
+            # The trigger must not wait for the (blocked) database inserts
+            list(trig.run(last_time_searched=(i + 1) * units.s, start_times=np.zeros(0, dtype=np.int64)))
+        big_array *= 0
+        self.assertEqual(len(collection.docs), 0)
+
+        collection.allow_inserts.set()
+        end_of_run_info = trig.shutdown()
+        self.assertGreaterEqual(end_of_run_info['max_monitor_queue_depth'], 1)
+
+        docs = [trigger.decode_monitor_doc(d) for d in collection.docs]
+        for data_type, n in (('batch_info', n_batches), ('big_array', n_batches), ('small_array', n_batches)):
+            self.assertEqual(len([d for d in docs if d['data_type'] == data_type]), n)
+        for d in docs:
+            if d['data_type'] == 'big_array':
+                np.testing.assert_array_equal(d['data'], np.arange(5000).reshape(50, 100))
+            elif d['data_type'] == 'small_array':
+                self.assertEqual(d['data'], [0, 1, 2])
+
+        # The zipfile has the same documents
+        with zipfile.ZipFile(config['Trigger']['trigger_monitor_file_path']) as zf:
+            self.assertEqual(len(zf.namelist()), len(docs))
+            d = trigger.decode_monitor_doc(bson.BSON(zlib.decompress(zf.read('big_array=%012d' % 2))).decode())
+            np.testing.assert_array_equal(d['data'], np.arange(5000).reshape(50, 100))
+
 
 class TestTriggerIntegration(unittest.TestCase):
     """Integration test for the trigger"""
@@ -301,6 +432,24 @@ class TestDeadTimeCalculation(unittest.TestCase):
         # Test a very large interval
         self.assertEqual(self.run_test([0], [13.5 * units.s]), 13.5 * units.s)
 
+        # Test invalid on/off signals are ignored
+        self.assertEqual(self.run_test([0, 5, 100], [10, 110, 120]), 20)
+
+    def test_veto_storm(self):
+        """Synthetic busy storm: many short dead time intervals spread over many batches"""
+        if six.PY2:
+            return
+
+        n_intervals = int(1e5)
+        on_times = np.arange(n_intervals, dtype=np.int64) * int(50 * units.us)
+        off_times = on_times + int(10 * units.us)
+
+        start = time.time()
+        dead_time = self.run_test(on_times, off_times, batch_duration=0.5 * units.s)
+        print("Tallied dead time of %d on/off pulse pairs in %0.3f sec" % (n_intervals, time.time() - start))
+
+        self.assertEqual(dead_time, n_intervals * 10 * units.us)
+
 
 if __name__ == '__main__':
     import sys
@@ -4,6 +4,7 @@ import numpy as np
 
 from pax.datastructure import Event, Pulse
 from pax import core
+from pax.plugins.ZLE import zle_event
 
 
 class TestZLE(unittest.TestCase):
@@ -59,5 +60,44 @@ class TestZLE(unittest.TestCase):
                 self.assertEqual(e.pulses[i].raw_data.tolist(), w[l:r + 1].tolist())
 
 
+class TestZLEEvent(unittest.TestCase):
+
+    def zle(self, waveforms, two_sample_words, max_intervals=32, before=50, after=50):
+        """Return (pulse, start, stop) regions to store for waveforms (in ADC counts above baseline)"""
+        raw_data = np.concatenate([1000 - np.array(w, dtype=np.int16) for w in waveforms])
+        pulse_start = np.cumsum([0] + [len(w) for w in waveforms]).astype(np.int64)
+        result_buffer = np.zeros((100, 3), dtype=np.int64)
+        n_found = zle_event(raw_data, pulse_start,
+                            1000 * np.ones(len(waveforms)), 41 * np.ones(len(waveforms)),
+                            -1, before, after, max_intervals, two_sample_words, result_buffer)
+        return result_buffer[:n_found].tolist()
+
+    def test_zle_event(self):
+        for w, sample_regions, word_regions in (
+            ([60, 60],                                         [[0, 1]],                 [[0, 1]]),
+            ([1] * 100 + [60] + [2] * 100,                     [[50, 149]],              [[50, 151]]),
+            ([1] * 101 + [60] + [2] * 100,                     [[52, 151]],              [[50, 151]]),
+            ([1] * 100 + [30] + [2] * 100,                     [],                       []),
+            ([1] * 100 + [60] + [2] * 200 + [60] + [3] * 100,  [[50, 149], [252, 351]],  [[50, 151], [250, 351]]),
+        ):
+            for two_sample_words, regions in ((False, sample_regions), (True, word_regions)):
+                # Second pulse has no data to store
+                self.assertEqual(self.zle([w, [0] * 10], two_sample_words),
+                                 [[0, left, right] for left, right in regions])
+
+    def test_no_whole_word(self):
+        # Regions which don't contain a whole word after truncation are not stored
+        self.assertEqual(self.zle([[0, 60, 0, 0], [60], [0, 60, 60, 0]], False, before=0, after=0), [])
+        self.assertEqual(self.zle([[0, 60, 0, 0], [60], [60, 60, 0, 0]], False, before=0, after=0),
+                         [[2, 0, 1]])
+        self.assertEqual(self.zle([[0, 60, 0, 0], [60]], True, before=0, after=0),
+                         [[0, 0, 1]])
+
+    def test_breakdown(self):
+        w = ([1] * 200 + [60]) * 4 + [1] * 100
+        self.assertEqual(self.zle([w], False, max_intervals=2),
+                         [[0, 150, 249], [0, 352, 451], [0, 552, len(w) - 1]])
+
+
 if __name__ == '__main__':
     unittest.main()